@@ -1,67 +1,147 @@
 from lib.bigearthnetv2_lib import *
+import argparse
 
 '''
 This script can be used to transform the TIFF files of the three RGB 
 bands of a patch into a PNG file with three bands. The script collects the 
-list of tiles and then processes the patches within each tile. The start tile
-and the end tile can be set in the script. The script creates the PNG files
-for the images and for the masks.
+list of tiles and then processes the patches within each tile. The tiles are
+sorted by name and the start tile and the end tile can be set with the 
+--start-tile and --end-tile options. The script creates the PNG files
+for the images, for the masks and for the masks mapped to the Corine2018 
+level 3 and level 1 classes, reading each patch once. The PNG images are 
+saved in the folder of the patch, the PNG masks in the folder of the 
+reference map, and then they are stored in zip files.
 The script can be executed using the command line from the root
 folder of the dl_remote_sensing project repository with the command
 
 >python bigearthnet_preparation.py data/BigEarthNet-S2
 
+An optional second argument sets the number of worker processes used
+to convert the patches, e.g. 
+
+>python bigearthnet_preparation.py data/BigEarthNet-S2 32
+
+By default all the CPU cores are used. The tiles can be split in shards
+that are processed independently, e.g. on different nodes, with the
+--shard and --num-shards options, e.g. 
+
+>python bigearthnet_preparation.py data/BigEarthNet-S2 32 --shard 1 --num-shards 4
+
+The output files of a shard are saved in data/shard_001_of_004/ and the 
+outputs of all the shards are merged with bigearthnetv2_merge.py into the 
+same files of a single run. The throughput and the estimated
+time to complete are printed every minute. The metrics of each stage, the 
+time spent reading, transforming, encoding and writing, the bytes read and 
+written and the files skipped, are saved in data/bigearthnet_preparation_metrics.json.
+The names of the PNG files in each zip file are saved in a text file with the
+same name, e.g. data/bigearthnet_pngs.txt. With the --archives-only option 
+the files are added to the zip files as soon as they are encoded and they are
+not saved in the patch folders, e.g. 
+
+>python bigearthnet_preparation.py data/BigEarthNet-S2 --archives-only
+
+The files can be encoded with another codec, webp, npy or zstd, and a 
+compression level with the --codec and --compresslevel options, e.g. 
+
+>python bigearthnet_preparation.py data/BigEarthNet-S2 --codec zstd --compresslevel 3
+
+The uint16 masks are always encoded as PNG with the webp codec, that supports 
+only uint8 bands. The encode and decode throughput and the size of the files of 
+each codec are compared by the codecs benchmark of bigearthnetv2_benchmark.py.
+
 This script imports some functions from the bigearthnetv2_lib.py python 
 script in the lib/ subfolder.
 '''
 
-BIGEARTHNETv2_DIR = sys.argv[1]
+parser = argparse.ArgumentParser(description='Creates the PNG files of the BigEarthNet patches.')
+parser.add_argument('dataset_dir', help='folder with the BigEarthNet-S2 and Reference_Maps folders')
+parser.add_argument('num_workers', type=int, nargs='?', default=os.cpu_count(), help='number of worker processes')
+parser.add_argument('--codec', default='png', choices=list(CODEC_EXTENSIONS), help='codec of the images and masks')
+parser.add_argument('--compresslevel', type=int, default=None, help='compression level of the codec')
+parser.add_argument('--archives-only', action='store_true', help='add the files to the zip files without saving them in the patch folders')
+add_shard_arguments(parser)
+args = parser.parse_args()
+
+BIGEARTHNETv2_DIR = args.dataset_dir
 #BIGEARTHNETv2_DIR = 'data/BigEarthNet-S2'
 print('Path to BigEarthNetv2 dataset: {:}'.format(BIGEARTHNETv2_DIR))
+NUM_WORKERS = args.num_workers
+print('Number of worker processes: {:d}'.format(NUM_WORKERS))
 
 IMAGES_DATA_DIR = pathlib.Path(BIGEARTHNETv2_DIR + '/BigEarthNet-S2')
 MASKS_DATA_DIR = pathlib.Path(BIGEARTHNETv2_DIR + '/Reference_Maps')
 
-start_tile_index = 0 
-end_tile_index = 5
+## Scan the dataset folders once and store the list of the files in a
+## manifest. The next runs update only the folders that have changed
+MANIFEST_PATH = BIGEARTHNETv2_DIR + '/bigearthnet_manifest.sqlite'
+listing_metrics = StageMetrics('Listing')
+build_manifest(IMAGES_DATA_DIR, MANIFEST_PATH)
+build_manifest(MASKS_DATA_DIR, MANIFEST_PATH)
+
+## Select the tiles of the shard, sorted by name, and the folder of its output files
+tile_names, OUTPUT_DIR = select_shard(args, list_tile_names(IMAGES_DATA_DIR, MANIFEST_PATH))
+print('Shard {:d} of {:d}: {:d} tiles, output folder {}'.format(args.shard, args.num_shards, len(tile_names), OUTPUT_DIR))
 
 ## Collect the tiles of the images
-tiles_list = list_image_files(IMAGES_DATA_DIR, start_tile_index, end_tile_index)
+tiles_list = list_image_files(IMAGES_DATA_DIR, 0, None, manifest_path=MANIFEST_PATH, tile_names=tile_names)
 #num_rgb_bands = print_images_list(tiles_list)
 
 ## collect the tiles of the masks
-tiles_mask_list = list_mask_files(MASKS_DATA_DIR, start_tile_index, end_tile_index)
+tiles_mask_list = list_mask_files(MASKS_DATA_DIR, 0, None, manifest_path=MANIFEST_PATH, tile_names=tile_names)
 #num_masks = print_masks_list(tiles_mask_list)
 
 num_tiles = len(tiles_list)
+listing_metrics.add({'patches': sum(len(patches_list) for patches_list in tiles_list)})
+listing_metrics.stop()
 
-## Creates the PNG files of the patches within the tiles. The PNG
-## images are saved in the same directory of the patch. The function
-## returns the list of the PNG files created
-print('Creating PNG images')
-pngs_list = createPNGs(tiles_list)
-
-## Creates the PNG files of the masks. The PNG masks are saved in
-## the same directory of the patch. The function
-## returns the list of the PNG files created
-print('Creating PNG masks')
-masks_png_list = createMaskPNGs(tiles_mask_list)
-
-## The PNG images are zipped to be copied to S3
-print('Creating images zip file')
-rgb_zip_file = 'data/bigearthnet_pngs.zip'
-zip_pngs(pngs_list, rgb_zip_file)
-
-## The PNG masks are zipped to be copied to S3
-print('Creating masks zip file')
-masks_zip_file = 'data/bigearthnet_mask_pngs.zip'
-zip_pngs(masks_png_list, masks_zip_file)
+## Creates in one pass the PNG files of the products of the patches 
+## within the tiles: the RGB images, the masks and the masks mapped 
+## to the Corine2018 levels 3 and 1. The PNG images are saved in the 
+## same directory of the patch, the PNG masks in the same directory of
+## the reference map, and then zipped to be copied to S3. With the 
+## --archives-only option the PNG files are not saved in the patch 
+## folders but added to the zip files as soon as they are encoded. 
+## Otherwise the patches completed are recorded in a journal in the 
+## output folder so that a run that is interrupted can be resumed. 
+## The function returns the lists of the PNG files of each product
+PRODUCTS = ['rgb', 'mask', 'l3', 'l1']
+CODECS = {product: args.codec for product in PRODUCTS}
+if (args.codec == 'webp'):
+    CODECS['mask'] = 'png'
+zip_files = {'rgb': OUTPUT_DIR + '/bigearthnet_pngs.zip',
+             'mask': OUTPUT_DIR + '/bigearthnet_mask_pngs.zip',
+             'l3': OUTPUT_DIR + '/bigearthnet_mask_l3_pngs.zip',
+             'l1': OUTPUT_DIR + '/bigearthnet_mask_l1_pngs.zip'}
+export_metrics = StageMetrics('Export')
+if (args.archives_only):
+    print('Creating PNG images and masks zip files')
+    archives = {product: PNGArchiveWriter(zip_files[product]) for product in PRODUCTS}
+    try:
+        product_files = exportPatches(tiles_list, tiles_mask_list, products=PRODUCTS, archives=archives, 
+                                      num_workers=NUM_WORKERS, metrics=export_metrics, codec=CODECS,
+                                      compresslevel=args.compresslevel)
+    finally:
+        for archive in archives.values():
+            archive.close()
+else:
+    print('Creating PNG images and masks')
+    product_files = exportPatches(tiles_list, tiles_mask_list, products=PRODUCTS, num_workers=NUM_WORKERS, 
+                                  metrics=export_metrics, codec=CODECS, compresslevel=args.compresslevel,
+                                  journal_path=os.path.join(OUTPUT_DIR, 'export_journal.jsonl'))
+    for product in PRODUCTS:
+        print('Creating {} zip file'.format(product))
+        zip_pngs(product_files[product], zip_files[product])
+    product_files = {product: [pathlib.Path(png_path).name for png_path in product_files[product]] 
+                     for product in PRODUCTS}
+export_metrics.stop()
+save_metrics([listing_metrics, export_metrics], OUTPUT_DIR + '/bigearthnet_preparation_metrics.json')
+for product in PRODUCTS:
+    with open(zip_files[product][:-4] + '.txt', 'w') as f:
+        f.writelines(png_name + '\n' for png_name in product_files[product])
 
 #unzip_folder = 'zip/'
 #unzip_pngs(target_zip_file, unzip_folder)
 
 print('Number of tiles: {:d}'.format(num_tiles))
-print('Number of RGB bands. {:d}'.format(num_rgb_bands))
-print('Number of masks. {:d}'.format(num_masks))
-print('Number of RGB PNG files: {:d}'.format(len(pngs_list)))
-print('Number of mask PNG files: {:d}'.format(len(masks_png_list)))
+for product in PRODUCTS:
+    print('Number of {} PNG files: {:d}'.format(product, len(product_files[product])))
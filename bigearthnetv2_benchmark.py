@@ -0,0 +1,615 @@
+from lib.bigearthnetv2_lib import *
+import sys
+import json
+import multiprocessing
+import resource
+import shutil
+import platform
+import subprocess
+from rasterio.crs import CRS
+
+'''
+This script measures the performance of some functions of the bigearthnetv2_lib.py
+python script in the lib/ subfolder. The script can be executed using the command
+line from the root folder of the dl_remote_sensing project repository with the
+name of the benchmark and its arguments, e.g.
+
+>python bigearthnetv2_benchmark.py remap 2000
+
+Benchmarks:
+remap <number of masks>: compares the lookup table remapping of the Corine2018
+masks (corine_remap) with the previous implementation that loops over the unique
+values of each mask.
+normalize <number of bands>: compares the throughput and the peak memory of the
+per patch min-max normalization of the bands (normalize) with the quantization
+to uint8 with dataset-wide clip values (quantize).
+stages <target folder> <number of tiles> <patches per tile> <results file> [<number of workers>]:
+creates a synthetic dataset with the folder structure of BigEarthNet-S2 and Reference_Maps
+in the target folder, if it doesn't exist, and measures each stage of the data preparation:
+the listing of the files, createPNG, createMaskPNG, corine_l3_mask, corine_l1_mask, 
+collect_statistics, zip_pngs and unzip_pngs. The number of patches per second and the peak
+resident memory of each stage are saved in the results file in JSON format.
+compare <results file> <results file>: prints the ratio between the number of patches per
+second and the peak memory of each stage in two results files of the stages benchmark.
+loader <images folder> <masks folder> [<batch size>] [<image size>] [<number of epochs>] [<number of threads>]:
+compares the number of patches per second loaded from the PNG images and masks in the two
+folders by BatchLoader, with uint8 and float16 images and with random flips and rotations, and by the TF dataset of the training
+notebook (get_dataset), if TensorFlow is installed.
+inference <dataset folder> <target folder> [<batch sizes>] [<numbers of threads>]: measures
+the number of patches per second of predict_tiles on the BigEarthNet-S2 folder of the dataset,
+e.g. created by the stages benchmark, with a NumPy stand-in of the model, for each batch size
+and number of threads in the comma separated lists, e.g. 8,32,128 and 1,4,8.
+import [<budget in ms>] [<number of runs>]: measures the time to import the library in a
+new python process, the best of some runs, and prints the modules that take most of the
+time. The script exits with an error if the import time is greater than the budget, 400 ms
+by default, or if GDAL, PIL, scikit-image, tifffile, matplotlib, TensorFlow or Keras are
+imported, so that a heavy package imported at the top of the library can be found before
+it slows down the scripts and every worker process.
+cache <masks folder> [<number of workers>] [<cache size in MB>]: measures the number of masks
+per second read by read_mask from the folder, e.g. the Reference_Maps folder of the dataset,
+without the raster cache, with a cold and a warm cache, and by a pool of worker processes
+that share the decoded masks through the shared memory backend of the cache, and prints
+the hits and misses of the cache.
+codecs <dataset folder> [<number of patches>]: measures the encode and decode throughput,
+in MB/s of decoded arrays, and the bytes per patch of each codec of encode_array, PNG
+with the zlib levels 1, 6 and 9, lossless WebP, NumPy .npy and .npy compressed by Zstandard
+with the levels 1, 3 and 9, for the RGB images, the masks and the level 1 masks of the first
+patches of the dataset folder, e.g. created by the stages benchmark.
+'''
+
+def corine2018_l3_class_bucket_list(clc_code):
+    '''
+    Previous implementation of corine2018_l3_class_bucket.
+    '''
+    corine2018_class_code = [
+        111, 112, 121, 122, 123, 124, 131, 132, 133, 141, 142,
+        211, 212, 213, 221, 222, 223, 231, 241, 242, 243, 244,
+        311, 312, 313, 321, 322, 323, 324, 331, 332, 333, 334, 335,
+        411, 412, 421, 422, 423,
+        511, 512, 521, 522, 523,
+        999]
+    clc_code_index = corine2018_class_code.index(clc_code)
+    corine2018_class_buckets = np.arange(1,46, dtype='uint8')
+    return corine2018_class_buckets[clc_code_index]
+
+def corine2018_l1_class_bucket_list(clc_code):
+    '''
+    Previous implementation of corine2018_l1_class_bucket.
+    '''
+    corine2018_class_code = [
+        [111, 112, 121, 122, 123, 124, 131, 132, 133, 141, 142],
+        [211, 212, 213, 221, 222, 223, 231, 241, 242, 243, 244],
+        [311, 312, 313, 321, 322, 323, 324, 331, 332, 333, 334, 335],
+        [411, 412, 421, 422, 423],
+        [511, 512, 521, 522, 523],
+        [999]]
+    for c in range(1, 7):
+        if (clc_code in corine2018_class_code[c - 1]):
+            return c
+
+def corine_mask_loop(mask_array, class_bucket):
+    '''
+    Previous implementation of corine_l3_mask and corine_l1_mask
+    that loops over the unique values of the mask.
+    '''
+    size = mask_array.shape
+    unif_mask = np.zeros(size, dtype=np.int8)
+    unique_values = np.unique(mask_array)
+    for u in unique_values:
+        t_mask = (mask_array == u)
+        unif_mask[t_mask] = class_bucket(u)
+    return unif_mask
+
+def synthetic_masks(num_masks, seed=0, class_weights=None):
+    '''
+    Returns a stack of Corine2018 Level 3 masks with shape (num_masks, 120, 120).
+    Each mask is made of 10x10 pixel blocks, the Corine2018 resolution is 100 m.,
+    of up to 6 classes. The classes of a mask are drawn with probabilities 
+    proportional to the class weights, e.g. the number of images of each class 
+    in data/statistics.txt, and each class covers the blocks that are nearest to
+    a random point so that the areas of the classes are contiguous.
+    '''
+    rng = np.random.default_rng(seed)
+    codes = np.array(CORINE2018_L3_CODES, dtype=np.uint16)
+    p = None
+    if (class_weights is not None):
+        p = np.asarray(class_weights, dtype=np.float64) + 1
+        p = p / p.sum()
+    mask_codes = rng.choice(codes, size=(num_masks, 6), p=p)
+    num_classes = rng.integers(1, 7, size=(num_masks, 1, 1))
+    centers = rng.uniform(0, 12, size=(num_masks, 6, 2))
+    rows, cols = np.mgrid[0:12, 0:12] + 0.5
+    distances = (rows[None, None] - centers[:, :, 0, None, None]) ** 2 + (cols[None, None] - centers[:, :, 1, None, None]) ** 2
+    distances[np.arange(6)[None, :] >= num_classes[:, :, 0]] = np.inf
+    blocks = distances.argmin(axis=1)
+    masks = np.take_along_axis(mask_codes, blocks.reshape(num_masks, -1), axis=1).reshape(num_masks, 12, 12)
+    return masks.repeat(10, axis=1).repeat(10, axis=2)
+
+def benchmark_remap(num_masks):
+    masks = synthetic_masks(num_masks)
+    print('Remapping {:d} masks with shape {}'.format(num_masks, masks.shape[1:]))
+    for level, class_bucket in [('l3', corine2018_l3_class_bucket_list), ('l1', corine2018_l1_class_bucket_list)]:
+        start = time.perf_counter()
+        loop_masks = [corine_mask_loop(mask, class_bucket) for mask in masks]
+        loop_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        lut_masks = [corine_remap(mask, level) for mask in masks]
+        lut_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batch_masks = corine_remap(masks, level)
+        batch_time = time.perf_counter() - start
+
+        assert np.array_equal(np.stack(loop_masks), np.stack(lut_masks))
+        assert np.array_equal(np.stack(lut_masks), batch_masks)
+        print('Level {}: unique value loop {:.0f} masks/s, lookup table {:.0f} masks/s ({:.1f}x), '
+              'lookup table on the stack {:.0f} masks/s ({:.1f}x)'.format(
+                  level, num_masks / loop_time, num_masks / lut_time, loop_time / lut_time,
+                  num_masks / batch_time, loop_time / batch_time))
+
+def synthetic_bands(num_bands, seed=0, size=120):
+    '''
+    Returns a stack of uint16 bands with shape (num_bands, size, size)
+    with values distributed like Sentinel-2 L2A surface reflectances.
+    '''
+    rng = np.random.default_rng(seed)
+    return rng.gamma(2.0, 600.0, size=(num_bands, size, size)).clip(0, 65535).astype(np.uint16)
+
+def measure(function, bands):
+    '''
+    Applies the function to each band and returns the elapsed 
+    time and the peak memory allocated by the function.
+    '''
+    import tracemalloc
+    tracemalloc.start()
+    start = time.perf_counter()
+    for band in bands:
+        function(band)
+    elapsed_time = time.perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed_time, peak_memory
+
+def benchmark_normalize(num_bands):
+    bands = synthetic_bands(num_bands)
+    histograms = {'B04': sum(band_histogram(band) for band in bands)}
+    low, high = band_clip_values(histograms)['B04']
+    print('Normalizing {:d} bands with shape {}, clip values ({:d}, {:d})'.format(num_bands, bands.shape[1:], low, high))
+    out = np.empty(bands.shape[1:], dtype=np.uint8)
+    quantize(bands[0], low, high)
+    for name, function in [('normalize', normalize),
+                           ('quantize', lambda band: quantize(band, low, high)),
+                           ('quantize with output buffer', lambda band: quantize(band, low, high, out=out))]:
+        elapsed_time, peak_memory = measure(function, bands)
+        print('{}: {:.0f} bands/s, peak memory {:.1f} KB'.format(name, num_bands / elapsed_time, peak_memory / 1024))
+
+def write_band_geotiff(target_path, band_array, transform, crs):
+    '''
+    Writes a one band uint16 GeoTIFF file with the profile of the BigEarthNet files.
+    '''
+    height, width = band_array.shape
+    with rasterio.open(target_path,
+                       mode='w',
+                       driver='GTiff',
+                       height=height,
+                       width=width,
+                       count=1,
+                       dtype='uint16',
+                       nodata=0,
+                       compress='deflate',
+                       crs=crs,
+                       transform=transform) as target_dataset:
+        target_dataset.write(band_array, 1)
+
+def create_synthetic_dataset(target_dir, num_tiles, patches_per_tile, class_weights=None, seed=0):
+    '''
+    Creates a synthetic dataset in the target folder with the folder structure and 
+    the file names of BigEarthNet-S2 and Reference_Maps: num_tiles tile folders with 
+    patches_per_tile patch folders each. The patches of the images have the 12 bands
+    of Sentinel-2 with their resolution (see SENTINEL2_BAND_RESOLUTIONS) and the 
+    patches of the masks a reference map (see synthetic_masks). All the files are 
+    uint16 GeoTIFF files like the ones of BigEarthNet. 
+    '''
+    crs = CRS.from_epsg(32633)
+    images_dir = pathlib.Path(target_dir) / 'BigEarthNet-S2'
+    masks_dir = pathlib.Path(target_dir) / 'Reference_Maps'
+    for tile_index in range(num_tiles):
+        orbit, tile_number = divmod(tile_index, 26 * 26)
+        tile_name = 'S2A_MSIL2A_20170613T101031_N9999_R{:03d}_T33U{}{}'.format(
+            (22 + orbit) % 1000, chr(65 + tile_number // 26), chr(65 + tile_number % 26))
+        tile_seed = seed + tile_index
+        masks = synthetic_masks(patches_per_tile, tile_seed, class_weights)
+        bands = {resolution: synthetic_bands(patches_per_tile * 12, tile_seed, 1200 // resolution)
+                 for resolution in (10, 20, 60)}
+        for patch_index in range(patches_per_tile):
+            row, col = divmod(patch_index, 100)
+            patch_name = '{}_{:02d}_{:02d}'.format(tile_name, row, col)
+            image_dir = images_dir / tile_name / patch_name
+            mask_dir = masks_dir / tile_name / patch_name
+            image_dir.mkdir(parents=True, exist_ok=True)
+            mask_dir.mkdir(parents=True, exist_ok=True)
+            x, y = 399960 + col * 1200, 5400000 - row * 1200
+            for band_index, band in enumerate(SENTINEL2_BANDS):
+                resolution = SENTINEL2_BAND_RESOLUTIONS[band]
+                transform = rasterio.Affine(resolution, 0, x, 0, -resolution, y)
+                write_band_geotiff(image_dir / '{}_{}.tif'.format(patch_name, band), 
+                                   bands[resolution][patch_index * 12 + band_index], transform, crs)
+            write_band_geotiff(mask_dir / '{}_reference_map.tif'.format(patch_name), 
+                               masks[patch_index].astype(np.uint16), rasterio.Affine(10, 0, x, 0, -10, y), crs)
+        print('Synthetic tile {:d} created'.format(tile_index + 1))
+
+def maxrss_mb(who):
+    '''
+    Returns the peak resident memory in MB of this process or of its children.
+    '''
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss / 1024 / 1024 if sys.platform == 'darwin' else maxrss / 1024
+
+def run_stage(stage_function):
+    '''
+    Runs a stage, a function that returns the number of patches it has processed,
+    in a child process so that the peak memory of each stage is measured separately.
+    Returns a dictionary with the elapsed time, the number of patches, the number of
+    patches per second, the peak resident memory in MB of the child process, or of 
+    the processes of its pool, and the increase with respect to the memory inherited 
+    from this process.
+    '''
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    def stage_process():
+        try:
+            start_rss = maxrss_mb(resource.RUSAGE_SELF)
+            start = time.perf_counter()
+            num_patches = stage_function()
+            elapsed_time = time.perf_counter() - start
+            peak_rss = max(maxrss_mb(resource.RUSAGE_SELF), maxrss_mb(resource.RUSAGE_CHILDREN))
+            sender.send({'seconds': elapsed_time, 
+                         'patches': num_patches, 
+                         'patches_per_second': num_patches / elapsed_time,
+                         'peak_rss_mb': peak_rss,
+                         'peak_rss_increase_mb': peak_rss - start_rss})
+        except Exception as e:
+            sender.send({'error': '{}: {}'.format(type(e).__name__, e)})
+    process = multiprocessing.get_context('fork').Process(target=stage_process)
+    process.start()
+    result = receiver.recv()
+    process.join()
+    return result
+
+def benchmark_stages(target_dir, num_tiles, patches_per_tile, results_file, num_workers=1):
+    dataset_file = pathlib.Path(target_dir) / 'synthetic_dataset.json'
+    dataset = {'num_tiles': num_tiles, 'patches_per_tile': patches_per_tile}
+    if (not dataset_file.is_file() or json.loads(dataset_file.read_text()) != dataset):
+        shutil.rmtree(target_dir, ignore_errors=True)
+        class_weights = None
+        if (os.path.isfile('data/statistics.txt')):
+            class_weights = read_statistics('data/statistics.txt')
+        start = time.perf_counter()
+        create_synthetic_dataset(target_dir, num_tiles, patches_per_tile, class_weights)
+        print('Synthetic dataset created in {:.1f} seconds'.format(time.perf_counter() - start))
+        dataset_file.write_text(json.dumps(dataset))
+    images_dir = pathlib.Path(target_dir) / 'BigEarthNet-S2'
+    masks_dir = pathlib.Path(target_dir) / 'Reference_Maps'
+    manifest_path = str(pathlib.Path(target_dir) / 'synthetic_manifest.sqlite')
+    zip_path = str(pathlib.Path(target_dir) / 'synthetic_pngs.zip')
+    unzip_dir = pathlib.Path(target_dir) / 'unzipped_pngs'
+    delete_files(images_dir.glob('*/*/*.png'))
+    delete_files(masks_dir.glob('*/*/*.png'))
+    if (os.path.isfile(manifest_path)):
+        os.remove(manifest_path)
+    shutil.rmtree(unzip_dir, ignore_errors=True)
+    num_patches = num_tiles * patches_per_tile
+    tiles_list = list_image_files(images_dir, 0, num_tiles, bands=['B04', 'B03', 'B02'])
+    tiles_mask_list = list_mask_files(masks_dir, 0, num_tiles)
+    mask_paths = [mask_list[0] for patches_list in tiles_mask_list for mask_list in patches_list]
+    masks = np.stack([read_mask(mask_path) for mask_path in mask_paths])
+    
+    def list_files():
+        list_image_files(images_dir, 0, num_tiles)
+        list_mask_files(masks_dir, 0, num_tiles)
+        return num_patches
+
+    def list_files_manifest():
+        build_manifest(images_dir, manifest_path)
+        build_manifest(masks_dir, manifest_path)
+        list_image_files(images_dir, 0, num_tiles, manifest_path=manifest_path)
+        list_mask_files(masks_dir, 0, num_tiles, manifest_path=manifest_path)
+        return num_patches
+
+    def statistics():
+        collect_statistics(masks_dir, 0, num_tiles)
+        return num_patches
+
+    def zip_files():
+        png_files = sorted(str(path) for path in images_dir.glob('*/*/*.png')) + \
+                    sorted(str(path) for path in masks_dir.glob('*/*/*.png'))
+        zip_pngs(png_files, zip_path)
+        return num_patches
+
+    def unzip_files():
+        unzip_pngs(zip_path, unzip_dir)
+        return num_patches
+
+    stages = [('list_image_files, list_mask_files', list_files),
+              ('build_manifest, list_image_files, list_mask_files', list_files_manifest),
+              ('createPNG', lambda: len(createPNGs(tiles_list, num_workers=num_workers))),
+              ('createMaskPNG', lambda: len(createMaskPNGs(tiles_mask_list, num_workers=num_workers))),
+              ('corine_l3_mask', lambda: len([corine_l3_mask(mask) for mask in masks])),
+              ('corine_l1_mask', lambda: len([corine_l1_mask(mask) for mask in masks])),
+              ('collect_statistics', statistics),
+              ('zip_pngs', zip_files),
+              ('unzip_pngs', unzip_files)]
+    results = {'dataset': dict(dataset, num_workers=num_workers),
+               'platform': {'python': platform.python_version(), 
+                            'machine': platform.machine(), 
+                            'cpu_count': os.cpu_count()},
+               'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'stages': {}}
+    for name, stage_function in stages:
+        result = run_stage(stage_function)
+        results['stages'][name] = result
+        if ('error' in result):
+            print('{}: failed, {}'.format(name, result['error']))
+        else:
+            print('{}: {:.0f} patches/s, peak RSS {:.1f} MB (+{:.1f} MB)'.format(
+                name, result['patches_per_second'], result['peak_rss_mb'], result['peak_rss_increase_mb']))
+    with open(results_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Results saved in {}'.format(results_file))
+
+def compare_stages(old_results_file, new_results_file):
+    with open(old_results_file) as f:
+        old_results = json.load(f)
+    with open(new_results_file) as f:
+        new_results = json.load(f)
+    print('Dataset: {} -> {}'.format(old_results['dataset'], new_results['dataset']))
+    for name, new_result in new_results['stages'].items():
+        old_result = old_results['stages'].get(name)
+        if (old_result is None or 'error' in old_result or 'error' in new_result):
+            print('{}: not comparable'.format(name))
+            continue
+        print('{}: {:.0f} -> {:.0f} patches/s ({:.2f}x), peak RSS {:.1f} -> {:.1f} MB'.format(
+            name, old_result['patches_per_second'], new_result['patches_per_second'],
+            new_result['patches_per_second'] / old_result['patches_per_second'],
+            old_result['peak_rss_mb'], new_result['peak_rss_mb']))
+
+def tf_dataset(batch_size, img_size, input_img_paths, target_img_paths):
+    '''
+    The TF dataset of the bigearthnet_model notebook (get_dataset).
+    '''
+    import tensorflow as tf
+    def load_img_masks(input_img_path, target_img_path):
+        input_img = tf.io.read_file(input_img_path)
+        input_img = tf.io.decode_png(input_img, channels=3)
+        input_img = tf.image.resize(input_img, img_size)
+        input_img = tf.image.convert_image_dtype(input_img, "float16")
+        target_img = tf.io.read_file(target_img_path)
+        target_img = tf.io.decode_png(target_img, channels=1)
+        target_img = tf.image.resize(target_img, img_size, method="nearest")
+        target_img = tf.image.convert_image_dtype(target_img, "uint8")
+        target_img -= 1
+        return input_img, target_img
+    dataset = tf.data.Dataset.from_tensor_slices((input_img_paths, target_img_paths))
+    dataset = dataset.map(load_img_masks, num_parallel_calls=tf.data.AUTOTUNE)
+    return dataset.batch(batch_size)
+
+def benchmark_loader(images_dir, masks_dir, batch_size=32, image_size=128, num_epochs=3, num_threads=8):
+    image_paths = sorted(os.path.join(images_dir, file_name) for file_name in os.listdir(images_dir) 
+                         if file_name.endswith('.png'))
+    mask_paths = sorted(os.path.join(masks_dir, file_name) for file_name in os.listdir(masks_dir) 
+                        if file_name.endswith('.png'))
+    pairs, unpaired_images, unpaired_masks = pair_patch_files(image_paths, mask_paths)
+    image_paths, mask_paths = split_file_paths(list(pairs.keys()), pairs)
+    print('Loading {:d} patches in batches of {:d}, image size {:d}, {:d} epochs'.format(
+        len(image_paths), batch_size, image_size, num_epochs))
+    for name, dtype, augment in [('BatchLoader uint8', np.uint8, False), 
+                                 ('BatchLoader float16', np.float16, False),
+                                 ('BatchLoader float16 augmented', np.float16, True)]:
+        loader = BatchLoader(image_paths, mask_paths, batch_size=batch_size, image_size=(image_size, image_size),
+                             dtype=dtype, label_offset=1, shuffle=True, num_threads=num_threads, augment=augment)
+        start = time.perf_counter()
+        for epoch in range(num_epochs):
+            for images, masks in loader:
+                pass
+        elapsed_time = time.perf_counter() - start
+        print('{}: {:.0f} patches/s'.format(name, num_epochs * len(image_paths) / elapsed_time))
+    try:
+        dataset = tf_dataset(batch_size, (image_size, image_size), image_paths, mask_paths)
+    except ImportError:
+        print('TF dataset: skipped, TensorFlow is not installed')
+        return
+    start = time.perf_counter()
+    for epoch in range(num_epochs):
+        for images, masks in dataset:
+            pass
+    elapsed_time = time.perf_counter() - start
+    print('TF dataset: {:.0f} patches/s'.format(num_epochs * len(image_paths) / elapsed_time))
+
+def standin_model(images, num_classes=6, seed=0):
+    '''
+    A NumPy stand-in of a segmentation model: a 1x1 convolution of the images
+    with random weights that returns the probabilities of the classes.
+    '''
+    weights = np.random.default_rng(seed).standard_normal((images.shape[-1], num_classes)).astype(np.float32)
+    logits = images.astype(np.float32) @ weights / 255.0
+    probabilities = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return probabilities / probabilities.sum(axis=-1, keepdims=True)
+
+def benchmark_inference(dataset_dir, target_dir, batch_sizes=(8, 32, 128), threads=(1, 4, 8)):
+    images_dir = pathlib.Path(dataset_dir) / 'BigEarthNet-S2'
+    for batch_size in batch_sizes:
+        for num_threads in threads:
+            metrics = StageMetrics('Inference', print_msg=False)
+            shutil.rmtree(target_dir, ignore_errors=True)
+            predict_tiles(standin_model, images_dir, 0, None, target_dir, batch_size=batch_size, 
+                          num_threads=num_threads, metrics=metrics)
+            report = metrics.stop().report()
+            totals = report['totals']
+            print('batch size {:d}, {:d} threads: {:.0f} patches/s, predict {:.0f}%'.format(
+                batch_size, num_threads, report['patches_per_second'], 
+                100 * totals['predict_seconds'] / totals['task_seconds']))
+
+## Default budget of the import of the library in ms, about twice the import
+## of numpy and rasterio, and the packages that the library shall import only
+## in the functions that use them
+IMPORT_BUDGET_MS = 400
+LAZY_PACKAGES = ['osgeo', 'PIL', 'skimage', 'tifffile', 'matplotlib', 'tensorflow', 'keras']
+
+def import_times(module_name):
+    '''
+    Returns the wall time of the import of a module in a new python process,
+    the cumulative import time, in seconds, of each package imported by the module,
+    from the output of python -X importtime, and the names of all the modules 
+    imported by the process.
+    '''
+    code = 'import time; start = time.perf_counter(); import {}; print(time.perf_counter() - start)'.format(module_name)
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                               capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    module_times = {}
+    imported_times = {}
+    imported_modules = set()
+    for line in completed.stderr.splitlines():
+        if (not line.startswith('import time:') or 'cumulative' in line):
+            continue
+        self_time, cumulative_time, name = line[len('import time:'):].split('|')
+        imported_modules.add(name.strip())
+        if (name.startswith('    ')):
+            continue
+        elif (name.startswith('   ')):
+            imported_times[name.strip()] = int(cumulative_time) / 1e6
+        else:
+            if (name.strip() == module_name):
+                module_times = imported_times
+            imported_times = {}
+    return float(completed.stdout.split()[-1]), module_times, imported_modules
+
+def lazy_packages_imported(imported_modules):
+    '''
+    Returns the sorted list of the packages in LAZY_PACKAGES that have been imported.
+    '''
+    return sorted({name.split('.')[0] for name in imported_modules} & set(LAZY_PACKAGES))
+
+def benchmark_import(budget_ms=IMPORT_BUDGET_MS, num_runs=5, module_name='lib.bigearthnetv2_lib', top=8):
+    SUCCESS = 0
+    FAILURE = 1
+    best_time = None
+    for run in range(num_runs):
+        import_time, module_times, imported_modules = import_times(module_name)
+        if (best_time is None or import_time < best_time):
+            best_time, best_module_times = import_time, module_times
+    print('Import of {}: {:.0f} ms (best of {:d} runs)'.format(module_name, best_time * 1000, num_runs))
+    for name, module_time in sorted(best_module_times.items(), key=lambda item: -item[1])[:top]:
+        print('  {}: {:.0f} ms'.format(name, module_time * 1000))
+    lazy_packages = lazy_packages_imported(imported_modules)
+    if (len(lazy_packages) > 0):
+        print('Packages that shall be imported when they are used: {}'.format(', '.join(lazy_packages)))
+        return FAILURE
+    if (budget_ms is not None and best_time * 1000 > budget_ms):
+        print('The import time is greater than the budget of {:.0f} ms'.format(budget_ms))
+        return FAILURE
+    return SUCCESS
+
+def read_masks(mask_paths):
+    for mask_path in mask_paths:
+        read_mask(mask_path)
+    cache = raster_cache()
+    return cache.stats() if cache is not None else {}
+
+def benchmark_cache(masks_dir, num_workers=2, max_mb=256):
+    mask_paths = sorted(str(mask_path) for mask_path in pathlib.Path(masks_dir).rglob('*.tif'))
+    print('Reading {:d} masks, cache of {:d} MB'.format(len(mask_paths), max_mb))
+    disable_raster_cache()
+    start = time.perf_counter()
+    read_masks(mask_paths)
+    print('No cache: {:.0f} masks/s'.format(len(mask_paths) / (time.perf_counter() - start)))
+    cache = enable_raster_cache(max_mb * 2**20)
+    for name in ['Cold cache', 'Warm cache']:
+        start = time.perf_counter()
+        read_masks(mask_paths)
+        print('{}: {:.0f} masks/s'.format(name, len(mask_paths) / (time.perf_counter() - start)))
+    print('Cache: {}'.format(cache.stats()))
+    cache = enable_raster_cache(max_mb * 2**20, shared_name='benchmark_{:d}'.format(os.getpid()))
+    chunks = [mask_paths[index::num_workers] for index in range(num_workers)]
+    try:
+        for name, worker_chunks in [('Pool, cold shared cache', chunks), 
+                                    ('New pool, shared cache', chunks[1:] + chunks[:1])]:
+            with multiprocessing.Pool(num_workers) as pool:
+                start = time.perf_counter()
+                worker_stats = pool.map(read_masks, worker_chunks, chunksize=1)
+                print('{}: {:.0f} masks/s'.format(name, len(mask_paths) / (time.perf_counter() - start)))
+            totals = {counter: sum(stats[counter] for stats in worker_stats) for counter in worker_stats[0]}
+            print('Workers cache: {}'.format(totals))
+    finally:
+        disable_raster_cache()
+
+CODEC_SETTINGS = [('png', 1), ('png', 6), ('png', 9), ('webp', None), ('npy', None), 
+                  ('zstd', 1), ('zstd', 3), ('zstd', 9)]
+
+def benchmark_codecs(dataset_dir, num_patches=500):
+    images_dir = pathlib.Path(dataset_dir) / 'BigEarthNet-S2'
+    masks_dir = pathlib.Path(dataset_dir) / 'Reference_Maps'
+    bands_lists = [bands_list for patches_list in list_image_files(images_dir, 0, None) 
+                   for bands_list in patches_list][:num_patches]
+    mask_paths = [mask_list[0] for patches_list in list_mask_files(masks_dir, 0, None) 
+                  for mask_list in patches_list][:num_patches]
+    masks = [read_mask(mask_path) for mask_path in mask_paths]
+    products = [('rgb', 'uint8', [read_normalized_bands(bands_list) for bands_list in bands_lists]),
+                ('mask', 'uint16', [[mask] for mask in masks]),
+                ('l1', 'uint8', [[corine_remap(mask, 'l1')] for mask in masks])]
+    for product, dtype, band_lists in products:
+        raw_bytes = sum(stack_bands(band_list, dtype).nbytes for band_list in band_lists)
+        print('{}: {:d} patches, {:.0f} bytes per patch decoded'.format(product, len(band_lists), 
+                                                                        raw_bytes / len(band_lists)))
+        for codec, compresslevel in CODEC_SETTINGS:
+            name = codec if compresslevel is None else '{} {:d}'.format(codec, compresslevel)
+            try:
+                start = time.perf_counter()
+                encoded = [encode_array(band_list, dtype, codec, compresslevel) for band_list in band_lists]
+                encode_time = time.perf_counter() - start
+            except (ValueError, ImportError) as e:
+                print('  {}: skipped, {}'.format(name, e))
+                continue
+            start = time.perf_counter()
+            for encoded_bytes in encoded:
+                decode_array(encoded_bytes, codec)
+            decode_time = time.perf_counter() - start
+            print('  {}: encode {:.1f} MB/s, decode {:.1f} MB/s, {:.0f} bytes per patch'.format(
+                name, raw_bytes / encode_time / 1e6, raw_bytes / decode_time / 1e6, 
+                sum(len(encoded_bytes) for encoded_bytes in encoded) / len(encoded)))
+
+BENCHMARK = sys.argv[1]
+if (BENCHMARK == 'remap'):
+    num_masks = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    benchmark_remap(num_masks)
+elif (BENCHMARK == 'normalize'):
+    num_bands = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    benchmark_normalize(num_bands)
+elif (BENCHMARK == 'stages'):
+    num_workers = int(sys.argv[6]) if len(sys.argv) > 6 else 1
+    benchmark_stages(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), sys.argv[5], num_workers)
+elif (BENCHMARK == 'compare'):
+    compare_stages(sys.argv[2], sys.argv[3])
+elif (BENCHMARK == 'loader'):
+    batch_size = int(sys.argv[4]) if len(sys.argv) > 4 else 32
+    image_size = int(sys.argv[5]) if len(sys.argv) > 5 else 128
+    num_epochs = int(sys.argv[6]) if len(sys.argv) > 6 else 3
+    num_threads = int(sys.argv[7]) if len(sys.argv) > 7 else 8
+    benchmark_loader(sys.argv[2], sys.argv[3], batch_size, image_size, num_epochs, num_threads)
+elif (BENCHMARK == 'inference'):
+    batch_sizes = [int(size) for size in sys.argv[4].split(',')] if len(sys.argv) > 4 else [8, 32, 128]
+    threads = [int(number) for number in sys.argv[5].split(',')] if len(sys.argv) > 5 else [1, 4, 8]
+    benchmark_inference(sys.argv[2], sys.argv[3], batch_sizes, threads)
+elif (BENCHMARK == 'import'):
+    budget_ms = float(sys.argv[2]) if len(sys.argv) > 2 else IMPORT_BUDGET_MS
+    num_runs = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    sys.exit(benchmark_import(budget_ms, num_runs))
+elif (BENCHMARK == 'cache'):
+    num_workers = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    max_mb = int(sys.argv[4]) if len(sys.argv) > 4 else 256
+    benchmark_cache(sys.argv[2], num_workers, max_mb)
+elif (BENCHMARK == 'codecs'):
+    num_patches = int(sys.argv[3]) if len(sys.argv) > 3 else 500
+    benchmark_codecs(sys.argv[2], num_patches)
+else:
+    print('Unknown benchmark: {}'.format(BENCHMARK))
@@ -0,0 +1,57 @@
+from lib.bigearthnetv2_lib import *
+import argparse
+
+'''
+This script renders the PNG images and masks of the BigEarthNetv2 patches into
+contact sheets, large PNG files with the image and the colored mask of hundreds or
+thousands of patches, for a quick visual check of the data. The masks are colored
+with the colors of the Corine2018 classes using a lookup table and the sheets are
+assembled with array operations, so the sheets of a whole tile are rendered in
+seconds. The images and the masks can be folders of PNG files or zip files, e.g.
+created by bigearthnet_preparation.py, and are paired by patch id. The script can be
+executed using the command line from the root folder of the dl_remote_sensing project
+repository with the images, the masks and the prefix of the sheets, e.g.
+
+>python bigearthnetv2_contact_sheet.py data/bigearthnet_pngs.zip data/bigearthnet_mask_l1_pngs.zip data/sheets/l1 --level l1
+
+The --level option is l1 or l3 for the masks with the class indexes of the level,
+or codes for the masks with the Corine2018 codes. The ids of the patches are written
+on the cells with the --labels option.
+
+This script imports some functions from the bigearthnetv2_lib.py python
+script in the lib/ subfolder.
+'''
+
+def open_png_source(source):
+    '''
+    Returns the PNG files of a folder or a PNGArchiveReader of a zip file.
+    '''
+    if (source.endswith('.zip')):
+        return PNGArchiveReader(source)
+    return sorted(os.path.join(source, file_name) for file_name in os.listdir(source) if file_name.endswith('.png'))
+
+parser = argparse.ArgumentParser(description='Renders the images and masks of the patches into contact sheets.')
+parser.add_argument('images', help='folder or zip file of the PNG images')
+parser.add_argument('masks', help='folder or zip file of the PNG masks')
+parser.add_argument('target_prefix', help='prefix of the PNG files of the sheets')
+parser.add_argument('--level', default='l3', choices=['l1', 'l3', 'codes'], help='values of the masks')
+parser.add_argument('--patches-per-sheet', type=int, default=1024, help='number of patches in a sheet')
+parser.add_argument('--columns', type=int, default=32, help='number of patches in a row of a sheet')
+parser.add_argument('--step', type=int, default=1, help='subsampling of the pixels of the patches')
+parser.add_argument('--labels', action='store_true', help='writes the patch ids on the sheets')
+parser.add_argument('--num-threads', type=int, default=8, help='number of threads decoding the PNG files')
+args = parser.parse_args()
+
+target_dir = os.path.dirname(args.target_prefix)
+if (target_dir != ''):
+    os.makedirs(target_dir, exist_ok=True)
+start = time.time()
+sheet_paths = render_contact_sheets(open_png_source(args.images), open_png_source(args.masks), args.target_prefix,
+                                    level=args.level, patches_per_sheet=args.patches_per_sheet,
+                                    columns=args.columns, step=args.step, labels=args.labels,
+                                    num_threads=args.num_threads)
+end = time.time()
+print('Number of contact sheets: {:d}'.format(len(sheet_paths)))
+print('Elapsed time (seconds): {:.2f}'.format(end - start))
+
+print('Done !')
@@ -0,0 +1,61 @@
+from lib.bigearthnetv2_lib import *
+import argparse
+import json
+
+'''
+This script evaluates the masks predicted by bigearthnetv2_inference.py against the
+reference maps of the BigEarthNetv2 dataset. The Corine2018 Level 3 codes of the
+reference maps are mapped to the level of the predictions and the pixels of all the
+patches are accumulated in one confusion matrix, from which the pixel accuracy, the
+mean IoU and the IoU, precision and recall of each class are computed. The script
+can be executed using the command line from the root folder of the dl_remote_sensing
+project repository with the dataset folder and the folder of the predicted masks, e.g.
+
+>python bigearthnetv2_evaluation.py data/BigEarthNet-S2 data/predictions --level l1
+
+The patches are evaluated by --num-workers processes. The metrics are saved in
+evaluation.json and the confusion matrix in confusion_matrix.npz in the folder of
+the predicted masks.
+
+This script imports some functions from the bigearthnetv2_lib.py python
+script in the lib/ subfolder.
+'''
+
+parser = argparse.ArgumentParser(description='Evaluates the predicted masks against the reference maps.')
+parser.add_argument('dataset_dir', help='folder with the Reference_Maps folder')
+parser.add_argument('predictions_dir', help='folder of the GeoTIFF files of the predicted masks')
+parser.add_argument('--level', default='l1', choices=['l1', 'l3'], help='Corine2018 level of the predicted classes')
+parser.add_argument('--num-workers', type=int, default=os.cpu_count(), help='number of worker processes')
+args = parser.parse_args()
+
+MASKS_DATA_DIR = pathlib.Path(args.dataset_dir + '/Reference_Maps')
+MANIFEST_PATH = args.dataset_dir + '/bigearthnet_manifest.sqlite'
+build_manifest(MASKS_DATA_DIR, MANIFEST_PATH)
+tiles_mask_list = list_mask_files(MASKS_DATA_DIR, 0, None, manifest_path=MANIFEST_PATH)
+reference_paths = [str(mask_list[0]) for patches_list in tiles_mask_list for mask_list in patches_list]
+suffix = '_' + args.level + '_pred.tif'
+prediction_paths = [os.path.join(args.predictions_dir, file_name) for file_name in os.listdir(args.predictions_dir)
+                    if file_name.endswith(suffix)]
+print('Number of predicted masks: {:d}'.format(len(prediction_paths)))
+
+start = time.time()
+confusion_matrix, num_patches = evaluate_predictions(reference_paths, prediction_paths, level=args.level,
+                                                     num_workers=args.num_workers)
+end = time.time()
+print('Number of patches evaluated: {:d}'.format(num_patches))
+print('Elapsed time (seconds): {:.2f}'.format(end - start))
+
+labels = corine2018_l1_labels() if args.level == 'l1' else corine2018_l3_labels()
+report = confusion_matrix.report(labels)
+print('Pixel accuracy: {:.4f}'.format(report['pixel_accuracy']))
+print('Mean IoU: {:.4f}'.format(report['mean_iou']))
+for label, metrics in report['classes'].items():
+    if (metrics['true_pixels'] > 0 or metrics['iou'] is not None):
+        print('{}: IoU {}, precision {}, recall {}'.format(label, *['{:.4f}'.format(metrics[name])
+                                                                   if metrics[name] is not None else '-'
+                                                                   for name in ('iou', 'precision', 'recall')]))
+with open(os.path.join(args.predictions_dir, 'evaluation.json'), 'w') as f:
+    json.dump(report, f, indent=2)
+save_confusion_matrix(confusion_matrix, os.path.join(args.predictions_dir, 'confusion_matrix.npz'))
+
+print('Done !')
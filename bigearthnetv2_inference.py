@@ -0,0 +1,57 @@
+from lib.bigearthnetv2_lib import *
+import argparse
+
+'''
+This script predicts the Corine2018 classes of the pixels of the BigEarthNetv2
+patches with a trained Keras model, e.g. data/bigearthnet_v2.keras created by the
+bigearthnet_model notebook, and writes the predicted masks as GeoTIFF files with
+the coordinate reference system and the transform of the patches, so that they
+can be compared with the reference maps or displayed on a map. The script can be
+executed using the command line from the root folder of the dl_remote_sensing
+project repository with the dataset folder, the model and the target folder, e.g.
+
+>python bigearthnetv2_inference.py data/BigEarthNet-S2 data/bigearthnet_v2.keras data/predictions --level l1
+
+The tiles are sorted by name and can be selected with the --start-tile and
+--end-tile options. The patches are predicted in batches of --batch-size patches
+while a pool of --num-threads threads reads the next batch and writes the masks
+of the previous one. The number of patches per second and the share of the time
+spent reading, resizing, predicting and writing are printed, and saved in the
+target folder in inference_metrics.json, to choose the batch size and the
+number of threads. TensorFlow is only imported by this script.
+
+This script imports some functions from the bigearthnetv2_lib.py python
+script in the lib/ subfolder.
+'''
+
+parser = argparse.ArgumentParser(description='Predicts the masks of the BigEarthNet patches with a Keras model.')
+parser.add_argument('dataset_dir', help='folder with the BigEarthNet-S2 folder')
+parser.add_argument('model_file', help='Keras model')
+parser.add_argument('target_dir', help='folder of the GeoTIFF files of the predicted masks')
+parser.add_argument('--level', default='l1', choices=['l1', 'l3'], help='Corine2018 level of the model classes')
+parser.add_argument('--batch-size', type=int, default=32, help='number of patches in a batch')
+parser.add_argument('--image-size', type=int, default=128, help='size of the images of the model')
+parser.add_argument('--num-threads', type=int, default=8, help='number of threads reading and writing the patches')
+parser.add_argument('--start-tile', type=int, default=0, help='index of the first tile')
+parser.add_argument('--end-tile', type=int, default=None, help='index of the tile after the last one')
+args = parser.parse_args()
+
+import keras
+model = keras.models.load_model(args.model_file)
+
+IMAGES_DATA_DIR = pathlib.Path(args.dataset_dir + '/BigEarthNet-S2')
+MANIFEST_PATH = args.dataset_dir + '/bigearthnet_manifest.sqlite'
+build_manifest(IMAGES_DATA_DIR, MANIFEST_PATH)
+
+metrics = StageMetrics('Inference')
+metrics.expect(sum(len(patches_list) for patches_list in
+                   list_image_files(IMAGES_DATA_DIR, args.start_tile, args.end_tile, manifest_path=MANIFEST_PATH)))
+target_paths = predict_tiles(model, IMAGES_DATA_DIR, args.start_tile, args.end_tile, args.target_dir,
+                             level=args.level, batch_size=args.batch_size,
+                             image_size=(args.image_size, args.image_size), num_threads=args.num_threads,
+                             manifest_path=MANIFEST_PATH, metrics=metrics)
+metrics.stop()
+save_metrics([metrics], os.path.join(args.target_dir, 'inference_metrics.json'))
+print('Number of predicted masks: {:d}'.format(len(target_paths)))
+
+print('Done !')
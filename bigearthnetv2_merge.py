@@ -0,0 +1,75 @@
+from lib.bigearthnetv2_lib import *
+import sys
+
+'''
+This script merges the output files of the shards of bigearthnet_preparation.py
+and bigearthnetv2_statistics.py, run with the --shard and --num-shards options,
+into the files of a single run: the zip files of the PNG files, the lists of the
+PNG files in each zip file, the statistics and the class presence index. The members of the zip files and
+the lists are sorted in the same order of a single run, by tile folder and patch,
+and the statistics are summed. The script can be executed using the command line
+from the root folder of the dl_remote_sensing project repository with the target
+folder and the folders of all the shards, e.g.
+
+>python bigearthnetv2_merge.py data data/shard_*_of_004
+
+This script imports some functions from the bigearthnetv2_lib.py python
+script in the lib/ subfolder.
+'''
+
+TARGET_DIR = sys.argv[1]
+SHARD_DIRS = sys.argv[2:]
+print('Target folder: {}'.format(TARGET_DIR))
+
+## Check that all the shards, created with the same options, are present
+shards = [read_shard_info(os.path.join(shard_dir, 'shard.json')) for shard_dir in SHARD_DIRS]
+num_shards = shards[0]['num_shards']
+shard_indexes = sorted(shard['shard'] for shard in shards)
+if (shard_indexes != list(range(num_shards)) or any(shard['num_shards'] != num_shards or
+                                                    shard['method'] != shards[0]['method'] for shard in shards)):
+    print('The shards {} are not the {:d} shards of one run'.format(shard_indexes, num_shards))
+    sys.exit(1)
+tile_names = sorted(tile_name for shard in shards for tile_name in shard['tiles'])
+print('Merging {:d} shards with {:d} tiles'.format(num_shards, len(tile_names)))
+os.makedirs(TARGET_DIR, exist_ok=True)
+save_shard_info(os.path.join(TARGET_DIR, 'shard.json'), 0, 1, shards[0]['method'], tile_names)
+order_key = tile_order_key(tile_names)
+
+## Merge the zip files and the lists of their PNG files
+zip_names = sorted(set(file_name for shard_dir in SHARD_DIRS for file_name in os.listdir(shard_dir)
+                       if file_name.endswith('.zip')))
+for zip_name in zip_names:
+    source_zip_files = [os.path.join(shard_dir, zip_name) for shard_dir in SHARD_DIRS
+                        if os.path.isfile(os.path.join(shard_dir, zip_name))]
+    png_names = merge_archives(source_zip_files, os.path.join(TARGET_DIR, zip_name), sort_key=order_key)
+    print('{}: {:d} PNG files'.format(zip_name, len(png_names)))
+    list_name = zip_name[:-4] + '.txt'
+    list_files = [os.path.join(shard_dir, list_name) for shard_dir in SHARD_DIRS
+                  if os.path.isfile(os.path.join(shard_dir, list_name))]
+    if (len(list_files) > 0):
+        png_names = []
+        for list_file in list_files:
+            with open(list_file, 'r') as f:
+                png_names.extend(f.read().splitlines())
+        png_names.sort(key=order_key)
+        with open(os.path.join(TARGET_DIR, list_name), 'w') as f:
+            f.writelines(png_name + '\n' for png_name in png_names)
+
+## Merge the statistics
+statistics_files = [os.path.join(shard_dir, 'statistics.npz') for shard_dir in SHARD_DIRS
+                    if os.path.isfile(os.path.join(shard_dir, 'statistics.npz'))]
+if (len(statistics_files) > 0):
+    statistics = merge_class_statistics([read_class_statistics(file_path) for file_path in statistics_files])
+    print('Number of masks: {:d}'.format(statistics['num_masks']))
+    save_statistics(statistics['image_counts'].astype(np.float64), os.path.join(TARGET_DIR, 'statistics.txt'))
+    save_class_statistics(statistics, os.path.join(TARGET_DIR, 'statistics.npz'))
+
+## Merge the class presence indexes
+index_files = [os.path.join(shard_dir, 'class_index.npz') for shard_dir in SHARD_DIRS
+               if os.path.isfile(os.path.join(shard_dir, 'class_index.npz'))]
+if (len(index_files) > 0):
+    class_index = merge_class_indexes([read_class_index(file_path) for file_path in index_files], sort_key=order_key)
+    print('Class presence index: {:d} patches'.format(len(class_index)))
+    save_class_index(class_index, os.path.join(TARGET_DIR, 'class_index.npz'))
+
+print('Done !')
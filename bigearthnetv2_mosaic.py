@@ -0,0 +1,71 @@
+from lib.bigearthnetv2_lib import *
+import argparse
+import sys
+
+'''
+This script assembles the patches of a Sentinel-2 tile of the BigEarthNetv2 dataset
+into one Cloud Optimized GeoTIFF, tiled and compressed with internal overviews, that
+can be opened in a GIS viewer, e.g. QGIS, to see the whole tile at once. The product
+can be the RGB image, normalized as the PNG files, the reference maps or the masks
+predicted by bigearthnetv2_inference.py. The script can be executed using the command
+line from the root folder of the dl_remote_sensing project repository with the dataset
+folder, the tile, the product and the target file, e.g.
+
+>python bigearthnetv2_mosaic.py data/BigEarthNet-S2 S2A_MSIL2A_20170613T101031_N9999_R022_T33UUP rgb data/T33UUP_rgb.tif
+
+The tile can also be given with the end of the name of its folder, e.g. R022_T33UUP,
+if only one folder matches. The reference maps can be mapped to the Corine2018 level 1
+or 3 classes with the --level option, that also sets the color table of the classes,
+e.g.
+
+>python bigearthnetv2_mosaic.py data/BigEarthNet-S2 R022_T33UUP reference data/T33UUP_l1.tif --level l1
+>python bigearthnetv2_mosaic.py data/BigEarthNet-S2 R022_T33UUP prediction data/T33UUP_pred.tif --level l1 --predictions-dir data/predictions
+
+This script imports some functions from the bigearthnetv2_lib.py python
+script in the lib/ subfolder.
+'''
+
+parser = argparse.ArgumentParser(description='Creates a Cloud Optimized GeoTIFF of the patches of a tile.')
+parser.add_argument('dataset_dir', help='folder with the BigEarthNet-S2 and Reference_Maps folders')
+parser.add_argument('tile', help='name of the tile folder or its end, e.g. R022_T33UUP')
+parser.add_argument('product', choices=['rgb', 'reference', 'prediction'], help='patches of the mosaic')
+parser.add_argument('target_file', help='Cloud Optimized GeoTIFF file')
+parser.add_argument('--level', choices=['l1', 'l3'], help='Corine2018 level of the classes of the masks')
+parser.add_argument('--predictions-dir', help='folder of the masks predicted by bigearthnetv2_inference.py')
+parser.add_argument('--num-threads', type=int, default=8, help='number of threads reading the patches')
+args = parser.parse_args()
+
+IMAGES_DATA_DIR = pathlib.Path(args.dataset_dir + '/BigEarthNet-S2')
+MASKS_DATA_DIR = pathlib.Path(args.dataset_dir + '/Reference_Maps')
+MANIFEST_PATH = args.dataset_dir + '/bigearthnet_manifest.sqlite'
+data_dir = MASKS_DATA_DIR if args.product == 'reference' else IMAGES_DATA_DIR
+build_manifest(data_dir, MANIFEST_PATH)
+
+tile_names = [tile_name for tile_name in list_tile_names(data_dir, MANIFEST_PATH) if tile_name.endswith(args.tile)]
+if (len(tile_names) != 1):
+    print('{:d} tile folders match {}: {}'.format(len(tile_names), args.tile, ', '.join(tile_names)))
+    sys.exit(1)
+print('Tile: {}'.format(tile_names[0]))
+
+if (args.product == 'reference'):
+    patches = [mask_list[0] for mask_list in
+               list_mask_files(MASKS_DATA_DIR, 0, None, manifest_path=MANIFEST_PATH, tile_names=tile_names)[0]]
+else:
+    patches = list_image_files(IMAGES_DATA_DIR, 0, None, manifest_path=MANIFEST_PATH, tile_names=tile_names)[0]
+if (args.product == 'prediction'):
+    predicted_patches = []
+    for patch in patches:
+        tile, patch_name, band, date = read_band_name(pathlib.Path(patch[0]).name)
+        prediction_path = os.path.join(args.predictions_dir,
+                                       create_prediction_file_name(tile, patch_name, date, args.level or 'l1'))
+        if (os.path.isfile(prediction_path)):
+            predicted_patches.append(prediction_path)
+    patches = predicted_patches
+print('Number of patches: {:d}'.format(len(patches)))
+
+start = time.time()
+width, height = build_mosaic(patches, args.target_file, level=args.level, num_threads=args.num_threads, print_msg=True)
+end = time.time()
+print('Elapsed time (seconds): {:.2f}'.format(end - start))
+
+print('Done !')
@@ -0,0 +1,64 @@
+from lib.bigearthnetv2_lib import *
+import argparse
+
+'''
+This script splits the BigEarthNetv2 patches into a train, a validation and a
+test set without moving or copying the files. The images and the masks are
+paired by the id of their patch, tile_patch_date, e.g. R022_T33UUP_26_57_20170613,
+and the ids of the patches of each split are saved in a CSV file. The images and
+masks can be given as folders of PNG files or as the text files with the names of
+the PNG files created by bigearthnet_preparation.py. The script can be executed
+using the command line from the root folder of the dl_remote_sensing project
+repository with the images, the masks and the target file, e.g.
+
+>python bigearthnetv2_split.py images masks data/bigearthnet_split.csv
+
+The split is random, with the seed set by the --seed option, and can keep all the
+patches of a Sentinel-2 tile in the same split with the --group-by-tile option or
+be stratified by the rarest class of each patch with the class presence index
+created by bigearthnetv2_statistics.py, e.g.
+
+>python bigearthnetv2_split.py images masks data/bigearthnet_split.csv --class-index data/class_index.npz
+
+In a notebook the lists of the paths of each split are read with
+
+splits = read_split('data/bigearthnet_split.csv')
+pairs, unpaired_images, unpaired_masks = pair_patch_files(img_paths, mask_paths)
+train_images, train_masks = split_file_paths(splits['train'], pairs)
+
+This script imports some functions from the bigearthnetv2_lib.py python
+script in the lib/ subfolder.
+'''
+
+def list_png_files(source):
+    '''
+    Returns the names of the PNG files in a folder or in a text file, one per line.
+    '''
+    if (os.path.isdir(source)):
+        return sorted(os.path.join(source, file_name) for file_name in os.listdir(source) if file_name.endswith('.png'))
+    with open(source, 'r') as f:
+        return f.read().splitlines()
+
+parser = argparse.ArgumentParser(description='Splits the patches into a train, a validation and a test set.')
+parser.add_argument('images', help='folder or text file of the PNG images')
+parser.add_argument('masks', help='folder or text file of the PNG masks')
+parser.add_argument('target_file', help='CSV file of the ids of the patches of each split')
+parser.add_argument('--fractions', type=float, nargs=3, default=[0.7, 0.2, 0.1], help='fractions of train, val and test')
+parser.add_argument('--seed', type=int, default=0, help='seed of the random order of the patches')
+parser.add_argument('--group-by-tile', action='store_true', help='keeps the patches of a tile in the same split')
+parser.add_argument('--class-index', help='class presence index used to stratify the split')
+args = parser.parse_args()
+
+pairs, unpaired_images, unpaired_masks = pair_patch_files(list_png_files(args.images), list_png_files(args.masks))
+print('Number of patches: {:d}'.format(len(pairs)))
+print('Images without a mask: {:d}, masks without an image: {:d}'.format(len(unpaired_images), len(unpaired_masks)))
+
+class_index = read_class_index(args.class_index) if args.class_index is not None else None
+fractions = dict(zip(['train', 'val', 'test'], args.fractions))
+splits = split_patches(pairs.keys(), fractions, seed=args.seed, group_by_tile=args.group_by_tile,
+                       class_index=class_index)
+for split_name, patch_ids in splits.items():
+    print('{}: {:d} patches'.format(split_name, len(patch_ids)))
+save_split(splits, args.target_file)
+
+print('Done !')
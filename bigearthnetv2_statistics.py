@@ -1,4 +1,5 @@
 from lib.bigearthnetv2_lib import *
+import argparse
 
 '''
 The script can be executed using the command line from the root
@@ -10,25 +11,59 @@ This script imports some functions from the bigearthnetv2_lib.py python
 script in the lib/ subfolder.
 
 The purpose of this script is to calculate the number of images in the BigEarthNetv2
-dataset for each of the Corine2018 Land Cover class. The task is accomplished by collecting
-the unique values in the mask file that is linked to an image.
+dataset for each of the Corine2018 Land Cover class. The task is accomplished by counting
+the pixels of each class in the mask file that is linked to an image. The script also 
+saves the number of pixels of each class and the class weights in data/statistics.npz.
+The counts of each tile are saved in data/statistics_partials/ and are not computed 
+again in the next runs. The classes present in each patch and the fraction 
+of their pixels are saved in the class presence index data/class_index.npz, 
+used by bigearthnetv2_subset.py to sample class-balanced subsets. The tiles are sorted by name and can be selected with the
+--start-tile and --end-tile options or split in shards that are processed on 
+different nodes with the --shard and --num-shards options, e.g. 
+
+>python bigearthnetv2_statistics.py data/BigEarthNet-S2 --shard 1 --num-shards 4
+
+The statistics of a shard are saved in data/shard_001_of_004/ and the ones of 
+all the shards are merged with bigearthnetv2_merge.py.
 '''
 
-BIGEARTHNETv2_DIR = sys.argv[1]
+parser = argparse.ArgumentParser(description='Counts the images and the pixels of each Corine2018 class.')
+parser.add_argument('dataset_dir', help='folder with the Reference_Maps folder')
+parser.add_argument('--num-workers', type=int, default=os.cpu_count(), help='number of worker processes')
+parser.add_argument('--partials-dir', default='data/statistics_partials', help='folder of the counts of each tile')
+add_shard_arguments(parser)
+args = parser.parse_args()
+
+BIGEARTHNETv2_DIR = args.dataset_dir
 #BIGEARTHNETv2_DIR = 'data/BigEarthNet-S2'
 print('Path to BigEarthNetv2 dataset: {:}'.format(BIGEARTHNETv2_DIR))
 
 MASKS_DATA_DIR = pathlib.Path(BIGEARTHNETv2_DIR + '/Reference_Maps')
 
-start_tile_index = 0 
-end_tile_index = 5
+MANIFEST_PATH = BIGEARTHNETv2_DIR + '/bigearthnet_manifest.sqlite'
+build_manifest(MASKS_DATA_DIR, MANIFEST_PATH)
+tile_names, OUTPUT_DIR = select_shard(args, list_tile_names(MASKS_DATA_DIR, MANIFEST_PATH))
+print('Shard {:d} of {:d}: {:d} tiles, output folder {}'.format(args.shard, args.num_shards, len(tile_names), OUTPUT_DIR))
 
 start = time.time()
-corine2018_buckets = collect_statistics(MASKS_DATA_DIR, start_tile_index, end_tile_index, print_msg=True)
+statistics = collect_class_statistics(MASKS_DATA_DIR, 0, None, partials_dir=args.partials_dir, 
+                                      num_workers=args.num_workers, print_msg=True, 
+                                      manifest_path=MANIFEST_PATH, tile_names=tile_names)
 end = time.time()
 elapsed_time = end - start
 print('Elapsed time (seconds): {:.2f}'.format(elapsed_time))
+print('Number of masks: {:d}'.format(statistics['num_masks']))
+if (statistics['missing_masks'] > 0):
+    print('Patches without a reference map: {:d}'.format(statistics['missing_masks']))
+
+corine2018_buckets = statistics['image_counts'].astype(np.float64)
+save_statistics(corine2018_buckets, OUTPUT_DIR + '/statistics.txt')
+save_class_statistics(statistics, OUTPUT_DIR + '/statistics.npz')
 
-save_statistics(corine2018_buckets, 'data/statistics.txt')
+## Build the class presence index from the counts of the tiles
+partial_paths = [os.path.join(args.partials_dir, tile_name + '.npz') for tile_name in tile_names]
+class_index = build_class_index([partial_path for partial_path in partial_paths if os.path.isfile(partial_path)])
+save_class_index(class_index, OUTPUT_DIR + '/class_index.npz')
+print('Class presence index: {:d} patches'.format(len(class_index)))
 
 print('Done !')
\ No newline at end of file
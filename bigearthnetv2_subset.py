@@ -0,0 +1,57 @@
+from lib.bigearthnetv2_lib import *
+import argparse
+
+'''
+This script selects a subset of the BigEarthNetv2 patches in which the Corine2018
+Level 3 classes are as balanced as possible, using the class presence index created
+by bigearthnetv2_statistics.py, without reading the masks. The ids of the patches
+of the subset, e.g. R022_T33UUP_26_57_20170613, are saved in a text file, one per
+line, in a random order given by the seed. The script can be executed using the
+command line from the root folder of the dl_remote_sensing project repository with
+the index file, the size of the subset and the target file, e.g.
+
+>python bigearthnetv2_subset.py data/class_index.npz 75000 data/bigearthnet_exp4.txt
+
+By default each class gets the same quota of patches. The quotas of some classes
+can be set with the --quota option, with the Corine2018 code and the number of
+patches, and the other classes are then filled with random patches, e.g.
+
+>python bigearthnetv2_subset.py data/class_index.npz 75000 data/bigearthnet_exp4.txt --quota 213=2000 --quota 422=2000
+
+The number of patches that contain each class in the index and in the subset
+is printed. This script imports some functions from the bigearthnetv2_lib.py
+python script in the lib/ subfolder.
+'''
+
+parser = argparse.ArgumentParser(description='Selects a class-balanced subset of the patches.')
+parser.add_argument('index_file', help='class presence index created by bigearthnetv2_statistics.py')
+parser.add_argument('size', type=int, help='number of patches of the subset')
+parser.add_argument('target_file', help='text file of the ids of the patches of the subset')
+parser.add_argument('--quota', action='append', default=[], help='minimum number of patches of a class, code=number')
+parser.add_argument('--min-fraction', type=float, default=0.0, help='minimum fraction of the pixels of a class in a patch')
+parser.add_argument('--seed', type=int, default=0, help='seed of the random order of the patches')
+args = parser.parse_args()
+
+class_index = read_class_index(args.index_file)
+print('Class presence index: {:d} patches'.format(len(class_index)))
+quotas = None
+if (len(args.quota) > 0):
+    quotas = {int(code): int(number) for code, number in (quota.split('=') for quota in args.quota)}
+
+start = time.time()
+positions = sample_class_subset(class_index, args.size, quotas=quotas, min_fraction=args.min_fraction, seed=args.seed)
+end = time.time()
+print('Elapsed time (seconds): {:.2f}'.format(end - start))
+
+index_counts = class_index.class_counts()
+subset_counts = class_index.class_counts(positions)
+print('Class: patches in the index -> patches in the subset')
+for class_number, code in enumerate(CORINE2018_L3_CODES):
+    if (index_counts[class_number] > 0):
+        print('{:d}: {:d} -> {:d}'.format(code, index_counts[class_number], subset_counts[class_number]))
+
+with open(args.target_file, 'w') as f:
+    f.writelines(patch_id + '\n' for patch_id in class_index.patch_ids[positions])
+print('Number of patches in the subset: {:d}'.format(len(positions)))
+
+print('Done !')
@@ -1,41 +1,118 @@
 import numpy as np
 import os
-import sys
-from osgeo import gdal, osr, ogr
 import pathlib
 import time
 import rasterio
-from rasterio.plot import show_hist
-from rasterio.plot import show
-import PIL
-from PIL import Image, ImageDraw
-from skimage import io
-from skimage import exposure
-from skimage.io import imread
-import tifffile as tiff
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.colors as mcol
-from matplotlib import cm, ticker
-from matplotlib.colors import ListedColormap, LinearSegmentedColormap 
+from rasterio.io import MemoryFile
 import zipfile
 from zipfile import ZipFile
+import multiprocessing
+import functools
+import sqlite3
+import json
+import zlib
+import collections
+import io
+import struct
+import threading
+import queue
+import contextlib
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 warnings.filterwarnings('ignore')
 
 '''
 This script implements some functions to create PNG RGB images 
 from TIFF images and masks of the BigEarthNet dataset.
+It only imports the packages used to read and write the rasters,
+so that the scripts and the worker processes start quickly. GDAL, 
+PIL, matplotlib and TensorFlow are imported by the functions that 
+use them the first time they are called. The notebooks can run 
+lib/bigearthnetv2_viz.py to import also the visualization packages.
+The raster cache, the archives, the batch loader and the inference 
+are also in this script: they only import the standard library and 
+NumPy, and the cache and the archives are used by the raster I/O.
 '''
+## The names imported by 'from lib.bigearthnetv2_lib import *': the functions,
+## classes and constants of the library and the packages that the scripts and
+## the notebooks have always got from it. The other modules imported above are
+## not exported, e.g. io would replace skimage.io in the notebooks.
+__all__ = ['np', 'os', 'pathlib', 'time', 'rasterio', 'zipfile', 'ZipFile', 'warnings',
+           # 1) Data collection
+           'SENTINEL2_BANDS', 'SENTINEL2_BAND_RESOLUTIONS', 'read_band_name', 'read_mask_name',
+           'create_png_file_name', 'create_mask_png_file_name', 'read_png_name', 'read_patch_id',
+           'list_image_files', 'list_mask_files', 'select_tiles', 'list_tile_names',
+           'shard_tile_names', 'add_shard_arguments', 'select_shard', 'save_shard_info',
+           'read_shard_info', 'tile_order_key', 'read_file_name', 'build_manifest',
+           'read_manifest_tiles', 'read_manifest_files', 'print_images_list', 'print_masks_list',
+           'get_raster_attributes', 'read_georeference',
+           # 2) TIFF to PNG transformation
+           'timed_metric', 'count_metric', 'patch_source_paths', 'PatchJournal', 'StageMetrics',
+           'save_metrics', 'normalize', 'read_normalized_bands', 'RasterCache',
+           'enable_raster_cache', 'disable_raster_cache', 'raster_cache', 'cached_read',
+           'read_mask', 'atomic_target', 'write_png', 'encode_png', 'CODEC_EXTENSIONS',
+           'file_codec', 'codec_file_name', 'stack_bands', 'encode_array', 'decode_array',
+           'read_array_file', 'createPNG', 'createMaskPNG', 'createPNGs', 'createMaskPNGs',
+           'run_patch_tasks', 'exportPatch', 'exportPatches', 'create_band_stack_file_name',
+           'resample_band', 'read_band_stack', 'write_band_stack', 'createBandStack',
+           'createBandStacks', 'delete_files', 'count_unique_occurrence', 'resize_png',
+           'mapCorine', 'create_corine_mask_file_name', 'mapCorine_list', 'mapCorineL3',
+           'mapCorineL3_list', 'mapCorineL1', 'mapCorineL1_list', 'corine2018_l1_class_bucket',
+           'corine2018_l1_labels', 'corine2018_l2_labels', 'bigearthnet19_labels',
+           'corine_l1_color_map',
+           # 3) Compression
+           'PNGArchiveWriter', 'zip_pngs', 'merge_archives', 'unzip_pngs', 'read_png',
+           'write_shards', 'ShardReader', 'PNGArchiveReader', 'dihedral_transform',
+           'random_dihedral_transforms', 'augment_batch', 'BatchLoader',
+           # 4) Normalization
+           'band_histogram', 'collect_band_histograms', 'merge_band_histograms',
+           'save_band_histograms', 'read_band_histograms', 'band_clip_values', 'quantization_lut',
+           'quantize', 'get_image_array', 'norm_image',
+           # 5) Visualization
+           'plot_examples', 'corine_l3_color_map', 'corine_color_lut', 'colorize_mask',
+           'contact_sheet', 'render_contact_sheets', 'corine2018_l3_labels', 'corine_l3_mask',
+           'corine_l2_mask', 'corine_l1_mask', 'corine_bigearthnet19_mask',
+           # 6) Statistics
+           'CORINE2018_L3_CODES', 'CORINE2018_L2_CODES', 'BIGEARTHNET19_L3_CODES',
+           'CORINE2018_NUM_CLASSES', 'corine2018_lut', 'corine_remap', 'corine2018_l3_class_code',
+           'corine2018_l3_class_bucket', 'mask_pixel_counts', 'source_fingerprint',
+           'save_tile_statistics', 'read_tile_statistics', 'read_tile_fingerprint',
+           'merge_statistics', 'merge_class_statistics', 'merge_statistics_files',
+           'class_presence_bits', 'ClassPresenceIndex', 'build_class_index', 'merge_class_indexes',
+           'save_class_index', 'read_class_index', 'sample_class_subset', 'class_weights',
+           'collect_class_statistics', 'collect_statistics', 'save_class_statistics',
+           'read_class_statistics', 'save_statistics', 'read_statistics',
+           # 7) Dataset splits
+           'pair_patch_files', 'split_sizes', 'split_patches', 'save_split', 'read_split',
+           'split_file_paths',
+           # 8) Inference
+           'create_prediction_file_name', 'predict_tiles',
+           # 9) Evaluation
+           'ConfusionMatrix', 'save_confusion_matrix', 'read_confusion_matrix',
+           'evaluate_predictions',
+           # 10) Mosaics
+           'mosaic_grid', 'build_mosaic']
 ## ---------------------------------------------- Start of functions definition -----------------------------------------------
-# The script is divided into four sections: 
+# The script is divided into ten sections: 
 # 1. Data collection
 # 2. TIFF to PNG transformation
 # 3. Compression
 # 4. Normalization
 # 5. Visualization
 # 6. Statistics
+# 7. Dataset splits
+# 8. Inference
+# 9. Evaluation
+# 10. Mosaics
 #------------------------- 1) Data collection --------------------------------------------------
+# Sentinel-2 L2A bands of the BigEarthNet patches and their resolution in meters.
+# The size of a patch is 120x120 pixels for the 10 m. bands, 60x60 for the 20 m.
+# bands and 20x20 for the 60 m. bands.
+SENTINEL2_BANDS = ['B01', 'B02', 'B03', 'B04', 'B05', 'B06', 'B07', 'B08', 'B8A', 'B09', 'B11', 'B12']
+SENTINEL2_BAND_RESOLUTIONS = {'B01': 60, 'B02': 10, 'B03': 10, 'B04': 10, 'B05': 20, 'B06': 20, 
+                              'B07': 20, 'B08': 10, 'B8A': 20, 'B09': 60, 'B11': 20, 'B12': 20}
+
 def read_band_name(band_name):
     '''
     Returns the information encoded in a TIFF image band file name:
@@ -63,44 +140,89 @@ def create_png_file_name(tile, patch, date):
 def create_mask_png_file_name(tile, patch, date):
     return tile + '_' + patch + '_' + date + '_mask.png'
 
-def list_image_files(root_path, start_tile_index, end_tile_index):
+def read_png_name(png_name):
+    '''
+    Returns the information encoded in the name of the PNG image and mask
+    files created by create_png_file_name and create_mask_png_file_name:
+    tile, patch, and date of acquisition.
+    '''
+    tile = png_name[:11]
+    patch = png_name[12:17]
+    date = png_name[18:26]
+    return tile, patch, date
+
+def read_patch_id(file_name):
+    '''
+    Returns the id of a patch, tile_patch_date, e.g. R022_T33UUP_26_57_20170613,
+    from the name of any of its files: a TIFF band, a reference map, a PNG 
+    image or mask, or a predicted mask (see create_prediction_file_name).
+    '''
+    if (file_name.endswith('_reference_map.tif')):
+        tile, patch, date = read_mask_name(file_name)
+    elif (file_name.endswith('_pred.tif')):
+        tile, patch, date = read_png_name(file_name)
+    elif (file_name.endswith('.tif')):
+        tile, patch, band, date = read_band_name(file_name)
+    else:
+        tile, patch, date = read_png_name(file_name)
+    return tile + '_' + patch + '_' + date
+
+def list_image_files(root_path, start_tile_index, end_tile_index, manifest_path=None, 
+                     bands=('B02', 'B03', 'B04'), tile_names=None):
     '''
     This function creates a list of tiles each containing
     lists of patches with three RGB bands each or a mask.
     The 2nd argument is the index of the first tile to be included. 
     The 3rd argument is the number of tiles to be returned. 
-    '''
+    If the path of a manifest created by build_manifest is passed
+    the lists are read from the manifest instead of the file system.
+    Other bands can be selected with the bands list, e.g. 
+    SENTINEL2_BANDS for all of them. The tiles, the patches and the 
+    bands are sorted by name so that the lists are the same on every 
+    machine. If a list of tile folder names is passed, e.g. the tiles 
+    of a shard (see shard_tile_names), only those tiles are included.
+    '''
+    if (manifest_path is not None):
+        return read_manifest_files(manifest_path, root_path, start_tile_index, end_tile_index, 
+                                   bands=list(bands), tile_names=tile_names)
     tiles_list = []
-    tiles_paths = [pathlib.Path(x) for x in root_path.iterdir() if x.is_dir()]
-    for tile_path in tiles_paths[start_tile_index:end_tile_index]:
+    tiles_paths = sorted(pathlib.Path(x) for x in root_path.iterdir() if x.is_dir())
+    for tile_path in select_tiles(tiles_paths[start_tile_index:end_tile_index], tile_names):
         # print(tile_path.name)
         patches_list = []
-        for patches_path in tile_path.iterdir():
+        for patches_path in sorted(tile_path.iterdir()):
             bands_list = []
-            for band_path in patches_path.iterdir():
+            for band_path in sorted(patches_path.iterdir()):
                 band_type = band_path.name[-7:]
-                if (band_type == 'B02.tif' or band_type == 'B03.tif' or band_type == 'B04.tif'):
+                if (band_type[-4:] == '.tif' and band_type[:3] in bands):
                     bands_list.append(band_path)
             patches_list.append(bands_list)
         tiles_list.append(patches_list)
     return tiles_list
 
-def list_mask_files(root_path, start_tile_index, end_tile_index):
+def list_mask_files(root_path, start_tile_index, end_tile_index, manifest_path=None, tile_names=None):
     '''
     This function, like the one for bands, creates a list of tiles 
     each containing lists of patches with a mask.
     The 2nd argument is the index of the first tile to be included. 
     The 3rd argument is the number of tiles to be returned. 
-    '''
+    If the path of a manifest created by build_manifest is passed
+    the lists are read from the manifest instead of the file system.
+    The tiles and the patches are sorted by name. If a list of tile 
+    folder names is passed only those tiles are included.
+    '''
+    if (manifest_path is not None):
+        return read_manifest_files(manifest_path, root_path, start_tile_index, end_tile_index, 
+                                   bands=['map'], tile_names=tile_names)
     tiles_list = []
-    tiles_paths = [pathlib.Path(x) for x in root_path.iterdir() if x.is_dir()]
+    tiles_paths = sorted(pathlib.Path(x) for x in root_path.iterdir() if x.is_dir())
     #print('Number of tiles: ', len(tiles_paths))
-    for tile_path in tiles_paths[start_tile_index:end_tile_index]:
+    for tile_path in select_tiles(tiles_paths[start_tile_index:end_tile_index], tile_names):
         #print('Tile:', tile_path.name)
         patches_list = []
-        for patch_path in tile_path.iterdir():
+        for patch_path in sorted(tile_path.iterdir()):
             mask_list = []
-            for mask_path in patch_path.iterdir():
+            for mask_path in sorted(patch_path.iterdir()):
                 file_type = mask_path.name[-7:]
                 #print('File type: {}'.format(file_type))
                 if (file_type == 'map.tif'):
@@ -109,6 +231,243 @@ def list_mask_files(root_path, start_tile_index, end_tile_index):
         tiles_list.append(patches_list)
     return tiles_list
 
+def select_tiles(tile_paths, tile_names=None):
+    '''
+    Returns the paths of the tiles whose folder name is in the list
+    of tile names, or all of them if the list is None.
+    '''
+    if (tile_names is None):
+        return tile_paths
+    tile_names = set(tile_names)
+    return [tile_path for tile_path in tile_paths if pathlib.Path(tile_path).name in tile_names]
+
+def list_tile_names(root_path, manifest_path=None):
+    '''
+    Returns the sorted list of the names of the tile folders in the root
+    path, from the manifest if its path is passed (see build_manifest).
+    '''
+    if (manifest_path is not None):
+        return [pathlib.Path(tile_path).name for tile_path in read_manifest_tiles(manifest_path, root_path)]
+    return sorted(entry.name for entry in os.scandir(root_path) if entry.is_dir())
+
+def shard_tile_names(tile_names, shard_index, num_shards, method='sorted'):
+    '''
+    Returns the names of the tiles assigned to one of num_shards shards,
+    with index in [0, num_shards), so that the shards can be processed
+    independently, e.g. on different nodes. The assignment only depends 
+    on the names of the tiles. With method 'sorted' the tiles, sorted by 
+    name, are assigned in turn to each shard so that the shards have the 
+    same number of tiles. With method 'hash' a tile is assigned by a hash 
+    of its name so that adding new tiles doesn't move the other ones to 
+    a different shard. The names are returned sorted.
+    '''
+    if (not 0 <= shard_index < num_shards):
+        raise ValueError('Shard index {:d} not in [0, {:d})'.format(shard_index, num_shards))
+    tile_names = sorted(tile_names)
+    if (method == 'sorted'):
+        return tile_names[shard_index::num_shards]
+    if (method == 'hash'):
+        return [tile_name for tile_name in tile_names 
+                if int(hashlib.md5(tile_name.encode()).hexdigest(), 16) % num_shards == shard_index]
+    raise ValueError('Unknown shard method: {}'.format(method))
+
+def add_shard_arguments(parser):
+    '''
+    Adds to the argparse parser of a script the arguments to select the tiles
+    to be processed: the range of the tiles, sorted by name, and the shard.
+    '''
+    parser.add_argument('--start-tile', type=int, default=0, help='index of the first tile, tiles sorted by name')
+    parser.add_argument('--end-tile', type=int, default=None, help='index after the last tile, by default all the tiles')
+    parser.add_argument('--shard', type=int, default=0, help='index of the shard processed by this run')
+    parser.add_argument('--num-shards', type=int, default=1, help='number of shards of the tiles')
+    parser.add_argument('--shard-method', choices=['sorted', 'hash'], default='sorted', 
+                        help='assignment of the tiles to the shards (see shard_tile_names)')
+    parser.add_argument('--output-dir', default='data', help='folder of the output files')
+
+def select_shard(args, tile_names):
+    '''
+    Returns the names of the tiles selected by the arguments added by 
+    add_shard_arguments and the folder of the output files. The output 
+    files of a shard are saved in a subfolder of the output folder, e.g.
+    data/shard_001_of_004, together with a shard.json file with the 
+    shard and the names of its tiles (see bigearthnetv2_merge.py).
+    '''
+    tile_names = sorted(tile_names)[args.start_tile:args.end_tile]
+    shard_names = shard_tile_names(tile_names, args.shard, args.num_shards, args.shard_method)
+    output_dir = args.output_dir
+    if (args.num_shards > 1):
+        output_dir = os.path.join(output_dir, 'shard_{:03d}_of_{:03d}'.format(args.shard, args.num_shards))
+    os.makedirs(output_dir, exist_ok=True)
+    save_shard_info(os.path.join(output_dir, 'shard.json'), args.shard, args.num_shards, 
+                    args.shard_method, shard_names)
+    return shard_names, output_dir
+
+def save_shard_info(file_path, shard_index, num_shards, method, tile_names):
+    with open(file_path, 'w') as f:
+        json.dump({'shard': shard_index, 'num_shards': num_shards, 'method': method, 'tiles': tile_names}, f, indent=2)
+
+def read_shard_info(file_path):
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+def tile_order_key(tile_names):
+    '''
+    Returns a function that maps the name of a PNG file of a patch to its
+    position in the lists of list_image_files and list_mask_files: the name 
+    of the tile folder and the patch. The date, orbit and tile in the name of 
+    the PNG file (see read_png_name) are matched to the names of the tile 
+    folders in the list. It is used to merge the outputs of different shards 
+    in the same order of a single run.
+    '''
+    tile_folders = {(tile_name[-11:], tile_name[11:19]): tile_name for tile_name in tile_names}
+    def order_key(file_name):
+        tile, patch, date = read_png_name(pathlib.Path(file_name).name)
+        return tile_folders[(tile, date)], patch
+    return order_key
+
+def read_file_name(file_name):
+    '''
+    Returns tile, patch, band, and date of acquisition of a BigEarthNet 
+    file. The band of a mask file is 'map'. For the files that are neither 
+    a band nor a mask, e.g. the PNG files, all the values are None.
+    '''
+    if (file_name.endswith('_reference_map.tif')):
+        tile, patch, date = read_mask_name(file_name)
+        return tile, patch, 'map', date
+    if (file_name.endswith('.tif') and file_name[-8:-7] == '_'):
+        return read_band_name(file_name)
+    return None, None, None, None
+
+def _scan_tile(tile_path, root_path, known_mtimes, known_subdirs):
+    '''
+    Worker task of build_manifest. It compares the modification time of the
+    tile folder and of its patch folders with the ones stored in the manifest
+    and lists again with os.scandir only the folders that have changed.
+    Returns the (path, parent, mtime) of the folders, the files of the 
+    folders that have been listed again and the folders that have been removed.
+    '''
+    folders = []
+    listed_folders = []
+    files = []
+    tile_mtime = os.stat(tile_path).st_mtime_ns
+    folders.append((tile_path, root_path, tile_mtime))
+    if (known_mtimes.get(tile_path) == tile_mtime):
+        patch_paths = known_subdirs.get(tile_path, [])
+    else:
+        with os.scandir(tile_path) as entries:
+            patch_paths = sorted([entry.path for entry in entries if entry.is_dir()])
+    patch_paths_set = set(patch_paths)
+    removed_folders = [path for path in known_subdirs.get(tile_path, []) if path not in patch_paths_set]
+    for patch_path in patch_paths:
+        try:
+            patch_mtime = os.stat(patch_path).st_mtime_ns
+        except FileNotFoundError:
+            removed_folders.append(patch_path)
+            continue
+        folders.append((patch_path, tile_path, patch_mtime))
+        if (known_mtimes.get(patch_path) == patch_mtime):
+            continue
+        listed_folders.append(patch_path)
+        with os.scandir(patch_path) as entries:
+            for entry in entries:
+                if (entry.is_file()):
+                    tile, patch, band, date = read_file_name(entry.name)
+                    files.append((entry.path, patch_path, tile_path, tile, patch, band, date))
+    return folders, listed_folders, files, removed_folders
+
+def build_manifest(root_path, manifest_path, num_workers=16):
+    '''
+    This function creates, or updates, a SQLite manifest of the files in 
+    the BigEarthNet-S2 or Reference_Maps folder passed as root path. For 
+    each file it stores tile, patch, band, date and path. The tiles are 
+    scanned in parallel by num_workers threads using os.scandir. The 
+    modification time of each folder is stored as well so that when the 
+    manifest already exists only the folders whose modification time has
+    changed are listed again. The images and the masks can be stored in 
+    the same manifest. Returns the number of files in the manifest for the
+    root path.
+    '''
+    root_path = str(pathlib.Path(root_path).resolve())
+    with sqlite3.connect(manifest_path) as connection:
+        connection.execute('CREATE TABLE IF NOT EXISTS folders (path TEXT PRIMARY KEY, parent TEXT, mtime INTEGER)')
+        connection.execute('CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, folder TEXT, tile_folder TEXT, '
+                           'tile TEXT, patch TEXT, band TEXT, date TEXT)')
+        connection.execute('CREATE INDEX IF NOT EXISTS folders_parent ON folders (parent)')
+        connection.execute('CREATE INDEX IF NOT EXISTS files_folder ON files (folder)')
+        connection.execute('CREATE INDEX IF NOT EXISTS files_tile_folder ON files (tile_folder, band)')
+        known_mtimes = {}
+        known_subdirs = {}
+        for path, parent, mtime in connection.execute('SELECT path, parent, mtime FROM folders'):
+            known_mtimes[path] = mtime
+            known_subdirs.setdefault(parent, []).append(path)
+        
+        root_mtime = os.stat(root_path).st_mtime_ns
+        if (known_mtimes.get(root_path) == root_mtime):
+            tile_paths = known_subdirs.get(root_path, [])
+        else:
+            with os.scandir(root_path) as entries:
+                tile_paths = sorted([entry.path for entry in entries if entry.is_dir()])
+        tile_paths_set = set(tile_paths)
+        removed_tiles = [path for path in known_subdirs.get(root_path, []) if path not in tile_paths_set]
+        
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results = executor.map(lambda tile_path: _scan_tile(tile_path, root_path, known_mtimes, known_subdirs), tile_paths)
+            connection.execute('INSERT OR REPLACE INTO folders VALUES (?, ?, ?)', (root_path, '', root_mtime))
+            num_listed_folders = 0
+            for folders, listed_folders, files, removed_folders in results:
+                for folder in removed_folders + listed_folders:
+                    connection.execute('DELETE FROM files WHERE folder = ?', (folder,))
+                for folder in removed_folders:
+                    connection.execute('DELETE FROM folders WHERE path = ?', (folder,))
+                connection.executemany('INSERT OR REPLACE INTO folders VALUES (?, ?, ?)', folders)
+                connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)', files)
+                num_listed_folders += len(listed_folders)
+        for tile_path in removed_tiles:
+            connection.execute('DELETE FROM files WHERE tile_folder = ?', (tile_path,))
+            connection.execute('DELETE FROM folders WHERE path = ? OR parent = ?', (tile_path, tile_path))
+        num_files = connection.execute('SELECT COUNT(*) FROM files f JOIN folders t ON f.tile_folder = t.path '
+                                       'WHERE t.parent = ?', (root_path,)).fetchone()[0]
+    connection.close()
+    print('Manifest {}: {:d} folders listed, {:d} files'.format(manifest_path, num_listed_folders, num_files))
+    return num_files
+
+def read_manifest_tiles(manifest_path, root_path):
+    '''
+    Returns the sorted list of the paths of the tile folders 
+    stored in the manifest for the root path.
+    '''
+    root_path = str(pathlib.Path(root_path).resolve())
+    with sqlite3.connect(manifest_path) as connection:
+        rows = connection.execute('SELECT path FROM folders WHERE parent = ? ORDER BY path', (root_path,)).fetchall()
+    connection.close()
+    return [row[0] for row in rows]
+
+def read_manifest_files(manifest_path, root_path, start_tile_index, end_tile_index, bands, tile_names=None):
+    '''
+    This function reads from the manifest the same nested lists returned 
+    by list_image_files and list_mask_files: a list of tiles each containing 
+    lists of patches with the paths of the files of the selected bands. The 
+    band of a mask is 'map'. The tiles are sorted by name. If a list of tile
+    folder names is passed only those tiles are included.
+    '''
+    tile_paths = read_manifest_tiles(manifest_path, root_path)
+    band_params = ','.join('?' * len(bands))
+    tiles_list = []
+    with sqlite3.connect(manifest_path) as connection:
+        for tile_path in select_tiles(tile_paths[start_tile_index:end_tile_index], tile_names):
+            rows = connection.execute('SELECT folder, path FROM files WHERE tile_folder = ? AND band IN ({}) '
+                                      'ORDER BY folder, path'.format(band_params), [tile_path] + list(bands))
+            patches_list = []
+            last_folder = None
+            for folder, path in rows:
+                if (folder != last_folder):
+                    patches_list.append([])
+                    last_folder = folder
+                patches_list[-1].append(pathlib.Path(path))
+            tiles_list.append(patches_list)
+    connection.close()
+    return tiles_list
+
 def print_images_list(tiles_list): 
     '''
     Prints the content of the nested folders
@@ -165,7 +524,248 @@ def get_raster_attributes(img_path):
         print('Bounding box \n left: {:.2f}, \n bottom: {:.2f}, \n right: {:.2f}, \n top: {:.2f}'.format(bb_left, bb_bottom, bb_right, bb_top))                                                   
     return width, height, d_type, transform
 
+def read_georeference(img_path):
+    '''
+    Returns the georeference of a raster, the same attributes read by 
+    get_raster_attributes without printing them, in a dictionary with 
+    the crs, the transform, the width and the height.
+    '''
+    with rasterio.open(img_path) as dataset:
+        return {'crs': dataset.crs, 'transform': dataset.transform, 
+                'width': dataset.width, 'height': dataset.height}
+
 #----------------------------2) TIFF to PNG transformation ----------------------------------
+# Counters of the patch processed by a task of run_patch_tasks: the time spent
+# reading the rasters, transforming the bands, encoding and writing the PNG files, the
+# bytes read, encoded and written and the files skipped because they already exist. The
+# workers of run_patch_tasks return the counters of each patch to the parent 
+# process where they are collected by StageMetrics. The counters are local to 
+# the thread that runs the task and they are set only while the task runs, so 
+# the functions that record them can also be called from other threads, e.g. 
+# by BatchLoader, where they do nothing.
+_metric_state = threading.local()
+
+@contextlib.contextmanager
+def timed_metric(name):
+    '''
+    Adds the time spent in the with block to the counter name_seconds, e.g. 
+    read_seconds, of the patch that is processed, if any.
+    '''
+    counters = getattr(_metric_state, 'counters', None)
+    if (counters is None):
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        counters[name + '_seconds'] += time.perf_counter() - start
+
+def count_metric(name, value=1):
+    '''
+    Adds the value to a counter of the patch that is processed, if any, e.g. bytes_read.
+    '''
+    counters = getattr(_metric_state, 'counters', None)
+    if (counters is not None):
+        counters[name] += value
+
+def _instrumented_task(task, task_function, use_journal=False):
+    '''
+    Applies the task function of run_patch_tasks to a patch and returns the
+    position of the patch, the tuple returned by the task, the fingerprint
+    of the source files of the patch, if a journal is used, and the counters 
+    of the patch. If the fingerprint is the same as the one in the journal 
+    the task is not applied and the result is None.
+    '''
+    position, patch_task, journal_fingerprint = task
+    counters = collections.Counter()
+    _metric_state.counters = counters
+    try:
+        start = time.perf_counter()
+        fingerprint = None
+        if (use_journal):
+            with timed_metric('fingerprint'):
+                fingerprint = source_fingerprint(patch_source_paths(patch_task[1]))
+            if (fingerprint is not None and fingerprint == journal_fingerprint):
+                counters['journal_skipped'] += 1
+                return position, patch_task[0], None, None, fingerprint, dict(counters)
+        tile_index, result, error = task_function(patch_task)
+        counters['task_seconds'] += time.perf_counter() - start
+        return position, tile_index, result, error, fingerprint, dict(counters)
+    finally:
+        _metric_state.counters = None
+
+def patch_source_paths(patch):
+    '''
+    Returns the list of the source files of a patch of run_patch_tasks, 
+    e.g. a list of bands or a tuple with a list of bands and a mask.
+    '''
+    if (isinstance(patch, (list, tuple))):
+        return [path for item in patch for path in patch_source_paths(item)]
+    return [] if patch is None else [patch]
+
+class PatchJournal:
+    '''
+    This class implements an append-only journal of the patches completed 
+    by run_patch_tasks: a text file with one JSON record per line. The record 
+    of a patch contains its tile, the fingerprint of its source files (see 
+    source_fingerprint) and the result of its task, e.g. the PNG file name.
+    The record of a tile is added when all its patches have been completed. 
+    The records are written as soon as the patches are completed, so a run 
+    that is killed loses at most the patches in progress, and a line truncated 
+    by the kill is ignored. A journal shall be used for one conversion with 
+    the same options, e.g. one for the images and one for the masks. 
+    '''
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.patches = {}
+        self.completed_tiles = set()
+        complete_line = True
+        if (os.path.isfile(journal_path)):
+            with open(journal_path, 'r') as journal_file:
+                for line in journal_file:
+                    complete_line = line.endswith('\n')
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if ('patch' in record):
+                        self.patches[record['patch']] = (record['fingerprint'], record['result'])
+                    else:
+                        self.completed_tiles.add(record['tile'])
+        self.journal_file = open(journal_path, 'a')
+        if (not complete_line):
+            self.journal_file.write('\n')
+
+    @staticmethod
+    def patch_keys(patch):
+        '''
+        Returns the names of the tile folder and of the patch folder of 
+        the first source file of a patch, used as keys in the journal.
+        '''
+        source_path = pathlib.Path(patch_source_paths(patch)[0])
+        return source_path.parent.parent.name, source_path.parent.name
+
+    def add_patch(self, tile_key, patch_key, fingerprint, result):
+        self.patches[patch_key] = (fingerprint, result)
+        self._write({'patch': patch_key, 'tile': tile_key, 'fingerprint': fingerprint, 'result': result})
+
+    def add_tile(self, tile_key):
+        self.completed_tiles.add(tile_key)
+        self._write({'tile': tile_key})
+        os.fsync(self.journal_file.fileno())
+
+    def _write(self, record):
+        self.journal_file.write(json.dumps(record) + '\n')
+        self.journal_file.flush()
+
+    def close(self):
+        self.journal_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class StageMetrics:
+    '''
+    This class collects the metrics of a stage of the data preparation, e.g. 
+    the export of the PNG files: the wall time, the number of patches processed 
+    and failed, the time spent by the workers reading, transforming, encoding 
+    and writing, the bytes read and written and the number of files skipped 
+    because they already exist, in total and for each tile. While the stage
+    runs a line with the throughput and the estimated time to complete is 
+    printed every report_interval seconds. The counters are cheap, some calls
+    to time.perf_counter for each patch, and can always be on. 
+    '''
+    def __init__(self, stage, num_patches=None, report_interval=60.0, print_msg=True):
+        self.stage = stage
+        self.num_patches = num_patches
+        self.expected_patches = num_patches is None
+        self.report_interval = report_interval
+        self.print_msg = print_msg
+        self.counters = collections.Counter()
+        self.tiles = collections.defaultdict(collections.Counter)
+        self.start_time = time.perf_counter()
+        self.last_report_time = self.start_time
+        self.wall_seconds = None
+
+    def expect(self, num_patches):
+        '''
+        Adds the number of patches of a run to the total used to estimate the 
+        time to complete, unless the total was passed when the object was created.
+        '''
+        if (self.expected_patches):
+            self.num_patches = (self.num_patches or 0) + num_patches
+
+    def add(self, counters, tile=None):
+        '''
+        Adds the counters of a patch, or of a whole stage, to the totals and 
+        to the ones of the tile, if passed, and prints the progress line
+        if report_interval seconds have passed since the last one.
+        '''
+        self.counters.update(counters)
+        if (tile is not None):
+            self.tiles[tile].update(counters)
+        now = time.perf_counter()
+        if (self.print_msg and now - self.last_report_time >= self.report_interval):
+            self.last_report_time = now
+            print(self.progress())
+
+    def tile_completed(self, tile):
+        self.tiles[tile]['completed_seconds'] = time.perf_counter() - self.start_time
+
+    def progress(self):
+        '''
+        Returns a line with the patches processed, the throughput and the
+        estimated time to complete the stage.
+        '''
+        elapsed_time = time.perf_counter() - self.start_time
+        patches = self.counters['patches']
+        throughput = patches / elapsed_time if elapsed_time > 0 else 0.0
+        line = '{}: {:d}'.format(self.stage, patches)
+        if (self.num_patches is not None):
+            line += '/{:d}'.format(self.num_patches)
+        line += ' patches, {:.1f} patches/s'.format(throughput)
+        if (self.num_patches is not None and throughput > 0):
+            eta = int((self.num_patches - patches) / throughput)
+            line += ', ETA {:d}:{:02d}:{:02d}'.format(eta // 3600, eta // 60 % 60, eta % 60)
+        return line
+
+    def stop(self):
+        '''
+        Stops the wall clock of the stage and prints a summary with the share
+        of the time of the workers spent reading, transforming, encoding and 
+        writing.
+        '''
+        self.wall_seconds = time.perf_counter() - self.start_time
+        if (self.print_msg):
+            task_seconds = self.counters['task_seconds']
+            shares = ['{} {:.0f}%'.format(name, 100 * self.counters[name + '_seconds'] / task_seconds)
+                      for name in ('read', 'transform', 'predict', 'encode', 'write') 
+                      if task_seconds > 0 and name + '_seconds' in self.counters]
+            print('{}: {:d} patches in {:.1f} s{}'.format(self.stage, self.counters['patches'], 
+                                                         self.wall_seconds, ', ' + ', '.join(shares) if shares else ''))
+        return self
+
+    def report(self):
+        '''
+        Returns a dictionary with the metrics of the stage that can be saved in JSON format.
+        '''
+        wall_seconds = self.wall_seconds if self.wall_seconds is not None else time.perf_counter() - self.start_time
+        return {'stage': self.stage,
+                'wall_seconds': wall_seconds,
+                'patches_per_second': self.counters['patches'] / wall_seconds if wall_seconds > 0 else 0.0,
+                'totals': dict(self.counters),
+                'tiles': {str(tile): dict(counters) for tile, counters in self.tiles.items()}}
+
+def save_metrics(metrics_list, file_path):
+    '''
+    Saves the reports of a list of StageMetrics in a JSON file.
+    '''
+    with open(file_path, 'w') as f:
+        json.dump([metrics.report() for metrics in metrics_list], f, indent=2)
 
 def normalize(data_array):
     '''
@@ -173,131 +773,929 @@ def normalize(data_array):
     '''
     return (data_array - np.min(data_array)) * ((255 - 0) / (np.max(data_array) - np.min(data_array))) + 0
 
-def createPNG(source_path_list, target_path):
+def read_normalized_bands(source_path_list, clip_values=None):
+    '''
+    This function reads the bands from a list of GeoTIFF files containing
+    one band each, opening each file once, and returns the list of the 
+    bands normalized to [0, 255]. If clip_values is None each band is 
+    stretched between its own min and max (see normalize), otherwise 
+    clip_values is a dictionary with the (low, high) values of each 
+    band, e.g. 'B04', computed on the whole dataset by band_clip_values, 
+    and the bands are quantized to uint8 by quantize.
+    '''
+    band_list = []
+    for raster_path in source_path_list:
+        with timed_metric('read'):
+            with rasterio.open(raster_path) as dataset:
+                band = dataset.read(1)
+            count_metric('bytes_read', os.path.getsize(raster_path))
+        with timed_metric('transform'):
+            if (clip_values is None):
+                band_list.append(normalize(band))
+            else:
+                band_name = read_band_name(pathlib.Path(raster_path).name)[2]
+                band_list.append(quantize(band, *clip_values[band_name]))
+    return band_list
+
+class RasterCache:
+    '''
+    This class implements a cache of the decoded arrays of raster files, e.g. 
+    the masks read by read_mask, so that a file read again, e.g. to compute the 
+    statistics and then the level 1 and level 3 masks or to plot it, is not 
+    decoded again. The arrays are identified by the path, the modification time 
+    and the size of the file, so a file that changes is read again. The cache 
+    keeps up to max_bytes bytes of arrays and evicts the least recently used ones. 
+    The arrays are read-only and shall be copied to be modified. If a shared name 
+    is passed the decoded arrays are also published in shared memory segments, 
+    named shared_name followed by a hash of the file, so that the worker processes 
+    of a pool, or other loaders on the same machine, copy the array from shared 
+    memory instead of decoding the file again. Each process keeps up to max_bytes
+    bytes of the segments it created and removes the oldest ones. The segments are
+    removed by close, that shall be called by the process that enabled the cache 
+    when the workers have completed. The cache is shared with the workers of a pool
+    only with the fork start method, the default on Linux, with which the workers 
+    inherit the cache enabled in the parent process; with spawn or forkserver each 
+    worker shall enable its own cache with the same shared name. A segment that is 
+    still being written by another process is a miss. The number of hits, shared 
+    hits, misses and evictions are counted.
+    '''
+    HEADER_SIZE = 256
+
+    def __init__(self, max_bytes=512 * 2**20, shared_name=None):
+        self.max_bytes = max_bytes
+        self.shared_name = shared_name
+        self.entries = collections.OrderedDict()
+        self.num_bytes = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.segments = collections.OrderedDict()
+        self.segment_bytes = 0
+        if (shared_name is not None):
+            # The workers forked later share the resource tracker of this process, 
+            # otherwise each one would start its own, that removes the segments 
+            # created by the worker when it exits
+            from multiprocessing import resource_tracker
+            resource_tracker.ensure_running()
+
+    @staticmethod
+    def key(path):
+        stat = os.stat(path)
+        return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path, reader):
+        '''
+        Returns the array of the file decoded by reader(path) from the cache, 
+        from the shared memory or from the reader, in this order.
+        '''
+        key = self.key(path)
+        with self.lock:
+            if (key in self.entries):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+        array = self._attach(key) if self.shared_name is not None else None
+        if (array is None):
+            array = np.asarray(reader(path))
+            with self.lock:
+                self.misses += 1
+            if (self.shared_name is not None):
+                self._publish(key, array)
+        else:
+            with self.lock:
+                self.shared_hits += 1
+        array.flags.writeable = False
+        with self.lock:
+            if (key not in self.entries):
+                self.entries[key] = array
+                self.num_bytes += array.nbytes
+            while (self.num_bytes > self.max_bytes and len(self.entries) > 1):
+                evicted_key, evicted_array = self.entries.popitem(last=False)
+                self.num_bytes -= evicted_array.nbytes
+                self.evictions += 1
+        return array
+
+    def _segment_name(self, key):
+        return '{}_{}'.format(self.shared_name, hashlib.blake2b(repr(key).encode(), digest_size=12).hexdigest())
+
+    def _attach(self, key):
+        from multiprocessing import shared_memory
+        try:
+            segment = shared_memory.SharedMemory(name=self._segment_name(key))
+        except (FileNotFoundError, ValueError):
+            # ValueError: the segment was created by another process but not sized yet
+            return None
+        try:
+            if (segment.size < self.HEADER_SIZE):
+                return None
+            header = bytes(segment.buf[:self.HEADER_SIZE])
+            if (header[0] != 1):
+                return None
+            description = json.loads(header[1:].rstrip(b'\0').decode())
+            view = np.ndarray(tuple(description['shape']), dtype=description['dtype'], 
+                              buffer=segment.buf, offset=self.HEADER_SIZE)
+            array = view.copy()
+            del view
+            return array
+        finally:
+            segment.close()
+
+    def _publish(self, key, array):
+        from multiprocessing import shared_memory
+        if (os.getpid() != self.pid):
+            self.pid = os.getpid()
+            self.segments = collections.OrderedDict()
+            self.segment_bytes = 0
+        description = json.dumps({'dtype': array.dtype.str, 'shape': array.shape}).encode()
+        try:
+            segment = shared_memory.SharedMemory(name=self._segment_name(key), create=True, 
+                                                 size=self.HEADER_SIZE + max(array.nbytes, 1))
+        except FileExistsError:
+            return
+        view = np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf, offset=self.HEADER_SIZE)
+        view[...] = array
+        del view
+        segment.buf[1:1 + len(description)] = description
+        segment.buf[0] = 1
+        with self.lock:
+            self.segments[segment.name] = segment
+            self.segment_bytes += segment.size
+            while (self.segment_bytes > self.max_bytes and len(self.segments) > 1):
+                evicted_name, evicted_segment = self.segments.popitem(last=False)
+                self.segment_bytes -= evicted_segment.size
+                evicted_segment.close()
+                evicted_segment.unlink()
+
+    def stats(self):
+        '''
+        Returns a dictionary with the counters and the bytes in the cache.
+        '''
+        return {'hits': self.hits, 'shared_hits': self.shared_hits, 'misses': self.misses, 
+                'evictions': self.evictions, 'entries': len(self.entries), 'bytes': self.num_bytes}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.num_bytes = 0
+
+    def close(self):
+        '''
+        Empties the cache and removes the shared memory segments created by 
+        this process and, on Linux, the ones of the shared name created by 
+        the other processes.
+        '''
+        self.clear()
+        with self.lock:
+            for segment in self.segments.values():
+                segment.close()
+                segment.unlink()
+            self.segments.clear()
+            self.segment_bytes = 0
+        if (self.shared_name is not None and os.path.isdir('/dev/shm')):
+            from multiprocessing import shared_memory
+            for file_name in os.listdir('/dev/shm'):
+                if (file_name.startswith(self.shared_name + '_')):
+                    try:
+                        segment = shared_memory.SharedMemory(name=file_name)
+                    except (FileNotFoundError, ValueError):
+                        continue
+                    segment.close()
+                    try:
+                        segment.unlink()
+                    except FileNotFoundError:
+                        pass
+
+_raster_cache = None
+
+def enable_raster_cache(max_bytes=512 * 2**20, shared_name=None):
+    '''
+    Enables the cache of the arrays read by read_mask, read_png and get_image_array
+    in this process and in the worker processes created later (see RasterCache).
+    Returns the cache.
+    '''
+    global _raster_cache
+    disable_raster_cache()
+    _raster_cache = RasterCache(max_bytes, shared_name)
+    return _raster_cache
+
+def disable_raster_cache():
+    '''
+    Disables the cache of the arrays and removes its shared memory segments.
+    '''
+    global _raster_cache
+    if (_raster_cache is not None):
+        _raster_cache.close()
+    _raster_cache = None
+
+def raster_cache():
+    '''
+    Returns the raster cache, or None if it is not enabled.
+    '''
+    return _raster_cache
+
+def cached_read(path, reader):
+    '''
+    Returns reader(path) from the raster cache, if it is enabled (see 
+    enable_raster_cache), otherwise calls the reader.
+    '''
+    if (_raster_cache is None):
+        return reader(path)
+    return _raster_cache.get(path, reader)
+
+def _read_mask_file(source_path):
+    with timed_metric('read'):
+        if (file_codec(source_path) in ('npy', 'zstd')):
+            band = read_array_file(source_path)
+            return band[:, :, 0] if band.ndim == 3 else band
+        with rasterio.open(source_path) as source_dataset:
+            band = source_dataset.read(1)
+        count_metric('bytes_read', os.path.getsize(source_path))
+    return band
+
+def read_mask(source_path):
+    '''
+    Returns the array of a one band GeoTIFF, or PNG, mask file, or of the first
+    band of a mask file written with one of the other codecs (see encode_array). If the raster
+    cache is enabled (see enable_raster_cache) the array is read-only.
+    '''
+    return cached_read(source_path, _read_mask_file)
+
+@contextlib.contextmanager
+def atomic_target(target_path):
+    '''
+    Returns a temporary path in the folder of the target file. The file 
+    written to the temporary path in the with block is renamed to the target
+    path with os.replace when the block completes, and removed if it fails, 
+    so that a run that is killed never leaves a truncated target file.
+    '''
+    temp_path = '{}.{:d}.tmp'.format(target_path, os.getpid())
+    try:
+        yield temp_path
+        os.replace(temp_path, target_path)
+    except BaseException:
+        if (os.path.exists(temp_path)):
+            os.remove(temp_path)
+        raise
+
+def write_png(target_path, band_list, dtype, compresslevel=None):
+    '''
+    This function writes a list of bands, 2D arrays with the same shape,
+    in a PNG file with the bands in the same order of the list. The PNG
+    is encoded in memory (see encode_png) and then written to the file 
+    so that the time spent encoding and writing is measured separately.
+    The file is written atomically (see atomic_target). The file can also
+    be written with one of the other codecs, selected by the extension of 
+    the target file (see encode_array).
+    '''
+    encoded_bytes = encode_array(band_list, dtype, file_codec(target_path), compresslevel)
+    with timed_metric('write'):
+        with atomic_target(target_path) as temp_path:
+            with open(temp_path, 'wb') as target_file:
+                target_file.write(encoded_bytes)
+    count_metric('bytes_written', len(encoded_bytes))
+
+def encode_png(band_list, dtype, compresslevel=None):
+    '''
+    This function encodes a list of bands, 2D arrays with the same shape,
+    as a PNG file in memory and returns its bytes, e.g. to be added to an
+    archive by PNGArchiveWriter without writing a file. The zlib compression
+    level, from 1 to 9, is 6 by default.
+    '''
+    return encode_array(band_list, dtype, 'png', compresslevel)
+
+# Codecs of the files of the images and masks and their extensions. The codec
+# of a file is selected by its extension (see file_codec). 
+CODEC_EXTENSIONS = {'png': '.png', 'webp': '.webp', 'npy': '.npy', 'zstd': '.npy.zst'}
+
+def file_codec(file_name):
+    '''
+    Returns the codec of a file from its extension, or None if the extension 
+    is not one of the codecs, e.g. for a GeoTIFF file.
+    '''
+    for codec in ('zstd', 'png', 'webp', 'npy'):
+        if (str(file_name).endswith(CODEC_EXTENSIONS[codec])):
+            return codec
+    return None
+
+def codec_file_name(file_name, codec):
+    '''
+    Returns the name of the file with the extension of the codec in place of
+    the extension of its codec, e.g. R022_T33UUP_26_57_20170613_mask.npy.zst
+    for R022_T33UUP_26_57_20170613_mask.png and the zstd codec.
+    '''
+    if (codec not in CODEC_EXTENSIONS):
+        raise ValueError('Unknown codec: {}'.format(codec))
+    extension = CODEC_EXTENSIONS[file_codec(file_name)]
+    return file_name[:-len(extension)] + CODEC_EXTENSIONS[codec]
+
+def stack_bands(band_list, dtype):
+    '''
+    Returns the bands in an array with shape (height, width) for one band or
+    (height, width, bands) of the dtype. The bands are cast to the dtype as
+    rasterio does when it writes them, e.g. the float bands returned by 
+    normalize are truncated, so that all the codecs store the same values.
+    '''
+    array = band_list[0] if len(band_list) == 1 else np.stack(band_list, axis=-1)
+    return np.ascontiguousarray(array.astype(dtype, copy=False))
+
+def encode_array(band_list, dtype, codec='png', compresslevel=None):
+    '''
+    This function encodes a list of bands, 2D arrays with the same shape, 
+    in memory with a codec and returns the bytes: 
+    'png', the PNG driver of GDAL with the zlib compression level, from 1 to 9,
+    6 by default; 
+    'webp', lossless WebP, only for uint8 bands, with the compression effort 
+    from 0 to 100, 75 by default. One band is encoded as a gray RGB image; 
+    'npy', the NumPy array in the .npy format (see stack_bands), not compressed; 
+    'zstd', the .npy bytes compressed by Zstandard with the compression level,
+    from 1 to 22, 3 by default. It requires the zstandard package.
+    The files are decoded by decode_array.
+    '''
+    with timed_metric('encode'):
+        if (codec in ('png', 'webp')):
+            if (codec == 'png'):
+                options = {'ZLEVEL': compresslevel} if compresslevel is not None else {}
+            else:
+                if (np.dtype(dtype) != np.uint8):
+                    raise ValueError('The webp codec encodes only uint8 bands, not {}'.format(np.dtype(dtype)))
+                if (len(band_list) == 1):
+                    band_list = band_list * 3
+                options = {'LOSSLESS': 'TRUE', 'QUALITY': compresslevel if compresslevel is not None else 75}
+            height, width = band_list[0].shape
+            with MemoryFile() as memory_file:
+                with memory_file.open(driver=codec.upper(),
+                                      height=height,
+                                      width=width,
+                                      count=len(band_list),
+                                      dtype=dtype,
+                                      **options) as target_dataset:
+                    band_index = 1
+                    for band in band_list:
+                        target_dataset.write(band, band_index)
+                        band_index += 1
+                encoded_bytes = memory_file.read()
+        elif (codec in ('npy', 'zstd')):
+            npy_file = io.BytesIO()
+            np.save(npy_file, stack_bands(band_list, dtype))
+            encoded_bytes = npy_file.getvalue()
+            if (codec == 'zstd'):
+                import zstandard
+                compressor = zstandard.ZstdCompressor(level=compresslevel if compresslevel is not None else 3)
+                encoded_bytes = compressor.compress(encoded_bytes)
+        else:
+            raise ValueError('Unknown codec: {}'.format(codec))
+    count_metric('bytes_encoded', len(encoded_bytes))
+    return encoded_bytes
+
+def decode_array(encoded_bytes, codec='png'):
+    '''
+    Returns the array of a file encoded by encode_array, with shape 
+    (height, width, channels) for a multiband image or (height, width) 
+    for a mask. A WebP file is always decoded with three channels.
+    '''
+    if (codec in ('png', 'webp')):
+        from PIL import Image
+        return np.asarray(Image.open(io.BytesIO(encoded_bytes)))
+    if (codec == 'zstd'):
+        import zstandard
+        encoded_bytes = zstandard.ZstdDecompressor().decompress(encoded_bytes)
+    elif (codec != 'npy'):
+        raise ValueError('Unknown codec: {}'.format(codec))
+    return np.load(io.BytesIO(encoded_bytes))
+
+def read_array_file(file_path):
+    '''
+    Returns the array of a .npy or .npy.zst file (see decode_array).
+    '''
+    with open(file_path, 'rb') as f:
+        encoded_bytes = f.read()
+    count_metric('bytes_read', len(encoded_bytes))
+    return decode_array(encoded_bytes, file_codec(file_path))
+
+def createPNG(source_path_list, target_path, clip_values=None, overwrite=False, compresslevel=None):
     '''
     This function creates a multiband PNG file from a list of GeoTIFF files 
     containing one band each. For an RGB file the source list shall contain three bands
     in the RGB order. For Sentinel-2 it is B04, B03, B02. The bin depth of each band is
-    reduced from 16 bits to 8 bits. If the target file already exists
+    reduced from 16 bits to 8 bits. By default each band is stretched between its min 
+    and max, if the clip values of the bands are passed they are used for all the patches
+    (see read_normalized_bands). If the target file already exists
     it doesn't create a new one and will return 1, otherwise it will create a new raster
-    and will return 0 
+    and will return 0. With overwrite True the target file is always created. The file
+    is written atomically so an existing file is never truncated. The codec is selected
+    by the extension of the target file and the compression level is passed to it 
+    (see encode_array).
     '''
     SUCCESS = 0
     FAILURE = 1
-    if (os.path.isfile(target_path)):
+    if (not overwrite and os.path.isfile(target_path)):
+        count_metric('skipped')
         return FAILURE 
         
-    band_list = []
-    with rasterio.open(source_path_list[0]) as source_dataset:
-        width = source_dataset.width
-        height = source_dataset.height
-        count = len(source_path_list)
-
-    #print('createPNG source_path_list', source_path_list)
-    for raster_path in source_path_list:
-        dataset = rasterio.open(raster_path)
-        band = normalize(dataset.read(1))
-        band_list.append(band)
-        
-        
-    with rasterio.open(target_path,
-                    mode='w',
-                    driver='PNG',
-                    height=height,
-                    width=width,
-                    count=count,
-                    dtype='uint8') as target_dataset:
-        band_index = 1
-        for band in band_list:
-            target_dataset.write(band, band_index)
-            band_index += 1
+    band_list = read_normalized_bands(source_path_list, clip_values)
+    write_png(target_path, band_list, 'uint8', compresslevel)
     
     return SUCCESS
 
-def createMaskPNG(source_path, target_path):
+def createMaskPNG(source_path, target_path, overwrite=False, compresslevel=None):
     '''
     This function creates a one band PNG file from a GeoTIFF mask file. 
     If the target file already exists it doesn't create a new one and 
     will return 1, otherwise it will create a new raster and will return 0. 
+    With overwrite True the target file is always created.
     We use dtype uint16 because mask pixel values can be > 255.
+    The codec is selected by the extension of the target file,
+    e.g. .npy.zst, and the compression level is passed to it.
     '''
-    #print('createMaskPNG source_path=', source_path)
     SUCCESS = 0
     FAILURE = 1
-    if (os.path.isfile(target_path)):
+    if (not overwrite and os.path.isfile(target_path)):
+        count_metric('skipped')
         return FAILURE 
         
-    with rasterio.open(source_path) as source_dataset:
-        width = source_dataset.width
-        height = source_dataset.height
-        band = source_dataset.read(1)
-        
-    with rasterio.open(target_path,
-                    mode='w',
-                    driver='PNG',
-                    height=height,
-                    width=width,
-                    count=1,
-                    dtype='uint16') as target_dataset:
-        band_index = 1
-        target_dataset.write(band, band_index)
+    band = read_mask(source_path)
+    write_png(target_path, [band], 'uint16', compresslevel)
 
     return SUCCESS
 
-def createPNGs(tiles_list):
+def createPNGs(tiles_list, num_workers=1, ordered=True, chunk_size=16, failed_patches=None, clip_values=None,
+               metrics=None, journal_path=None, codec='png', compresslevel=None):
     '''
     This function creates a PNG for each patch of the tiles
     in the list. The path of the PNG files is added to a list 
     that will be returned. In case a PNG file already exist it 
-    only adds its path to the list.
-    '''
-    png_patches = []
-    num_tiles = 0
-    for patches_list in tiles_list:
-        for bands_list in patches_list: 
-            band_name = bands_list[0].name
-            #print('Band name: {}'.format(band_name))
-            tile, patch, band, date = read_band_name(band_name)
-            patch_dir = bands_list[0].parent
-            png_file_name = str(patch_dir) +  '/' + create_png_file_name(tile, patch, date)
-            if (createPNG(bands_list, png_file_name) == 1):
-                #print('The image PNG file already exists.')
-                png_patches.append(png_file_name)
-            else:
-                png_patches.append(png_file_name)
-        num_tiles += 1
-        print('Tile image {:d} completed'.format(num_tiles))
-    return png_patches
+    only adds its path to the list. With num_workers > 1 the 
+    patches are converted in a pool of processes (see run_patch_tasks).
+    A patch whose conversion fails is reported and its path is not
+    added to the list. The clip values are passed to createPNG. The
+    metrics of the run are added to metrics if passed (see StageMetrics).
+    If the path of a journal is passed the patches completed in a previous
+    run are skipped using the journal instead of checking if the PNG files
+    exist (see run_patch_tasks). The files are written with the codec and
+    the compression level (see encode_array), e.g. 'webp'.
+    '''
+    png_task = functools.partial(_png_task, clip_values=clip_values, overwrite=journal_path is not None,
+                                 codec=codec, compresslevel=compresslevel)
+    return run_patch_tasks(png_task, tiles_list, num_workers=num_workers, ordered=ordered, 
+                           chunk_size=chunk_size, label='Tile image', failed_patches=failed_patches, 
+                           metrics=metrics, journal_path=journal_path)
 
-def createMaskPNGs(tiles_list):
+def createMaskPNGs(tiles_list, num_workers=1, ordered=True, chunk_size=16, failed_patches=None, metrics=None,
+                   journal_path=None, codec='png', compresslevel=None):
     '''
     This function creates a PNG mask for each patch of the tiles
     in the list. The path of the PNG files is added to a list 
     that will be returned. In case a PNG file already exist it 
-    only adds its path to the list.
-    '''
-    png_patches = []
+    only adds its path to the list. With num_workers > 1 the 
+    masks are converted in a pool of processes (see run_patch_tasks).
+    A mask whose conversion fails is reported and its path is not
+    added to the list. The metrics of the run are added to metrics 
+    if passed (see StageMetrics). If the path of a journal is passed 
+    the masks completed in a previous run are skipped using the journal
+    (see run_patch_tasks). The files are written with the codec and the 
+    compression level (see encode_array), e.g. 'zstd'.
+    '''
+    mask_png_task = functools.partial(_mask_png_task, overwrite=journal_path is not None, codec=codec,
+                                      compresslevel=compresslevel)
+    return run_patch_tasks(mask_png_task, tiles_list, num_workers=num_workers, ordered=ordered,
+                           chunk_size=chunk_size, label='Tile mask', failed_patches=failed_patches,
+                           metrics=metrics, journal_path=journal_path)
+
+def _png_task(task, clip_values=None, overwrite=False, codec='png', compresslevel=None):
+    '''
+    Worker task of createPNGs. It converts the bands of one patch into
+    a PNG file and returns the tile index, the PNG file name and an error
+    message that is None if the conversion succeeded.
+    '''
+    tile_index, bands_list = task
+    band_name = bands_list[0].name
+    tile, patch, band, date = read_band_name(band_name)
+    patch_dir = bands_list[0].parent
+    png_file_name = str(patch_dir) +  '/' + codec_file_name(create_png_file_name(tile, patch, date), codec)
+    try:
+        createPNG(bands_list, png_file_name, clip_values, overwrite, compresslevel)
+    except Exception as e:
+        return tile_index, png_file_name, '{}: {}'.format(type(e).__name__, e)
+    return tile_index, png_file_name, None
+
+def _mask_png_task(task, overwrite=False, codec='png', compresslevel=None):
+    '''
+    Worker task of createMaskPNGs. It converts the mask of one patch into
+    a PNG file and returns the tile index, the PNG file name and an error
+    message that is None if the conversion succeeded.
+    '''
+    tile_index, patch_path = task
+    patch_dir = patch_path[0].parent
+    patch_name = patch_path[0].name
+    tile, patch, date = read_mask_name(patch_name)
+    png_file_name = str(patch_dir) +  '/' + codec_file_name(create_mask_png_file_name(tile, patch, date), codec)
+    tiff_path_name = str(patch_path[0])
+    try:
+        createMaskPNG(tiff_path_name, png_file_name, overwrite, compresslevel)
+    except Exception as e:
+        return tile_index, png_file_name, '{}: {}'.format(type(e).__name__, e)
+    return tile_index, png_file_name, None
+
+def run_patch_tasks(task_function, tiles_list, num_workers=1, ordered=True, chunk_size=16, 
+                    label='Tile', failed_patches=None, result_callback=None, metrics=None, 
+                    journal_path=None):
+    '''
+    This function applies a worker task to each patch of the tiles in the list 
+    and returns the list of the results of the task, e.g. the file names. With 
+    num_workers = 1 the patches are processed in this process, otherwise they are 
+    sent in chunks of chunk_size patches to a pool of num_workers processes. If 
+    ordered is True the results are returned in the same order of the patches in 
+    the tiles list, otherwise in the order in which the workers complete them. A task 
+    must return a tuple (tile index, result, error message). A patch that fails is 
+    printed, appended as a (result, error message) tuple to the failed_patches list, 
+    if one is passed, and doesn't stop the run. The result of a failed patch should
+    identify it, e.g. its file name. The result_callback function, if passed, is 
+    applied in this process to the result of each patch that succeeded as soon as it
+    is received and the value it returns is added to the list in place of the result.
+    The counters of each patch (see timed_metric) are added to metrics, a StageMetrics
+    that prints the throughput and the ETA periodically. If it is not passed one is 
+    created with the label as stage name and stopped at the end of the run.
+    If the path of a journal is passed (see PatchJournal) the tiles completed in the 
+    journal are skipped without accessing their files and their results are read 
+    from the journal. The other patches are skipped by the workers if the fingerprint
+    of their source files is the same as in the journal, otherwise the task is applied
+    again, so the task shall overwrite the existing files. The results of the patches
+    that succeed and the tiles whose patches all succeed are added to the journal.
+    '''
+    journal = PatchJournal(journal_path) if journal_path is not None else None
+    tasks = []
+    patch_keys = []
+    journal_results = []
+    remaining_patches = [len(patches_list) for patches_list in tiles_list]
+    for tile_index, patches_list in enumerate(tiles_list):
+        for patch in patches_list:
+            position = len(patch_keys)
+            keys = PatchJournal.patch_keys(patch) if journal is not None else None
+            patch_keys.append(keys)
+            journal_fingerprint = None
+            if (journal is not None and keys[1] in journal.patches):
+                journal_fingerprint, journal_result = journal.patches[keys[1]]
+                if (keys[0] in journal.completed_tiles):
+                    journal_results.append((position, journal_result))
+                    remaining_patches[tile_index] -= 1
+                    continue
+            tasks.append((position, (tile_index, patch), journal_fingerprint))
+    stop_metrics = metrics is None
+    if (metrics is None):
+        metrics = StageMetrics(label)
+    metrics.expect(len(tasks) + len(journal_results))
+    metrics.add({'patches': len(journal_results), 'journal_skipped': len(journal_results)})
+    task_function = functools.partial(_instrumented_task, task_function=task_function, 
+                                      use_journal=journal is not None)
+    tile_failed = [False] * len(tiles_list)
+    results_list = list(journal_results)
     num_tiles = 0
-    for patches_list in tiles_list:
-        for patch_path in patches_list: 
-            #print('Patch path: {}'.format(patch_path))
-            patch_dir = patch_path[0].parent
-            patch_name = patch_path[0].name
-            #print('Patch name: {}'.format(patch_name))
-            tile, patch, date = read_mask_name(patch_name)
-            #print('Tile: {}, Patch: {}, Date: {}'.format(tile, patch, date))
-            png_file_name = str(patch_dir) +  '/' + create_mask_png_file_name(tile, patch, date)
-            #print('Mask file name: {}'.format(png_file_name))
-            tiff_path_name = str(patch_path[0])
-            #print('Tiff patch path name', tiff_path_name)
-            if (createMaskPNG(tiff_path_name, png_file_name) == 1):
-                #print('The mask PNG file already exists.')
-                png_patches.append(png_file_name)
+    for num_patches in remaining_patches:
+        if (num_patches == 0):
+            num_tiles += 1
+            print('{} {:d} completed'.format(label, num_tiles))
+
+    pool = None
+    if (num_workers > 1):
+        pool = multiprocessing.Pool(processes=num_workers)
+        pool_map = pool.imap if ordered else pool.imap_unordered
+        results = pool_map(task_function, tasks, chunksize=chunk_size)
+    else:
+        results = map(task_function, tasks)
+
+    try:
+        for position, tile_index, file_name, error, fingerprint, counters in results:
+            counters['patches'] = 1
+            if (counters.get('journal_skipped')):
+                results_list.append((position, journal.patches[patch_keys[position][1]][1]))
+            elif (error is None):
+                if (result_callback is not None):
+                    start = time.perf_counter()
+                    file_name = result_callback(file_name)
+                    counters['callback_seconds'] = time.perf_counter() - start
+                if (journal is not None):
+                    journal.add_patch(patch_keys[position][0], patch_keys[position][1], fingerprint, file_name)
+                results_list.append((position, file_name))
             else:
-                png_patches.append(png_file_name)
-        num_tiles += 1
-        print('Tile mask {:d} completed'.format(num_tiles))
-    return png_patches
+                counters['failed'] = 1
+                tile_failed[tile_index] = True
+                print('Patch {} failed: {}'.format(file_name, error))
+                if (failed_patches is not None):
+                    failed_patches.append((file_name, error))
+            metrics.add(counters, tile_index)
+            remaining_patches[tile_index] -= 1
+            if (remaining_patches[tile_index] == 0):
+                num_tiles += 1
+                metrics.tile_completed(tile_index)
+                if (journal is not None and not tile_failed[tile_index]):
+                    journal.add_tile(patch_keys[position][0])
+                print('{} {:d} completed'.format(label, num_tiles))
+    finally:
+        if (pool is not None):
+            pool.terminate()
+            pool.join()
+        if (journal is not None):
+            journal.close()
+    if (stop_metrics):
+        metrics.stop()
+    if (ordered):
+        results_list.sort(key=lambda position_result: position_result[0])
+    return [file_name for position, file_name in results_list]
+
+def exportPatch(bands_list, mask_path, products=('rgb', 'mask', 'l3', 'l1'), target_dirs=None, 
+                encoded_products=(), clip_values=None, overwrite=False, codec='png', compresslevel=None):
+    '''
+    This function reads the RGB bands and the reference map of a patch once 
+    and creates the PNG files of the products in the list: 'rgb', the RGB image 
+    created by createPNG, 'mask', the uint16 mask created by createMaskPNG, and 
+    'l1', 'l2', 'l3' or 'ben19', the masks mapped to a Corine2018 level created 
+    by mapCorine. By default the image is saved in the folder of its bands and 
+    the masks in the folder of the reference map. A different folder can be set 
+    for each product in the target_dirs dictionary. The files that already exist 
+    are not created again, unless overwrite is True, and if all of them exist the
+    patch is not read. 
+    Returns a dictionary with the PNG file name of each product. The products 
+    in the encoded_products list are not written: their value in the dictionary 
+    is a tuple with the name of the PNG file, without folder, and its bytes.
+    The clip values of the bands are passed to read_normalized_bands. The files
+    are encoded with the codec and the compression level (see encode_array). The
+    codec can also be a dictionary with the codec of each product, e.g. 
+    {'rgb': 'webp', 'mask': 'zstd'}, the products not in it are encoded as PNG.
+    '''
+    target_dirs = target_dirs or {}
+    codecs = codec if isinstance(codec, dict) else {product: codec for product in products}
+    tile, patch, band, date = read_band_name(bands_list[0].name)
+    mask_png_file_name = create_mask_png_file_name(tile, patch, date)
+    target_paths = {}
+    for product in products:
+        if (product == 'rgb'):
+            target_dir = target_dirs.get(product, str(bands_list[0].parent))
+            target_paths[product] = target_dir + '/' + create_png_file_name(tile, patch, date)
+        elif (product == 'mask'):
+            target_dir = target_dirs.get(product, str(pathlib.Path(mask_path).parent))
+            target_paths[product] = target_dir + '/' + mask_png_file_name
+        elif (product in CORINE2018_NUM_CLASSES):
+            target_dir = target_dirs.get(product, str(pathlib.Path(mask_path).parent))
+            target_paths[product] = target_dir + '/' + create_corine_mask_file_name(mask_png_file_name, product)
+        else:
+            raise ValueError('Unknown product: {}'.format(product))
+        target_paths[product] = codec_file_name(target_paths[product], codecs.get(product, 'png'))
+    
+    def output_png(product, band_list, dtype):
+        if (product in encoded_products):
+            target_paths[product] = (pathlib.Path(target_paths[product]).name, 
+                                     encode_array(band_list, dtype, file_codec(target_paths[product]), compresslevel))
+        else:
+            write_png(target_paths[product], band_list, dtype, compresslevel)
+
+    missing_products = [product for product in products 
+                        if product in encoded_products or overwrite or not os.path.isfile(target_paths[product])]
+    count_metric('skipped', len(products) - len(missing_products))
+    if ('rgb' in missing_products):
+        output_png('rgb', read_normalized_bands(bands_list, clip_values), 'uint8')
+    mask_products = [product for product in missing_products if product != 'rgb']
+    if (len(mask_products) > 0):
+        mask_array = read_mask(mask_path)
+        for product in mask_products:
+            if (product == 'mask'):
+                output_png(product, [mask_array], 'uint16')
+            else:
+                with timed_metric('transform'):
+                    product_array = corine_remap(mask_array, product)
+                output_png(product, [product_array], 'uint8')
+    return target_paths
+
+def _export_task(task, products, target_dirs, encoded_products, clip_values, overwrite=False, codec='png', 
+                 compresslevel=None):
+    '''
+    Worker task of exportPatches. It exports the products of one patch and 
+    returns the tile index, the dictionary of the PNG file names and an error 
+    message that is None if the export succeeded. If the export fails the 
+    name of the patch folder is returned in place of the dictionary. 
+    '''
+    tile_index, (bands_list, mask_path) = task
+    try:
+        if (mask_path is None and any(product != 'rgb' for product in products)):
+            raise FileNotFoundError('reference map not found')
+        target_paths = exportPatch(bands_list, mask_path, products, target_dirs, encoded_products, 
+                                   clip_values, overwrite, codec, compresslevel)
+        return tile_index, target_paths, None
+    except Exception as e:
+        return tile_index, bands_list[0].parent.name, '{}: {}'.format(type(e).__name__, e)
+
+def exportPatches(tiles_list, tiles_mask_list, products=('rgb', 'mask', 'l3', 'l1'), target_dirs=None, 
+                  archives=None, num_workers=1, ordered=True, chunk_size=16, failed_patches=None, 
+                  clip_values=None, metrics=None, journal_path=None, codec='png', compresslevel=None):
+    '''
+    This function exports the products of each patch of the tiles in one pass 
+    (see exportPatch). The first argument is the list of the tiles of the images 
+    returned by list_image_files, the second one the list of the tiles of the masks 
+    returned by list_mask_files. The masks are matched to the images by tile and 
+    patch. The patches are processed in a pool of num_workers processes (see 
+    run_patch_tasks). The archives dictionary can contain a PNGArchiveWriter for 
+    some of the products: their PNG files are not written but added to the archive
+    as they are encoded. Returns a dictionary with the list of the PNG file names 
+    of each product, for the products in an archive the names of the members.
+    The clip values of the bands are passed to exportPatch. The metrics of the 
+    run are added to metrics if passed (see StageMetrics). If the path of a
+    journal is passed the patches completed in a previous run are skipped 
+    using the journal (see run_patch_tasks). A journal cannot be used with
+    archives because the skipped patches would be missing from the archives.
+    The codec, or the dictionary of the codec of each product, and the 
+    compression level are passed to exportPatch.
+    '''
+    archives = archives or {}
+    if (journal_path is not None and len(archives) > 0):
+        raise ValueError('A journal cannot be used with archives')
+    encoded_products = tuple(product for product in products if product in archives)
+    mask_paths = {}
+    for patches_list in tiles_mask_list:
+        for mask_list in patches_list:
+            for mask_path in mask_list:
+                tile, patch, date = read_mask_name(mask_path.name)
+                mask_paths[(tile, patch)] = mask_path
+    export_tiles_list = []
+    for patches_list in tiles_list:
+        export_patches_list = []
+        for bands_list in patches_list:
+            tile, patch, band, date = read_band_name(bands_list[0].name)
+            export_patches_list.append((bands_list, mask_paths.get((tile, patch))))
+        export_tiles_list.append(export_patches_list)
+    
+    def add_to_archives(target_paths):
+        for product in encoded_products:
+            png_name, png_bytes = target_paths[product]
+            archives[product].add(png_name, png_bytes)
+            target_paths[product] = png_name
+        return target_paths
+
+    export_task = functools.partial(_export_task, products=products, target_dirs=target_dirs, 
+                                    encoded_products=encoded_products, clip_values=clip_values,
+                                    overwrite=journal_path is not None, codec=codec, compresslevel=compresslevel)
+    results = run_patch_tasks(export_task, export_tiles_list, num_workers=num_workers, ordered=ordered,
+                              chunk_size=chunk_size, label='Tile', failed_patches=failed_patches,
+                              result_callback=add_to_archives, metrics=metrics, journal_path=journal_path)
+    product_files = {product: [] for product in products}
+    for target_paths in results:
+        for product in products:
+            product_files[product].append(target_paths[product])
+    return product_files
+
+def create_band_stack_file_name(tile, patch, date, extension='tif'):
+    return tile + '_' + patch + '_' + date + '_stack.' + extension
+
+def resample_band(band_array, factor, method='nearest'):
+    '''
+    Upsamples a band, or a stack of bands with the rows and columns in the 
+    last two axes, by an integer factor, e.g. 2 for a 20 m. band or 6 for 
+    a 60 m. band to the 10 m. grid. The 'nearest' method repeats each pixel 
+    and keeps the dtype. The 'bilinear' method interpolates between the pixel 
+    centers, clamping at the borders, and returns a float32 array.
+    '''
+    if (factor == 1):
+        return band_array
+    if (method == 'nearest'):
+        return band_array.repeat(factor, axis=-2).repeat(factor, axis=-1)
+    if (method != 'bilinear'):
+        raise ValueError('Unknown resampling method: {}'.format(method))
+    band_array = band_array.astype(np.float32)
+    for axis in (-2, -1):
+        size = band_array.shape[axis]
+        x = (np.arange(size * factor, dtype=np.float32) + 0.5) / factor - 0.5
+        x = np.clip(x, 0, size - 1)
+        x_floor = np.floor(x)
+        x0 = x_floor.astype(np.intp)
+        x1 = np.minimum(x0 + 1, size - 1)
+        weight_shape = [1] * band_array.ndim
+        weight_shape[axis] = size * factor
+        w = (x - x_floor).reshape(weight_shape)
+        band_array = np.take(band_array, x0, axis=axis) * (1 - w) + np.take(band_array, x1, axis=axis) * w
+    return band_array
+
+def read_band_stack(source_path_list, bands=None, method='nearest', patch_size=120):
+    '''
+    This function reads a list of GeoTIFF files containing one band each,
+    opening each file once, and returns a (C, patch_size, patch_size) uint16
+    array with the bands upsampled to the 10 m. grid (see resample_band) and
+    the georeference, a dictionary with the crs and the transform of the 
+    10 m. grid. The bands are stacked in the order of the bands list, e.g.
+    ['B04', 'B03', 'B02', 'B08'], that must contain the bands of the files,
+    or in the order of the files if it is None. The bilinear values are 
+    rounded to the nearest integer.
+    '''
+    band_paths = {read_band_name(pathlib.Path(path).name)[2]: path for path in source_path_list}
+    bands = list(bands) if bands is not None else list(band_paths)
+    missing_bands = [band for band in bands if band not in band_paths]
+    if (len(missing_bands) > 0):
+        raise FileNotFoundError('bands not found: {}'.format(', '.join(missing_bands)))
+    stack = np.empty((len(bands), patch_size, patch_size), dtype=np.uint16)
+    georeference = None
+    for band_index, band in enumerate(bands):
+        with timed_metric('read'):
+            with rasterio.open(band_paths[band]) as dataset:
+                band_array = dataset.read(1)
+                factor = patch_size // dataset.width
+                if (georeference is None or factor == 1):
+                    t = dataset.transform
+                    georeference = {'crs': dataset.crs, 
+                                    'transform': rasterio.Affine(t.a / factor, t.b / factor, t.c, 
+                                                                 t.d / factor, t.e / factor, t.f)}
+            count_metric('bytes_read', os.path.getsize(band_paths[band]))
+        with timed_metric('transform'):
+            band_array = resample_band(band_array, factor, method)
+            if (band_array.dtype != stack.dtype):
+                band_array = np.rint(band_array).clip(0, 65535)
+            stack[band_index] = band_array
+    return stack, georeference
+
+def write_band_stack(target_path, stack, georeference, bands=None):
+    '''
+    Writes a stack of bands in a multiband GeoTIFF file with the crs and 
+    transform of the georeference and the band names as band descriptions, 
+    or, if the extension of the target file is .npy, as a raw numpy array.
+    The file is written atomically (see atomic_target).
+    '''
+    with timed_metric('write'), atomic_target(target_path) as temp_path:
+        if (str(target_path).endswith('.npy')):
+            with open(temp_path, 'wb') as target_file:
+                np.save(target_file, stack)
+        else:
+            count, height, width = stack.shape
+            with rasterio.open(temp_path,
+                               mode='w',
+                               driver='GTiff',
+                               height=height,
+                               width=width,
+                               count=count,
+                               dtype=stack.dtype,
+                               crs=georeference['crs'],
+                               transform=georeference['transform']) as target_dataset:
+                target_dataset.write(stack)
+                if (bands is not None):
+                    for band_index, band in enumerate(bands):
+                        target_dataset.set_band_description(band_index + 1, band)
+    count_metric('bytes_written', os.path.getsize(target_path))
+
+def createBandStack(source_path_list, target_path, bands=None, method='nearest', overwrite=False):
+    '''
+    This function creates a multiband GeoTIFF, or .npy, file from a list of
+    GeoTIFF files containing one band each, with the bands in the order of the
+    bands list and upsampled to 120x120 pixels (see read_band_stack). If the 
+    target file already exists it doesn't create a new one and will return 1, 
+    otherwise it will create a new file and will return 0. With overwrite True
+    the target file is always created.
+    '''
+    SUCCESS = 0
+    FAILURE = 1
+    if (not overwrite and os.path.isfile(target_path)):
+        count_metric('skipped')
+        return FAILURE 
+    
+    stack, georeference = read_band_stack(source_path_list, bands, method)
+    if (bands is None):
+        bands = [read_band_name(pathlib.Path(path).name)[2] for path in source_path_list]
+    write_band_stack(target_path, stack, georeference, bands)
+    
+    return SUCCESS
+
+def createBandStacks(tiles_list, bands, extension='tif', method='nearest', target_dir=None, 
+                     num_workers=1, ordered=True, chunk_size=16, failed_patches=None, metrics=None,
+                     journal_path=None):
+    '''
+    This function creates a band stack file for each patch of the tiles 
+    returned by list_image_files with the same bands list. The files are 
+    saved in the patch folders, or in target_dir if it is passed, as GeoTIFF 
+    files, or as .npy files if the extension is 'npy'. The patches are 
+    processed in a pool of num_workers processes (see run_patch_tasks). 
+    Returns the list of the file names. The metrics of the run are added
+    to metrics if passed (see StageMetrics). If the path of a journal is 
+    passed the patches completed in a previous run are skipped using the 
+    journal (see run_patch_tasks).
+    '''
+    stack_task = functools.partial(_band_stack_task, bands=bands, extension=extension, method=method, 
+                                   target_dir=target_dir, overwrite=journal_path is not None)
+    return run_patch_tasks(stack_task, tiles_list, num_workers=num_workers, ordered=ordered, 
+                           chunk_size=chunk_size, label='Tile stack', failed_patches=failed_patches,
+                           metrics=metrics, journal_path=journal_path)
+
+def _band_stack_task(task, bands, extension, method, target_dir, overwrite=False):
+    '''
+    Worker task of createBandStacks. It stacks the bands of one patch and
+    returns the tile index, the file name and an error message that is None
+    if the stack was created.
+    '''
+    tile_index, bands_list = task
+    tile, patch, band, date = read_band_name(bands_list[0].name)
+    stack_dir = target_dir if target_dir is not None else str(bands_list[0].parent)
+    stack_file_name = stack_dir + '/' + create_band_stack_file_name(tile, patch, date, extension)
+    try:
+        createBandStack(bands_list, stack_file_name, bands, method, overwrite)
+    except Exception as e:
+        return tile_index, stack_file_name, '{}: {}'.format(type(e).__name__, e)
+    return tile_index, stack_file_name, None
 
 def delete_files(file_list):
     '''
@@ -328,65 +1726,107 @@ def resize_png(file_path, png_size):
     and returns a new tensor resized
     according to the png_size, e.g. (128, 128).
     '''
+    from tensorflow import io as tf_io, image as tf_image
     img = tf_io.read_file(file_path)
-    num_channnels = img.shape
-    decoded_img = tf_io.decode_png(img, channels=num_channnels)
+    decoded_img = tf_io.decode_png(img, channels=0)
     resized_img = tf_image.resize(decoded_img, png_size)
     return resized_img
 
-def mapCorineL3(source_path, target_path):
+def mapCorine(source_path, target_path, level, overwrite=False, compresslevel=None):
     '''
     This function creates a new target mask PNG file from a source mask file
-    mapping the Corine2018 Level 3 color codes of the source to their index 
-    in [1, 45]. If the target file already exists it doesn't create a new one 
-    and will return 1, otherwise it will create a new raster and will return 0. 
-    The dtype of the target file is uint8.
+    mapping the Corine2018 Level 3 color codes of the source to the class 
+    indexes of the level, one of 'l1', 'l2', 'l3' or 'ben19' (see corine_remap).
+    If the target file already exists it doesn't create a new one and will 
+    return 1, otherwise it will create a new raster and will return 0. With 
+    overwrite True the target file is always created. The dtype of the target
+    file is uint8. The codec is selected by the extension of the target file,
+    e.g. .webp, and the compression level is passed to it (see encode_array).
     '''
-    #print('createMaskPNG source_path=', source_path)
     SUCCESS = 0
     FAILURE = 1
-    if (os.path.isfile(target_path)):
+    if (not overwrite and os.path.isfile(target_path)):
+        count_metric('skipped')
         return FAILURE 
         
-    with rasterio.open(source_path) as source_dataset:
-        width = source_dataset.width
-        height = source_dataset.height
-        band = source_dataset.read(1)
-
-    band = corine_l3_mask(band)
-    
-    with rasterio.open(target_path,
-                    mode='w',
-                    driver='PNG',
-                    height=height,
-                    width=width,
-                    count=1,
-                    dtype='uint8') as target_dataset:
-        band_index = 1
-        target_dataset.write(band, band_index)
+    band = corine_remap(read_mask(source_path), level)
+    write_png(target_path, [band], 'uint8', compresslevel)
 
     return SUCCESS
 
-def mapCorineL3_list(source_folder, target_folder):
+def create_corine_mask_file_name(mask_file_name, level):
+    '''
+    Returns the name of the file of a mask mapped to a Corine2018 level
+    from the name of the mask PNG file. The level 3 masks end with '_nc.png',
+    the other levels with '_<level>_mask.png', e.g. '_l1_mask.png'. The 
+    extension of a mask written with another codec is kept, e.g. '_nc.webp'.
+    '''
+    extension = CODEC_EXTENSIONS[file_codec(mask_file_name)]
+    if (level == 'l3'):
+        return mask_file_name[:-len(extension)] + '_nc' + extension
+    return mask_file_name[:-len(extension) - 4] + level + '_mask' + extension
+
+def mapCorine_list(source_folder, target_folder, level, journal_path=None, codec='png', compresslevel=None):
     '''
     This function creates new mask PNG files in the target folder from 
     source mask files in the source folder by mapping the Corine2018 
-    level 3 color codes of the source files to their index in [1, 45]
+    level 3 color codes of the source files to the class indexes of 
+    the level, one of 'l1', 'l2', 'l3' or 'ben19'. If the path of a 
+    journal is passed (see PatchJournal) the masks whose source file 
+    has the same fingerprint as in the journal are skipped and the 
+    others are created again. When all the masks have been created 
+    the source folder is recorded in the journal as completed, and 
+    the next runs return its masks without reading the source files. 
+    The files are written with the codec and the compression level 
+    (see encode_array).
     '''
     target_masks = []
     source_masks_folder_path = pathlib.Path(source_folder)
     source_masks = [str(file) for file in source_masks_folder_path.iterdir()]
-    num_source_masks = len(source_masks)
-    for source_mask in source_masks:
-        #print('Source mask: {}', source_mask)
-        target_mask_name = pathlib.Path(source_mask).name[:-4] + '_nc.png'    
-        target_mask = target_folder + target_mask_name
-        #print('Target mask: {}', target_mask)
-        mapCorineL3(source_mask, target_mask)
-        target_masks.append(target_mask)
+    journal = PatchJournal(journal_path) if journal_path is not None else None
+    if (journal is not None and source_masks_folder_path.name in journal.completed_tiles):
+        journal.close()
+        return [target_folder + codec_file_name(create_corine_mask_file_name(pathlib.Path(source_mask).name, level), codec) 
+                for source_mask in source_masks]
+    try:
+        for source_mask in source_masks:
+            source_mask_name = pathlib.Path(source_mask).name
+            target_mask_name = codec_file_name(create_corine_mask_file_name(source_mask_name, level), codec)
+            target_mask = target_folder + target_mask_name
+            if (journal is None):
+                mapCorine(source_mask, target_mask, level, compresslevel=compresslevel)
+            else:
+                fingerprint = source_fingerprint([source_mask])
+                if (journal.patches.get(source_mask_name, (None, None))[0] != fingerprint):
+                    mapCorine(source_mask, target_mask, level, overwrite=True, compresslevel=compresslevel)
+                    journal.add_patch(source_masks_folder_path.name, source_mask_name, fingerprint, target_mask)
+            target_masks.append(target_mask)
+        if (journal is not None):
+            journal.add_tile(source_masks_folder_path.name)
+    finally:
+        if (journal is not None):
+            journal.close()
     return target_masks
 
-def mapCorineL1(source_path, target_path):
+def mapCorineL3(source_path, target_path, compresslevel=None):
+    '''
+    This function creates a new target mask PNG file from a source mask file
+    mapping the Corine2018 Level 3 color codes of the source to their index 
+    in [1, 45]. If the target file already exists it doesn't create a new one 
+    and will return 1, otherwise it will create a new raster and will return 0. 
+    The dtype of the target file is uint8.
+    '''
+    return mapCorine(source_path, target_path, 'l3', compresslevel=compresslevel)
+
+def mapCorineL3_list(source_folder, target_folder, journal_path=None, codec='png', compresslevel=None):
+    '''
+    This function creates new mask PNG files in the target folder from 
+    source mask files in the source folder by mapping the Corine2018 
+    level 3 color codes of the source files to their index in [1, 45]
+    '''
+    return mapCorine_list(source_folder, target_folder, 'l3', journal_path, codec, compresslevel)
+
+def mapCorineL1(source_path, target_path, compresslevel=None):
     '''
     This function creates a new target mask PNG file from a source mask file
     mapping the Corine2018 Level 3 color codes of the source to level 1. If 
@@ -394,51 +1834,15 @@ def mapCorineL1(source_path, target_path):
     1, otherwise it will create a new raster and will return 0. The dtype of 
     the target file is uint8.
     '''
-    #print('createMaskPNG source_path=', source_path)
-    SUCCESS = 0
-    FAILURE = 1
-    if (os.path.isfile(target_path)):
-        return FAILURE 
-        
-    with rasterio.open(source_path) as source_dataset:
-        width = source_dataset.width
-        height = source_dataset.height
-        band = source_dataset.read(1)
-
-    band = corine_l1_mask(band)
-    
-    with rasterio.open(target_path,
-                    mode='w',
-                    driver='PNG',
-                    height=height,
-                    width=width,
-                    count=1,
-                    dtype='uint8') as target_dataset:
-        band_index = 1
-        target_dataset.write(band, band_index)
-
-    return SUCCESS
+    return mapCorine(source_path, target_path, 'l1', compresslevel=compresslevel)
 
-def mapCorineL1_list(source_folder, target_folder):
+def mapCorineL1_list(source_folder, target_folder, journal_path=None, codec='png', compresslevel=None):
     '''
     This function creates new mask PNG files in the target folder from 
     source mask files in the source folder by mapping the Corine2018 
     level 3 color codes of the source files to level 1
     '''
-    target_masks = []
-    source_masks_folder_path = pathlib.Path(source_folder)
-    source_masks = [str(file) for file in source_masks_folder_path.iterdir()]
-    num_source_masks = len(source_masks)
-    #print('Num. source masks: ', num_source_masks)
-    for source_mask in source_masks:
-        #print('Source mask: ', source_mask)
-        target_mask_name = pathlib.Path(source_mask).name[:-8] + 'l1_mask.png'    
-        target_mask = target_folder + target_mask_name
-        #print('Target mask: ', target_mask)
-        mapCorineL1(source_mask, target_mask)
-        target_masks.append(target_mask)
-    return target_masks
-
+    return mapCorine_list(source_folder, target_folder, 'l1', journal_path, codec, compresslevel)
 
 def corine2018_l1_class_bucket(clc_code):
     '''
@@ -449,19 +1853,9 @@ def corine2018_l1_class_bucket(clc_code):
     works as the inverse of corine2018_l1_class_code(). If 
     the clc_code is not valid the function returns no values.
     '''
-    corine2018_class_code = [
-        [111, 112, 121, 122, 123, 124, 131, 132, 133, 141, 142],
-        [211, 212, 213, 221, 222, 223, 231, 241, 242, 243, 244],
-        [311, 312, 313, 321, 322, 323, 324, 331, 332, 333, 334, 335],
-        [411, 412, 421, 422, 423],
-        [511, 512, 521, 522, 523], 
-        [999]]
-    
-    corine2018_l1_class_buckets = np.arange(1, 7, dtype='uint8')
-
-    for c in range(1, 7):
-        if (clc_code in corine2018_class_code[c - 1]):
-            return c
+    bucket = corine2018_lut('l1')[clc_code]
+    if (bucket > 0):
+        return int(bucket)
 
 def corine2018_l1_labels():
     '''
@@ -479,6 +1873,63 @@ def corine2018_l1_labels():
     
     return corine2018_level1_labels
 
+def corine2018_l2_labels():
+    '''
+    This function simply returns the list of the 15 
+    Corine2018 level 2 land cover labels plus one additional class,
+    'Unclassified', used for pixels that were not classified.
+    '''
+    corine2018_level2_labels = [
+        'Urban fabric',
+        'Industrial, commercial and transport units',
+        'Mine, dump and construction sites',
+        'Artificial, non-agricultural vegetated areas',
+        'Arable land',
+        'Permanent crops',
+        'Pastures',
+        'Heterogeneous agricultural areas',
+        'Forests',
+        'Scrub and/or herbaceous vegetation associations',
+        'Open spaces with little or no vegetation',
+        'Inland wetlands',
+        'Maritime wetlands',
+        'Inland waters',
+        'Marine waters',
+        'Unclassified']
+    
+    return corine2018_level2_labels
+
+def bigearthnet19_labels():
+    '''
+    This function simply returns the list of the 19 land cover 
+    labels of the BigEarthNet nomenclature plus one additional class,
+    'Unclassified', used for pixels that were not classified or whose
+    Corine2018 class is not part of the nomenclature.
+    '''
+    bigearthnet19_labels = [
+        'Urban fabric',
+        'Industrial or commercial units',
+        'Arable land',
+        'Permanent crops',
+        'Pastures',
+        'Complex cultivation patterns',
+        'Land principally occupied by agriculture, with significant areas of natural vegetation',
+        'Agro-forestry areas',
+        'Broad-leaved forest',
+        'Coniferous forest',
+        'Mixed forest',
+        'Natural grassland and sparsely vegetated areas',
+        'Moors, heathland and sclerophyllous vegetation',
+        'Transitional woodland, shrub',
+        'Beaches, dunes, sands',
+        'Inland wetlands',
+        'Coastal wetlands',
+        'Inland waters',
+        'Marine waters',
+        'Unclassified']
+    
+    return bigearthnet19_labels
+
 def corine_l1_color_map():
     '''
     This function returns the 6 Corine2018 Level 1
@@ -504,29 +1955,640 @@ def corine_l1_color_map():
 
 #-------------------------------------3) Compression ----------------------------------------------------
 
-def zip_pngs(pngs_list, target_zip_file):
+class PNGArchiveWriter:
+    '''
+    This class writes PNG files, passed as bytes or as paths, into a zip archive.
+    PNG files are already compressed so by default they are stored without 
+    compression (ZIP_STORED). The members are written with ZipFile.writestr in 
+    the order in which they are added. With mode 'a' the members are appended to 
+    an existing archive without rewriting it and the members whose name is 
+    already in the archive are skipped.
+    '''
+    def __init__(self, target_zip_file, mode='w', compression=zipfile.ZIP_STORED, compresslevel=6):
+        self.zip_file = ZipFile(target_zip_file, mode, compression)
+        self.compression = compression
+        self.compresslevel = compresslevel
+        self.names = set(self.zip_file.namelist())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, arcname, data):
+        '''
+        Adds a member with the name and the bytes passed as arguments.
+        Returns False if a member with the same name already exists.
+        '''
+        if (arcname in self.names):
+            return False
+        self.names.add(arcname)
+        self.zip_file.writestr(arcname, data, compress_type=self.compression, compresslevel=self.compresslevel)
+        return True
+
+    def add_file(self, file_path, arcname=None):
+        '''
+        Adds a file as a member named as the file, without folder, if 
+        arcname is None. Returns False if the member already exists.
+        '''
+        arcname = arcname or pathlib.Path(file_path).name
+        if (arcname in self.names):
+            return False
+        with open(file_path, 'rb') as f:
+            return self.add(arcname, f.read())
+
+    def close(self):
+        '''
+        Writes the central directory of the archive.
+        '''
+        self.zip_file.close()
+
+def zip_pngs(pngs_list, target_zip_file, compression=zipfile.ZIP_STORED, mode='w'):
     '''
-    This function can be used to compress all the PNG files
-    created using the createPNGs function into a zip file
+    This function can be used to put all the PNG files created using the 
+    createPNGs function into a zip file. PNG files are already compressed so 
+    by default they are stored without compression. With mode 'a' the files 
+    are appended to an existing zip file (see PNGArchiveWriter).
     '''
-    with ZipFile(target_zip_file, 'w', zipfile.ZIP_DEFLATED) as zipObj:
+    with PNGArchiveWriter(target_zip_file, mode=mode, compression=compression) as writer:
         for png in pngs_list:
-            png_path = pathlib.Path(png)
-            zipObj.write(png, arcname=png_path.name)
+            writer.add_file(png)
+
+def merge_archives(source_zip_files, target_zip_file, sort_key=None, compression=zipfile.ZIP_STORED):
+    '''
+    This function merges the members of the source zip files in the target
+    zip file, sorted by the sort_key function of their names if it is passed,
+    e.g. the one returned by tile_order_key, otherwise in the order of the 
+    source files. The members are copied one at a time and the members with 
+    the same name are added once. Returns the list of the member names.
+    '''
+    source_archives = [ZipFile(source_zip_file, 'r') for source_zip_file in source_zip_files]
+    try:
+        members = [(name, source_archive) for source_archive in source_archives for name in source_archive.namelist()]
+        if (sort_key is not None):
+            members.sort(key=lambda member: sort_key(member[0]))
+        names = []
+        with PNGArchiveWriter(target_zip_file, compression=compression) as writer:
+            for name, source_archive in members:
+                if (writer.add(name, source_archive.read(name))):
+                    names.append(name)
+    finally:
+        for source_archive in source_archives:
+            source_archive.close()
+    return names
 
 def unzip_pngs(source_zip_file, target_folder):
     with ZipFile(source_zip_file, 'r') as zipObj:
         zipObj.extractall(path=f'{target_folder}')
 
+def read_png(png_path):
+    '''
+    Returns the array of a PNG file, or of a file written with one of the
+    other codecs (see encode_array), with shape (height, width, channels) 
+    for a multiband image or (height, width) for a mask. If the raster cache
+    is enabled (see enable_raster_cache) the array is read-only.
+    '''
+    return cached_read(png_path, _read_png_file)
+
+def _read_png_file(png_path):
+    if (file_codec(png_path) in ('npy', 'zstd')):
+        return read_array_file(png_path)
+    with rasterio.open(png_path) as dataset:
+        array = dataset.read()
+    if (array.shape[0] == 1):
+        return array[0]
+    return np.ascontiguousarray(np.moveaxis(array, 0, -1))
+
+def write_shards(pngs_list, masks_list, target_dir, shard_size=4096):
+    '''
+    This function packs the PNG images and masks of the two lists, e.g. 
+    created by createPNGs and mapCorineL1_list, into shards of shard_size 
+    patches. Each shard is a pair of .npy files with contiguous arrays: 
+    shard_<n>_images.npy with shape (N, 120, 120, 3) and dtype uint8, and 
+    shard_<n>_masks.npy with shape (N, 120, 120) and the dtype of the masks. 
+    The i-th mask must belong to the same patch of the i-th image. The ids 
+    of the patches in the shards are saved in shards_index.json in the order
+    in which they are stored. Use ShardReader to read the shards. Returns 
+    the number of shards.
+    '''
+    if (len(pngs_list) != len(masks_list)):
+        raise ValueError('The number of images and masks must be the same')
+    os.makedirs(target_dir, exist_ok=True)
+    patch_ids = []
+    num_shards = 0
+    image_shape = None
+    mask_dtype = None
+    for shard_start in range(0, len(pngs_list), shard_size):
+        shard_pngs = pngs_list[shard_start:shard_start + shard_size]
+        shard_masks = masks_list[shard_start:shard_start + shard_size]
+        images = None
+        masks = None
+        for patch_index, (png, mask) in enumerate(zip(shard_pngs, shard_masks)):
+            patch_id = read_patch_id(pathlib.Path(png).name)
+            if (patch_id != read_patch_id(pathlib.Path(mask).name)):
+                raise ValueError('The mask {} does not belong to the image {}'.format(mask, png))
+            image_array = read_png(png)
+            mask_array = read_mask(mask)
+            if (images is None):
+                image_shape = image_array.shape
+                mask_dtype = mask_array.dtype
+                shard_name = 'shard_{:05d}'.format(num_shards)
+                images = np.lib.format.open_memmap(os.path.join(target_dir, shard_name + '_images.npy'), mode='w+',
+                                                   dtype=np.uint8, shape=(len(shard_pngs),) + image_shape)
+                masks = np.lib.format.open_memmap(os.path.join(target_dir, shard_name + '_masks.npy'), mode='w+',
+                                                  dtype=mask_dtype, shape=(len(shard_pngs),) + mask_array.shape)
+            images[patch_index] = image_array
+            masks[patch_index] = mask_array
+            patch_ids.append(patch_id)
+        images.flush()
+        masks.flush()
+        del images, masks
+        num_shards += 1
+        print('Shard {:d} completed'.format(num_shards))
+    
+    index = {'shard_size': shard_size, 
+             'num_shards': num_shards, 
+             'image_shape': image_shape, 
+             'mask_dtype': str(mask_dtype), 
+             'patch_ids': patch_ids}
+    with open(os.path.join(target_dir, 'shards_index.json'), 'w') as f:
+        json.dump(index, f)
+    return num_shards
+
+class ShardReader:
+    '''
+    This class reads the shards written by write_shards. The shards are 
+    memory mapped so that reading a patch, or a batch of consecutive patches
+    within a shard, returns a view of the file without copying or decoding it.
+    The patches are indexed by their position in the index of the shards or 
+    by their patch id.
+    '''
+    def __init__(self, shards_dir):
+        with open(os.path.join(shards_dir, 'shards_index.json'), 'r') as f:
+            index = json.load(f)
+        self.shard_size = index['shard_size']
+        self.patch_ids = index['patch_ids']
+        self.positions = {patch_id: position for position, patch_id in enumerate(self.patch_ids)}
+        self.images = []
+        self.masks = []
+        for shard_index in range(index['num_shards']):
+            shard_name = os.path.join(shards_dir, 'shard_{:05d}'.format(shard_index))
+            self.images.append(np.load(shard_name + '_images.npy', mmap_mode='r'))
+            self.masks.append(np.load(shard_name + '_masks.npy', mmap_mode='r'))
+
+    def __len__(self):
+        return len(self.patch_ids)
+
+    def get(self, position):
+        '''
+        Returns the image and the mask of the patch at the position.
+        '''
+        shard_index, offset = divmod(position, self.shard_size)
+        return self.images[shard_index][offset], self.masks[shard_index][offset]
+
+    def get_patch(self, patch_id):
+        '''
+        Returns the image and the mask of the patch with the id.
+        '''
+        return self.get(self.positions[patch_id])
+
+    def get_batch(self, start, end):
+        '''
+        Returns the images and the masks of the patches from the start position 
+        to the end position excluded. If they are in the same shard the arrays 
+        are views of the shard, otherwise they are copied.
+        '''
+        end = min(end, len(self.patch_ids))
+        first_shard, first_offset = divmod(start, self.shard_size)
+        last_shard, last_offset = divmod(end - 1, self.shard_size)
+        if (first_shard == last_shard):
+            return (self.images[first_shard][first_offset:last_offset + 1], 
+                    self.masks[first_shard][first_offset:last_offset + 1])
+        return self.take(range(start, end))
+
+    def take(self, positions):
+        '''
+        Returns the images and the masks of the patches at the positions in 
+        the list, e.g. a shuffled batch, copied into two new arrays.
+        '''
+        positions = list(positions)
+        images = np.empty((len(positions),) + self.images[0].shape[1:], dtype=self.images[0].dtype)
+        masks = np.empty((len(positions),) + self.masks[0].shape[1:], dtype=self.masks[0].dtype)
+        for batch_index, position in enumerate(positions):
+            images[batch_index], masks[batch_index] = self.get(position)
+        return images, masks
+
+class PNGArchiveReader:
+    '''
+    This class reads the PNG files in a zip archive, e.g. created by zip_pngs, 
+    without extracting them. The central directory of the archive is read once 
+    when the reader is created. The members can be read by position or by patch 
+    id (see read_patch_id) and decoded into arrays with shape (height, width, channels)
+    for the images or (height, width) for the masks. The members are read with 
+    positioned reads on a shared file descriptor so that many threads can read 
+    from the same reader at the same time. Only the members whose name starts 
+    with the prefix, e.g. 'images/', are indexed. The members written with the
+    other codecs, e.g. .webp or .npy.zst files, are read as well (see decode_array).
+    '''
+    def __init__(self, zip_path, prefix=''):
+        with ZipFile(zip_path, 'r') as zip_file:
+            self.members = [zinfo for zinfo in zip_file.infolist() 
+                            if zinfo.filename.startswith(prefix) and file_codec(zinfo.filename) is not None]
+        self.patch_ids = [read_patch_id(pathlib.PurePath(zinfo.filename).name) for zinfo in self.members]
+        self.positions = {patch_id: position for position, patch_id in enumerate(self.patch_ids)}
+        self.file = open(zip_path, 'rb')
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.members)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _read_at(self, offset, size):
+        if (hasattr(os, 'pread')):
+            return os.pread(self.file.fileno(), size, offset)
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read(size)
+
+    def read_bytes(self, position):
+        '''
+        Returns the bytes of the PNG file of the member at the position.
+        '''
+        zinfo = self.members[position]
+        local_header = self._read_at(zinfo.header_offset, 30)
+        if (local_header[:4] != b'PK\x03\x04'):
+            raise zipfile.BadZipFile('Bad local file header of {}'.format(zinfo.filename))
+        name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+        data = self._read_at(zinfo.header_offset + 30 + name_length + extra_length, zinfo.compress_size)
+        if (zinfo.compress_type == zipfile.ZIP_DEFLATED):
+            data = zlib.decompress(data, -15)
+        elif (zinfo.compress_type != zipfile.ZIP_STORED):
+            with self.lock, ZipFile(self.file.name, 'r') as zip_file:
+                data = zip_file.read(zinfo)
+        if (zlib.crc32(data) != zinfo.CRC):
+            raise zipfile.BadZipFile('Bad CRC-32 of {}'.format(zinfo.filename))
+        return data
+
+    def read(self, position):
+        '''
+        Returns the decoded array of the member at the position.
+        '''
+        return decode_array(self.read_bytes(position), file_codec(self.members[position].filename))
+
+    def read_patch(self, patch_id):
+        '''
+        Returns the decoded array of the member of the patch.
+        '''
+        return self.read(self.positions[patch_id])
+
+    def read_many(self, positions, num_threads=8):
+        '''
+        Returns the list of the decoded arrays of the members at 
+        the positions, read and decoded by a pool of threads.
+        '''
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            return list(executor.map(self.read, positions))
+
+    def close(self):
+        self.file.close()
+
+def dihedral_transform(array, transform, axes=(0, 1)):
+    '''
+    This function applies to an array one of the 8 transforms of the square: 
+    a rotation by transform % 4 times 90 degrees followed, if transform is 4 or 
+    more, by a flip of the rows. The axes are the rows and the columns, e.g. 
+    (1, 2) for a batch. Returns a view of the array, without copying it.
+    '''
+    array = np.rot90(array, transform % 4, axes=axes)
+    if (transform >= 4):
+        array = np.flip(array, axis=axes[0])
+    return array
+
+def random_dihedral_transforms(num_samples, rng, square=True):
+    '''
+    Returns a random transform (see dihedral_transform) for each sample. If the
+    images are not square only the transforms that keep their shape are used:
+    the identity, the rotation by 180 degrees and the two flips.
+    '''
+    if (square):
+        return rng.integers(0, 8, size=num_samples)
+    return rng.choice(np.array([0, 2, 4, 6]), size=num_samples)
+
+def augment_batch(images, masks, rng=None, transforms=None):
+    '''
+    This function applies a dihedral transform (see dihedral_transform) to each 
+    image of a batch with shape (batch, height, width, channels) and the same 
+    transform to its mask with shape (batch, height, width), in place. The 
+    transforms of the samples are passed, e.g. by BatchLoader, or drawn from 
+    the random generator. The samples with the same transform are transformed 
+    together with one array operation. Returns the transforms of the samples.
+    '''
+    if (transforms is None):
+        transforms = random_dihedral_transforms(len(images), rng, images.shape[1] == images.shape[2])
+    for transform in range(1, 8):
+        samples = np.flatnonzero(transforms == transform)
+        if (len(samples) > 0):
+            images[samples] = dihedral_transform(images[samples], transform, axes=(1, 2))
+            masks[samples] = dihedral_transform(masks[samples], transform, axes=(1, 2))
+    return transforms
+
+class BatchLoader:
+    '''
+    This class loads batches of images and masks, e.g. for the evaluation of a 
+    model or for the statistics, without depending on a deep learning framework.
+    The images and the masks are lists of PNG file paths or PNGArchiveReader 
+    objects and are paired by patch id (see read_patch_id), so the mask of a 
+    patch is always in the same position of its image in a batch. The PNG files 
+    are decoded, and resized to image_size (height, width) if it is passed, by a 
+    pool of num_threads threads directly into preallocated buffers with shape 
+    (batch_size, height, width, channels) for the images and (batch_size, height, 
+    width) for the masks, with the dtype of the PNG masks. The images are uint8 or 
+    float16 with the values in [0, 255], not rescaled, as in the TF datasets of the 
+    notebooks, and label_offset is subtracted from the masks, e.g. 1 to have the 
+    classes starting from 0. Up to prefetch batches are loaded in a background 
+    thread while the current one is used. The 
+    arrays of a batch are reused for the next batches: they are valid until the 
+    next batch is requested and shall be copied to be kept. With shuffle the order 
+    of the patches in each epoch is a permutation given by the seed and by the 
+    number of the epoch, so that every run sees the same sequence of batches.
+    With augment each image and its mask are transformed by a random flip or 
+    rotation (see dihedral_transform), also given by the seed and the epoch. 
+    The transforms are applied by augment_batch to the whole batch in its 
+    buffers, with one array operation for each transform, and the number of 
+    patches of an epoch does not change.
+    '''
+    def __init__(self, images, masks, batch_size=32, image_size=None, dtype=np.uint8, label_offset=0,
+                 shuffle=False, seed=0, num_threads=8, prefetch=2, drop_remainder=False, augment=False):
+        image_ids, self.image_items, self.image_reader = self._index_source(images)
+        mask_ids, mask_items, self.mask_reader = self._index_source(masks)
+        mask_positions = {patch_id: position for position, patch_id in enumerate(mask_ids)}
+        missing = [patch_id for patch_id in image_ids if patch_id not in mask_positions]
+        if (len(missing) > 0):
+            raise ValueError('{:d} images have no mask, e.g. {}'.format(len(missing), missing[0]))
+        self.patch_ids = image_ids
+        self.mask_items = [mask_items[mask_positions[patch_id]] for patch_id in image_ids]
+        self.batch_size = batch_size
+        self.dtype = np.dtype(dtype)
+        self.label_offset = label_offset
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_threads = num_threads
+        self.prefetch = max(prefetch, 1)
+        self.drop_remainder = drop_remainder
+        self.augment = augment
+        self.epoch = 0
+        first_image = self._decode(self.image_reader, self.image_items[0])
+        if (image_size is None):
+            image_size = first_image.shape[:2]
+        self.image_size = tuple(image_size)
+        channels = first_image.shape[2] if first_image.ndim == 3 else 1
+        mask_dtype = self._decode(self.mask_reader, self.mask_items[0]).dtype
+        num_buffers = self.prefetch + 1
+        self.images = np.zeros((num_buffers, batch_size) + self.image_size + (channels,), dtype=self.dtype)
+        self.masks = np.zeros((num_buffers, batch_size) + self.image_size, dtype=mask_dtype)
+
+    @staticmethod
+    def _index_source(source):
+        if (isinstance(source, PNGArchiveReader)):
+            return list(source.patch_ids), list(range(len(source))), source
+        return [read_patch_id(pathlib.Path(path).name) for path in source], list(source), None
+
+    @staticmethod
+    def _decode(reader, item, size=None, resample=None):
+        from PIL import Image
+        codec = file_codec(item if reader is None else reader.members[item].filename)
+        if (codec in ('npy', 'zstd')):
+            array = read_array_file(item) if reader is None else decode_array(reader.read_bytes(item), codec)
+            if (size is None or array.shape[:2] == tuple(size)):
+                return array
+            image = Image.fromarray(array)
+        elif (reader is None):
+            image = Image.open(item)
+        else:
+            image = Image.open(io.BytesIO(reader.read_bytes(item)))
+        if (size is not None and image.size != (size[1], size[0])):
+            image = image.resize((size[1], size[0]), resample)
+        return np.asarray(image)
+
+    def __len__(self):
+        if (self.drop_remainder):
+            return len(self.patch_ids) // self.batch_size
+        return -(-len(self.patch_ids) // self.batch_size)
+
+    def epoch_order(self, epoch):
+        '''
+        Returns the order of the positions of the patches in an epoch.
+        '''
+        if (not self.shuffle):
+            return np.arange(len(self.patch_ids))
+        return np.random.default_rng([self.seed, epoch]).permutation(len(self.patch_ids))
+
+    def epoch_transforms(self, epoch):
+        '''
+        Returns the transforms of the patches in an epoch (see dihedral_transform),
+        by position of the patch, or None if the loader does not augment the patches.
+        '''
+        if (not self.augment):
+            return None
+        rng = np.random.default_rng([self.seed, epoch, 1])
+        return random_dihedral_transforms(len(self.patch_ids), rng, self.image_size[0] == self.image_size[1])
+
+    def _load(self, buffer_index, batch_index, position):
+        from PIL import Image
+        image = self._decode(self.image_reader, self.image_items[position], self.image_size, Image.BILINEAR)
+        mask = self._decode(self.mask_reader, self.mask_items[position], self.image_size, Image.NEAREST)
+        image_buffer = self.images[buffer_index, batch_index]
+        if (image.ndim == 2):
+            image = image[:, :, np.newaxis]
+        image_buffer[...] = image
+        if (mask.ndim == 3):
+            mask = mask[:, :, 0]
+        np.subtract(mask, self.label_offset, out=self.masks[buffer_index, batch_index], casting='unsafe')
+
+    def _produce(self, batches, transforms, free_buffers, ready_batches, stop):
+        try:
+            with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+                for batch_positions in batches:
+                    buffer_index = free_buffers.get()
+                    if (stop.is_set()):
+                        return
+                    futures = [executor.submit(self._load, buffer_index, batch_index, position) 
+                               for batch_index, position in enumerate(batch_positions)]
+                    for future in futures:
+                        future.result()
+                    if (transforms is not None):
+                        num_patches = len(batch_positions)
+                        augment_batch(self.images[buffer_index, :num_patches], self.masks[buffer_index, :num_patches],
+                                      transforms=transforms[batch_positions])
+                    ready_batches.put((buffer_index, len(batch_positions), None))
+            ready_batches.put((None, 0, None))
+        except BaseException as error:
+            ready_batches.put((None, 0, error))
+
+    def __iter__(self):
+        order = self.epoch_order(self.epoch)
+        transforms = self.epoch_transforms(self.epoch)
+        self.epoch += 1
+        batches = [order[start:start + self.batch_size] for start in range(0, len(order), self.batch_size)]
+        if (self.drop_remainder and len(order) % self.batch_size != 0):
+            batches = batches[:-1]
+        free_buffers = queue.Queue()
+        for buffer_index in range(len(self.images)):
+            free_buffers.put(buffer_index)
+        ready_batches = queue.Queue()
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, daemon=True,
+                                    args=(batches, transforms, free_buffers, ready_batches, stop))
+        producer.start()
+        current_buffer = None
+        try:
+            while True:
+                if (current_buffer is not None):
+                    free_buffers.put(current_buffer)
+                buffer_index, num_patches, error = ready_batches.get()
+                if (error is not None):
+                    raise error
+                if (buffer_index is None):
+                    break
+                current_buffer = buffer_index
+                yield self.images[buffer_index, :num_patches], self.masks[buffer_index, :num_patches]
+        finally:
+            stop.set()
+            free_buffers.put(None)
+            producer.join()
+
 ## ------------------------------------------ 4) Normalization ------------------------------------
+def band_histogram(band_array):
+    '''
+    Returns the histogram of the values of a uint16 band with 65536 
+    bins of width 1, one for each possible value.
+    '''
+    return np.bincount(band_array.ravel(), minlength=65536)
+
+def _band_histograms_task(patches_list):
+    '''
+    Worker task of collect_band_histograms. It returns a dictionary with 
+    the sum of the histograms of each band of the patches of a tile.
+    '''
+    histograms = {}
+    for bands_list in patches_list:
+        for band_path in bands_list:
+            band_name = read_band_name(band_path.name)[2]
+            with rasterio.open(band_path) as dataset:
+                histogram = band_histogram(dataset.read(1))
+            if (band_name in histograms):
+                histograms[band_name] += histogram
+            else:
+                histograms[band_name] = histogram
+    return histograms
+
+def collect_band_histograms(tiles_list, num_workers=1):
+    '''
+    This function computes, in one streaming pass over the tiles returned by
+    list_image_files, the histogram of each Sentinel-2 band with 65536 bins of 
+    width 1. The tiles are processed in a pool of num_workers processes. Returns 
+    a dictionary with the histogram of each band, e.g. 'B04'. The histograms of 
+    different tile ranges can be added with merge_band_histograms.
+    '''
+    if (num_workers > 1):
+        with multiprocessing.Pool(processes=num_workers) as pool:
+            return merge_band_histograms(pool.imap_unordered(_band_histograms_task, tiles_list))
+    return merge_band_histograms(map(_band_histograms_task, tiles_list))
+
+def merge_band_histograms(histograms_list):
+    '''
+    Returns the sum of the histograms of each band in the list of dictionaries.
+    '''
+    merged_histograms = {}
+    for histograms in histograms_list:
+        for band_name, histogram in histograms.items():
+            if (band_name in merged_histograms):
+                merged_histograms[band_name] = merged_histograms[band_name] + histogram
+            else:
+                merged_histograms[band_name] = histogram
+    return merged_histograms
+
+def save_band_histograms(histograms, file_path):
+    '''
+    Saves the dictionary of the histograms of the bands in a npz file.
+    '''
+    np.savez(file_path, **histograms)
+
+def read_band_histograms(file_path):
+    '''
+    Reads the histograms of the bands saved by save_band_histograms.
+    '''
+    with np.load(file_path) as histograms:
+        return {band_name: histograms[band_name] for band_name in histograms.files}
+
+def band_clip_values(histograms, low_percentile=1.0, high_percentile=99.0):
+    '''
+    This function returns a dictionary with the (low, high) clip values of each 
+    band, the values at the low and high percentiles of its histogram. The values 
+    of the pixels of all the patches are then stretched between the same clip values
+    so that the same land cover has the same brightness in all the patches.
+    '''
+    clip_values = {}
+    for band_name, histogram in histograms.items():
+        cumulative = np.cumsum(histogram)
+        total = cumulative[-1]
+        low = int(np.searchsorted(cumulative, total * low_percentile / 100.0))
+        high = int(np.searchsorted(cumulative, total * high_percentile / 100.0))
+        clip_values[band_name] = (low, max(high, low + 1))
+    return clip_values
+
+_quantization_luts = {}
+
+def quantization_lut(low, high):
+    '''
+    Returns a lookup table with 65536 entries that maps each uint16 value 
+    to uint8, stretching the values between low and high to [0, 255] and 
+    clipping the others. The table is computed once with float32 arithmetic.
+    '''
+    key = (int(low), int(high))
+    if (key not in _quantization_luts):
+        values = np.arange(65536, dtype=np.float32)
+        values -= low
+        values *= np.float32(255.0 / (high - low))
+        np.clip(values, 0, 255, out=values)
+        lut = np.rint(values).astype(np.uint8)
+        lut.flags.writeable = False
+        _quantization_luts[key] = lut
+    return _quantization_luts[key]
+
+def quantize(band_array, low, high, out=None):
+    '''
+    This function transforms the bit depth of a uint16 band from 16 to 8 stretching
+    the values between the low and high clip values to [0, 255]. Unlike normalize 
+    it doesn't depend on the min and max of the band and it doesn't create float 
+    arrays: the arrays allocated are the uint8 result, unless the out array is 
+    passed, and the index array of np.take, that converts the uint16 values to 
+    intp, 8 bytes per pixel, e.g. 115 KB for a band of 120x120 pixels. The mode 
+    'clip' avoids the copy of the out array made by np.take in the default mode,
+    the uint16 values being always valid indexes of the table.
+    '''
+    return np.take(quantization_lut(low, high), band_array, out=out, mode='clip')
+
 def get_image_array(img_path):
     '''
     This function returns a NumPy array
     of the image. For one band it returns 
     a 2D array with shape (height, width).
     For a RGB image with three bands it 
-    returns a 3D array with shape (channels, height, width) 
+    returns a 3D array with shape (channels, height, width).
+    If the raster cache is enabled (see enable_raster_cache)
+    the array is read-only.
     '''
+    return cached_read(img_path, _read_gdal_array)
+
+def _read_gdal_array(img_path):
+    from osgeo import gdal
     with gdal.Open(img_path) as image_ds:
         image_array = image_ds.ReadAsArray()
     return image_array
@@ -547,6 +2609,9 @@ def plot_examples(images_list, masks_list, start=0, end=10):
     '''
     Plots images and masks in two columns.
     '''
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import ListedColormap
+    from PIL import Image
     row_start = start
     row_end = end
     num_rows = row_end - row_start
@@ -591,6 +2656,97 @@ def corine_l3_color_map():
     
     return hex_color_map
 
+_corine_color_luts = {}
+
+def corine_color_lut(level='l3'):
+    '''
+    This function returns a uint8 lookup table with shape (values, 3) that maps 
+    the values of a mask to the RGB colors of corine_l1_color_map, for the 'l1' 
+    class indexes [1, 6], or of corine_l3_color_map, for the 'l3' class indexes 
+    [1, 45] or for the 'codes' of the Corine2018 Level 3 classes, e.g. 211, of 
+    the reference maps. The other values are black. The tables are computed once.
+    '''
+    if (level in _corine_color_luts):
+        return _corine_color_luts[level]
+    if (level not in ('l1', 'l3', 'codes')):
+        raise ValueError('Unknown Corine2018 level: {}'.format(level))
+    if (level == 'codes'):
+        lut = corine_color_lut('l3')[corine2018_lut('l3')]
+    else:
+        color_map = corine_l1_color_map() if level == 'l1' else corine_l3_color_map()
+        lut = np.zeros((256, 3), dtype=np.uint8)
+        for class_index, color in enumerate(color_map):
+            lut[class_index + 1] = [int(color[i:i + 2], 16) for i in (1, 3, 5)]
+    lut.flags.writeable = False
+    _corine_color_luts[level] = lut
+    return lut
+
+def colorize_mask(mask_array, level='l3'):
+    '''
+    Returns the RGB image, with shape (..., 3) and dtype uint8, of a mask or 
+    of a stack of masks using the lookup table of the level (see corine_color_lut).
+    '''
+    lut = corine_color_lut(level)
+    return lut[np.minimum(mask_array, len(lut) - 1)]
+
+def contact_sheet(images, masks, level='l3', columns=16, step=1, gap=2, labels=None):
+    '''
+    This function tiles the images, with shape (N, height, width, 3), and the 
+    colored masks, with shape (N, height, width), of N patches into one RGB array, 
+    a contact sheet, for the visual check of many pairs at once. Each cell has 
+    the image on the left and the mask on the right, the cells are placed in 
+    rows of columns cells and separated by gap white pixels. The patches are 
+    subsampled taking one pixel every step pixels. All the operations are on 
+    whole arrays: the masks are colored with the lookup table of the level (see 
+    colorize_mask) and the cells are arranged with one reshape and transpose. 
+    If a list of labels, e.g. the patch ids, is passed they are written on the 
+    cells with PIL.
+    '''
+    images = np.asarray(images)[:, ::step, ::step]
+    masks = colorize_mask(np.asarray(masks)[:, ::step, ::step], level)
+    if (images.ndim == 3):
+        images = np.repeat(images[..., np.newaxis], 3, axis=3)
+    num_patches, height, width = images.shape[:3]
+    num_rows = -(-num_patches // columns)
+    cell_height, cell_width = height + gap, 2 * width + 2 * gap
+    cells = np.full((num_rows * columns, cell_height, cell_width, 3), 255, dtype=np.uint8)
+    cells[:num_patches, :height, :width] = images
+    cells[:num_patches, :height, width + gap:2 * width + gap] = masks
+    sheet = cells.reshape(num_rows, columns, cell_height, cell_width, 3).transpose(0, 2, 1, 3, 4)
+    sheet = sheet.reshape(num_rows * cell_height, columns * cell_width, 3)
+    if (labels is not None):
+        from PIL import Image, ImageDraw
+        sheet_image = Image.fromarray(sheet)
+        draw = ImageDraw.Draw(sheet_image)
+        for patch_index, label in enumerate(labels):
+            row, column = divmod(patch_index, columns)
+            position = (column * cell_width + 2, row * cell_height + 1)
+            draw.text(position, str(label), fill=(255, 255, 255), stroke_width=1, stroke_fill=(0, 0, 0))
+        sheet = np.asarray(sheet_image)
+    return sheet
+
+def render_contact_sheets(images, masks, target_prefix, level='l3', patches_per_sheet=1024, columns=32, 
+                          step=1, labels=False, num_threads=8):
+    '''
+    This function renders the pairs of images and masks, lists of PNG files or 
+    PNGArchiveReader objects paired by patch id, into contact sheets of 
+    patches_per_sheet patches (see contact_sheet) saved as PNG files named 
+    target_prefix_000.png, target_prefix_001.png and so on. The PNG files are 
+    decoded by a BatchLoader with num_threads threads while the previous sheet 
+    is rendered. If labels is True the patch ids are written on the cells. 
+    Returns the list of the PNG files.
+    '''
+    loader = BatchLoader(images, masks, batch_size=patches_per_sheet, num_threads=num_threads, prefetch=1)
+    sheet_paths = []
+    for sheet_index, (batch_images, batch_masks) in enumerate(loader):
+        start = sheet_index * patches_per_sheet
+        sheet_labels = loader.patch_ids[start:start + len(batch_images)] if labels else None
+        sheet = contact_sheet(batch_images, batch_masks, level, columns, step, labels=sheet_labels)
+        sheet_path = '{}_{:03d}.png'.format(target_prefix, sheet_index)
+        write_png(sheet_path, [sheet[:, :, band] for band in range(3)], 'uint8')
+        sheet_paths.append(sheet_path)
+    return sheet_paths
+
 def corine2018_l3_labels():
     '''
     This function simply returns the list of the 44 
@@ -651,29 +2807,103 @@ def corine_l3_mask(mask_array):
     to a set indexes, from 1 to 45, that corresponds to the
     Corine2018 classes.
     '''
-    size = mask_array.shape
-    unif_mask = np.zeros(size, dtype=np.int8)
-    unique_values = np.unique(mask_array) 
-    for u in unique_values:
-        t_mask = (mask_array == u)
-        unif_mask[t_mask] = corine2018_l3_class_bucket(u)
-    return unif_mask
+    return corine_remap(mask_array, 'l3')
+
+def corine_l2_mask(mask_array):
+    '''
+    This function maps the Corine2018 L3 values of a mask
+    to Level 2 (15 + 1 classes).
+    '''
+    return corine_remap(mask_array, 'l2')
 
 def corine_l1_mask(mask_array):
     '''
     This function maps the Corine2018 L3 values of a mask
     to Level 1 (5 + 1 classes and color codes).
     '''
-    size = mask_array.shape
-    unif_mask = np.zeros(size, dtype=np.int8)
-    unique_values = np.unique(mask_array) 
-    for u in unique_values:
-        t_mask = (mask_array == u)
-        unif_mask[t_mask] = corine2018_l1_class_bucket(u)
-    return unif_mask
+    return corine_remap(mask_array, 'l1')
+
+def corine_bigearthnet19_mask(mask_array):
+    '''
+    This function maps the Corine2018 L3 values of a mask
+    to the BigEarthNet nomenclature (19 + 1 classes).
+    '''
+    return corine_remap(mask_array, 'ben19')
 
 
 ## ---------------------------------------------- 6) Statistics
+# Corine2018 Level 3 class codes. The last code 999 does not belong 
+# to Corine2018 and is used for pixels that were not classified.
+CORINE2018_L3_CODES = [
+    111, 112, 121, 122, 123, 124, 131, 132, 133, 141, 142,
+    211, 212, 213, 221, 222, 223, 231, 241, 242, 243, 244,
+    311, 312, 313, 321, 322, 323, 324, 331, 332, 333, 334, 335,
+    411, 412, 421, 422, 423,
+    511, 512, 521, 522, 523, 
+    999]
+
+# Corine2018 Level 2 class codes plus 99 for the pixels that were not classified.
+CORINE2018_L2_CODES = [11, 12, 13, 14, 21, 22, 23, 24, 31, 32, 33, 41, 42, 51, 52, 99]
+
+# Corine2018 Level 3 class codes of each one of the 19 classes of the BigEarthNet nomenclature
+BIGEARTHNET19_L3_CODES = [
+    [111, 112], [121], [211, 212, 213], [221, 222, 223, 241], [231], [242], [243], [244],
+    [311], [312], [313], [321, 333], [322, 323], [324], [331], 
+    [411, 412], [421, 422], 
+    [511, 512], [521, 522, 523]]
+
+# Number of classes of each level, the last one is 'Unclassified'
+CORINE2018_NUM_CLASSES = {'l1': 6, 'l2': 16, 'l3': 45, 'ben19': 20}
+
+_corine2018_luts = {}
+
+def corine2018_lut(level):
+    '''
+    This function returns a lookup table that maps each uint16 value, from 
+    0 to 65535, of a Corine2018 Level 3 mask to the index of its class in the 
+    level: 'l1' [1, 6], 'l2' [1, 16], 'l3' [1, 45] or 'ben19', the BigEarthNet 
+    nomenclature, [1, 20]. The last index of each level is used for 999, 
+    i.e. pixels that were not classified, and for 'ben19' also for the 
+    codes that are not part of the nomenclature. The values that are not 
+    Corine2018 codes, e.g. a nodata value of 65535, are mapped to 0. The 
+    tables are computed once.
+    '''
+    if (level in _corine2018_luts):
+        return _corine2018_luts[level]
+    if (level not in CORINE2018_NUM_CLASSES):
+        raise ValueError('Unknown Corine2018 level: {}'.format(level))
+    num_classes = CORINE2018_NUM_CLASSES[level]
+    lut = np.zeros(65536, dtype=np.uint8)
+    for code_index, code in enumerate(CORINE2018_L3_CODES):
+        if (code == 999):
+            lut[code] = num_classes
+        elif (level == 'l3'):
+            lut[code] = code_index + 1
+        elif (level == 'l2'):
+            lut[code] = CORINE2018_L2_CODES.index(code // 10) + 1
+        elif (level == 'l1'):
+            lut[code] = code // 100
+        else:
+            lut[code] = num_classes
+    if (level == 'ben19'):
+        for class_index, codes in enumerate(BIGEARTHNET19_L3_CODES):
+            lut[codes] = class_index + 1
+    lut.flags.writeable = False
+    _corine2018_luts[level] = lut
+    return lut
+
+def corine_remap(mask_array, level='l3'):
+    '''
+    This function maps the Corine2018 Level 3 values of a mask, or of a 
+    stack of masks with shape (N, H, W), to the class indexes of the level, 
+    one of 'l1', 'l2', 'l3' or 'ben19', using a lookup table (see corine2018_lut) 
+    in one pass over the pixels. Returns an array of dtype uint8 with the 
+    same shape of the input. The values that are not Corine2018 codes are 
+    mapped to 0, also the ones outside the uint16 range of the table, that 
+    are clipped to its first or last value.
+    '''
+    return np.take(corine2018_lut(level), mask_array, mode='clip')
+
 def corine2018_l3_class_code(index):
     '''
     This function returns the Corine2018 Land Cover classification 
@@ -687,15 +2917,7 @@ def corine2018_l3_class_code(index):
         print('The index must be a number between 1 and 44')
         return FAILURE
     
-    corine2018_class_code = [
-        111, 112, 121, 122, 123, 124, 131, 132, 133, 141, 142,
-        211, 212, 213, 221, 222, 223, 231, 241, 242, 243, 244,
-        311, 312, 313, 321, 322, 323, 324, 331, 332, 333, 334, 335,
-        411, 412, 421, 422, 423,
-        511, 512, 521, 522, 523, 
-        999]
-    
-    return corine2018_class_code[index - 1]
+    return CORINE2018_L3_CODES[index - 1]
     
 def corine2018_l3_class_bucket(clc_code):
     '''
@@ -705,54 +2927,409 @@ def corine2018_l3_class_bucket(clc_code):
     were not classified. This function works as the inverse of 
     corine2018_l3_class_code().
     '''
-    corine2018_class_code = [
-        111, 112, 121, 122, 123, 124, 131, 132, 133, 141, 142,
-        211, 212, 213, 221, 222, 223, 231, 241, 242, 243, 244,
-        311, 312, 313, 321, 322, 323, 324, 331, 332, 333, 334, 335,
-        411, 412, 421, 422, 423,
-        511, 512, 521, 522, 523, 
-        999]
-    
-    clc_code_index = corine2018_class_code.index(clc_code)
-    corine2018_class_buckets = np.arange(1,46, dtype='uint8')
-    bucket = corine2018_class_buckets[clc_code_index]
+    bucket = corine2018_lut('l3')[clc_code]
+    if (bucket == 0):
+        raise ValueError('{} is not a Corine2018 class code'.format(clc_code))
     return bucket
 
-def collect_statistics(root_path, start_tile_index, end_tile_index, print_msg=False):
+def mask_pixel_counts(mask_array):
+    '''
+    This function returns the number of pixels of a Corine2018 Level 3
+    mask in each one of the 45 classes (see corine2018_l3_class_code).
+    The counts are computed in one pass with np.bincount over the class
+    indexes of the pixels.
+    '''
+    class_indexes = corine_remap(mask_array, 'l3')
+    return np.bincount(class_indexes.ravel(), minlength=46)[1:]
+
+def source_fingerprint(source_paths):
+    '''
+    Returns a digest of name, size and modification time of the source files
+    of a patch, or None if one of them cannot be read.
+    '''
+    digest = hashlib.blake2b(digest_size=8)
+    try:
+        for path in sorted(str(path) for path in source_paths):
+            stat = os.stat(path)
+            digest.update('{}:{:d}:{:d};'.format(os.path.basename(path), stat.st_size, stat.st_mtime_ns).encode())
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+def _tile_statistics_task(task):
+    '''
+    Worker task of collect_class_statistics. It counts the pixels of each class 
+    in the masks of a tile and saves them in the partial statistics file of the tile,
+    if its path is not None. If the partial file already exists and it was saved
+    for the same mask files, with the same size and modification time (see 
+    source_fingerprint), it is read instead. The patches without a reference map 
+    are skipped. Returns the patch ids and the pixel counts of the masks, one row 
+    per mask, and the number of patches without a reference map.
+    '''
+    patches_list, partial_path = task
+    mask_paths = [mask_list[0] for mask_list in patches_list if len(mask_list) > 0]
+    num_missing = len(patches_list) - len(mask_paths)
+    fingerprint = source_fingerprint(mask_paths)
+    if (partial_path is not None and fingerprint is not None and 
+        read_tile_fingerprint(partial_path) == fingerprint):
+        patch_ids, pixel_counts = read_tile_statistics(partial_path)
+        return patch_ids, pixel_counts, num_missing
+    patch_ids = []
+    pixel_counts = np.zeros((len(mask_paths), 45), dtype=np.int64)
+    for patch_index, mask_path in enumerate(mask_paths):
+        tile, patch, date = read_mask_name(mask_path.name)
+        patch_ids.append(create_png_file_name(tile, patch, date)[:-4])
+        pixel_counts[patch_index] = mask_pixel_counts(read_mask(mask_path))
+    patch_ids = np.array(patch_ids, dtype=str)
+    if (partial_path is not None):
+        save_tile_statistics(partial_path, patch_ids, pixel_counts, fingerprint)
+    return patch_ids, pixel_counts, num_missing
+
+def save_tile_statistics(file_path, patch_ids, pixel_counts, fingerprint=None):
+    '''
+    Saves the partial statistics of a tile in a npz file: the ids of the 
+    patches, the number of pixels of each class in their masks and the 
+    fingerprint of the mask files (see source_fingerprint). The file is 
+    written atomically (see atomic_target).
+    '''
+    with atomic_target(str(file_path)) as temp_path:
+        with open(temp_path, 'wb') as f:
+            np.savez(f, patch_ids=patch_ids, pixel_counts=pixel_counts, fingerprint=str(fingerprint or ''))
+
+def read_tile_statistics(file_path):
+    '''
+    Reads the partial statistics of a tile saved by save_tile_statistics
+    and returns the patch ids and the pixel counts of their masks.
+    '''
+    with np.load(file_path) as partial:
+        return partial['patch_ids'], partial['pixel_counts'].astype(np.int64, copy=False)
+
+def read_tile_fingerprint(file_path):
+    '''
+    Returns the fingerprint of the mask files saved in the partial statistics 
+    of a tile, or None if the file doesn't exist, cannot be read or was saved 
+    without a fingerprint.
+    '''
+    try:
+        with np.load(file_path) as partial:
+            if ('fingerprint' not in partial.files):
+                return None
+            return str(partial['fingerprint']) or None
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return None
+
+def merge_statistics(pixel_counts_list):
+    '''
+    This function merges the pixel counts of the masks of one or more tiles
+    and returns a dictionary with the number of masks, the number of masks 
+    that contain each class ('image_counts'), the number of pixels of each 
+    class ('pixel_counts') and the class weights computed from the pixel counts.
+    '''
+    num_masks = 0
+    image_counts = np.zeros(45, dtype=np.int64)
+    pixel_counts = np.zeros(45, dtype=np.int64)
+    for tile_pixel_counts in pixel_counts_list:
+        num_masks += tile_pixel_counts.shape[0]
+        image_counts += np.count_nonzero(tile_pixel_counts, axis=0)
+        pixel_counts += tile_pixel_counts.sum(axis=0, dtype=np.int64)
+    return {'num_masks': num_masks,
+            'image_counts': image_counts,
+            'pixel_counts': pixel_counts,
+            'class_weights': class_weights(pixel_counts)}
+
+def merge_class_statistics(statistics_list):
+    '''
+    Merges the dictionaries returned by collect_class_statistics for different
+    tiles, e.g. the shards of a dataset, into the one of all the tiles. 
+    '''
+    pixel_counts = sum(statistics['pixel_counts'] for statistics in statistics_list)
+    return {'num_masks': sum(int(statistics['num_masks']) for statistics in statistics_list),
+            'missing_masks': sum(int(statistics.get('missing_masks', 0)) for statistics in statistics_list),
+            'image_counts': sum(statistics['image_counts'] for statistics in statistics_list),
+            'pixel_counts': pixel_counts,
+            'class_weights': class_weights(pixel_counts)}
+
+def merge_statistics_files(partial_paths):
+    '''
+    Merges the partial statistics files of the tiles (see merge_statistics)
+    without reading the masks again.
+    '''
+    return merge_statistics([read_tile_statistics(partial_path)[1] for partial_path in partial_paths])
+
+def class_presence_bits(pixel_counts):
+    '''
+    This function returns, for each row of pixel counts of the 45 classes 
+    (see mask_pixel_counts), a uint64 bitset in which the bit i is set if 
+    the class with index i + 1 is present in the mask.
+    '''
+    pixel_counts = np.asarray(pixel_counts)
+    presence = np.zeros(pixel_counts.shape[0], dtype=np.uint64)
+    for class_index in range(pixel_counts.shape[1]):
+        presence |= (pixel_counts[:, class_index] > 0).astype(np.uint64) << np.uint64(class_index)
+    return presence
+
+class ClassPresenceIndex:
+    '''
+    This class implements an inverted index of the Corine2018 Level 3 classes 
+    present in the masks of the patches. For each patch it stores the classes 
+    present as a uint64 bitset (see class_presence_bits) and the fraction of 
+    the pixels of the mask in each class as float16, about 100 bytes per patch. 
+    The index is built from the partial statistics of the tiles, without reading 
+    the masks (see build_class_index), and answers the queries for the patches 
+    that contain one or more classes with a bitwise operation on the bitsets.
+    The classes are passed as Corine2018 codes, e.g. 213 for Rice fields.
+    '''
+    def __init__(self, patch_ids, presence, fractions):
+        self.patch_ids = np.asarray(patch_ids, dtype=str)
+        self.presence = np.asarray(presence, dtype=np.uint64)
+        self.fractions = np.asarray(fractions, dtype=np.float16)
+        self.positions = {patch_id: position for position, patch_id in enumerate(self.patch_ids)}
+
+    def __len__(self):
+        return len(self.patch_ids)
+
+    @staticmethod
+    def class_bits(codes):
+        '''
+        Returns the bitset of a Corine2018 code or of a list of codes.
+        '''
+        bits = np.uint64(0)
+        for code in np.atleast_1d(codes):
+            bits |= np.uint64(1) << np.uint64(corine2018_l3_class_bucket(int(code)) - 1)
+        return bits
+
+    def select(self, codes, match='any', min_fraction=0.0):
+        '''
+        Returns the positions of the patches that contain any or all (match)
+        of the classes. If min_fraction is greater than 0 a class is present 
+        only if the fraction of its pixels is at least min_fraction.
+        '''
+        codes = np.atleast_1d(codes)
+        if (min_fraction > 0):
+            class_indexes = [corine2018_l3_class_bucket(int(code)) - 1 for code in codes]
+            present = self.fractions[:, class_indexes] >= min_fraction
+            selected = present.all(axis=1) if match == 'all' else present.any(axis=1)
+        else:
+            bits = self.class_bits(codes)
+            if (match == 'all'):
+                selected = (self.presence & bits) == bits
+            elif (match == 'any'):
+                selected = (self.presence & bits) != 0
+            else:
+                raise ValueError('Unknown match: {}'.format(match))
+        return np.flatnonzero(selected)
+
+    def patches_with(self, codes, match='any', min_fraction=0.0):
+        '''
+        Returns the ids of the patches that contain any or all of the classes (see select).
+        '''
+        return self.patch_ids[self.select(codes, match, min_fraction)]
+
+    def classes_of(self, patch_id):
+        '''
+        Returns the Corine2018 codes of the classes present in a patch.
+        '''
+        presence = int(self.presence[self.positions[patch_id]])
+        return [code for class_index, code in enumerate(CORINE2018_L3_CODES) if (presence >> class_index) & 1]
+
+    def class_counts(self, positions=None):
+        '''
+        Returns the number of patches, all or the ones at the positions, 
+        that contain each one of the 45 classes.
+        '''
+        presence = self.presence if positions is None else self.presence[positions]
+        return np.array([np.count_nonzero(presence & (np.uint64(1) << np.uint64(class_index)))
+                         for class_index in range(45)])
+
+def build_class_index(partial_paths):
+    '''
+    Builds the class presence index of the patches from the partial statistics
+    files of the tiles saved by collect_class_statistics with a partials folder.
+    '''
+    patch_ids_list = []
+    presence_list = []
+    fractions_list = []
+    for partial_path in partial_paths:
+        patch_ids, pixel_counts = read_tile_statistics(partial_path)
+        total_pixels = np.maximum(pixel_counts.sum(axis=1, keepdims=True), 1)
+        patch_ids_list.append(patch_ids)
+        presence_list.append(class_presence_bits(pixel_counts))
+        fractions_list.append((pixel_counts / total_pixels).astype(np.float16))
+    if (len(patch_ids_list) == 0):
+        return ClassPresenceIndex(np.array([], dtype=str), np.array([], dtype=np.uint64), 
+                                  np.zeros((0, 45), dtype=np.float16))
+    return ClassPresenceIndex(np.concatenate(patch_ids_list), np.concatenate(presence_list), 
+                              np.concatenate(fractions_list))
+
+def merge_class_indexes(indexes, sort_key=None):
+    '''
+    Merges the class presence indexes of different tiles, e.g. the shards of a 
+    dataset. If a sort key is passed (see tile_order_key) the patches are sorted
+    in the order of a single run.
+    '''
+    patch_ids = np.concatenate([index.patch_ids for index in indexes])
+    order = np.arange(len(patch_ids))
+    if (sort_key is not None):
+        order = np.array(sorted(order, key=lambda position: sort_key(patch_ids[position])), dtype=np.int64)
+    return ClassPresenceIndex(patch_ids[order], 
+                              np.concatenate([index.presence for index in indexes])[order],
+                              np.concatenate([index.fractions for index in indexes])[order])
+
+def save_class_index(index, file_path):
+    '''
+    Saves a class presence index in a npz file.
+    '''
+    np.savez(file_path, patch_ids=index.patch_ids, presence=index.presence, fractions=index.fractions)
+
+def read_class_index(file_path):
+    '''
+    Reads a class presence index saved by save_class_index.
+    '''
+    with np.load(file_path) as index:
+        return ClassPresenceIndex(index['patch_ids'], index['presence'], index['fractions'])
+
+def sample_class_subset(index, size, quotas=None, min_fraction=0.0, seed=0, exclude=(999,)):
+    '''
+    This function selects a subset of size patches from a class presence index 
+    in which the classes are as balanced as possible, without reading the masks. 
+    The quotas are a dictionary with the minimum number of patches that shall 
+    contain each class, by Corine2018 code, e.g. {213: 500, 421: 500}. Without 
+    quotas each class present in the index, except the excluded ones, gets the 
+    same quota of size divided by the number of classes. The classes are filled 
+    from the rarest to the most common, in a random order of the patches given 
+    by the seed, and a patch selected for a class counts also for the other classes 
+    it contains, so the rare classes get all their patches, up to their quota, and 
+    the common ones are mostly filled by the patches already selected. The remaining 
+    places are filled with random patches. If min_fraction is greater than 0 a patch 
+    counts for a class only if the fraction of its pixels is at least min_fraction.
+    Returns the positions of the patches in the index in a random order.
+    '''
+    rng = np.random.default_rng(seed)
+    size = min(size, len(index))
+    priority = rng.permutation(len(index))
+    if (quotas is None):
+        class_counts = index.class_counts()
+        codes = [code for class_index, code in enumerate(CORINE2018_L3_CODES) 
+                 if class_counts[class_index] > 0 and code not in exclude]
+        quotas = {code: -(-size // max(len(codes), 1)) for code in codes}
+    candidates_list = [(code, index.select(code, min_fraction=min_fraction)) for code in quotas]
+    candidates_list.sort(key=lambda item: len(item[1]))
+    selected = np.zeros(len(index), dtype=bool)
+    num_selected = 0
+    for code, candidates in candidates_list:
+        candidates = candidates[np.argsort(priority[candidates])]
+        num_missing = quotas[code] - np.count_nonzero(selected[candidates])
+        new_patches = candidates[~selected[candidates]][:max(min(num_missing, size - num_selected), 0)]
+        selected[new_patches] = True
+        num_selected += len(new_patches)
+    if (num_selected < size):
+        others = np.flatnonzero(~selected)
+        others = others[np.argsort(priority[others])][:size - num_selected]
+        selected[others] = True
+    positions = np.flatnonzero(selected)
+    return positions[np.argsort(priority[positions])]
+
+def class_weights(pixel_counts, method='median_frequency'):
+    '''
+    This function computes the weights of the classes for the training of a 
+    model on imbalanced data from the number of pixels of each class. With the
+    'median_frequency' method the weight of a class is the median of the class
+    frequencies divided by its frequency, with the 'inverse_frequency' method it 
+    is the number of pixels divided by the number of classes times the pixels of 
+    the class. The classes without pixels have weight 0.
+    '''
+    pixel_counts = np.asarray(pixel_counts, dtype=np.float64)
+    weights = np.zeros(len(pixel_counts))
+    present = pixel_counts > 0
+    if (not present.any()):
+        return weights
+    frequencies = pixel_counts[present] / pixel_counts.sum()
+    if (method == 'median_frequency'):
+        weights[present] = np.median(frequencies) / frequencies
+    elif (method == 'inverse_frequency'):
+        weights[present] = 1.0 / (np.count_nonzero(present) * frequencies)
+    else:
+        raise ValueError('Unknown method: {}'.format(method))
+    return weights
+
+def collect_class_statistics(root_path, start_tile_index, end_tile_index, partials_dir=None, 
+                             num_workers=1, print_msg=False, manifest_path=None, tile_names=None):
+    '''
+    This function counts for each one of the 45 Corine2018 classes the masks 
+    that contain it and its pixels in the masks of the tiles. If a partials 
+    folder is passed the counts of the masks of each tile are saved in a npz 
+    file, named as the tile folder, and the tiles whose file already exists 
+    and was saved for the same mask files are not read again, so that adding 
+    new tiles or merging the results of different runs only requires to merge 
+    the files. The tiles are processed in a pool of num_workers processes. 
+    Returns the dictionary of merge_statistics including the class weights and
+    the number of patches without a reference map ('missing_masks'), that are 
+    skipped. If a list of tile folder names is passed only those tiles are 
+    included (see list_mask_files).
+    '''
+    tiles_list = list_mask_files(root_path, start_tile_index, end_tile_index, manifest_path=manifest_path,
+                                 tile_names=tile_names)
+    tasks = []
+    tile_folders = []
+    missing_masks = 0
+    for patches_list in tiles_list:
+        mask_paths = [mask_list[0] for mask_list in patches_list if len(mask_list) > 0]
+        if (len(mask_paths) == 0):
+            missing_masks += len(patches_list)
+            continue
+        tile_folders.append(mask_paths[0].parent.parent.name)
+        partial_path = None
+        if (partials_dir is not None):
+            os.makedirs(partials_dir, exist_ok=True)
+            partial_path = os.path.join(partials_dir, tile_folders[-1] + '.npz')
+        tasks.append((patches_list, partial_path))
+    
+    pixel_counts_list = []
+    if (num_workers > 1):
+        with multiprocessing.Pool(processes=num_workers) as pool:
+            results = list(pool.imap(_tile_statistics_task, tasks))
+    else:
+        results = map(_tile_statistics_task, tasks)
+    for tile_folder, (patch_ids, pixel_counts, num_missing) in zip(tile_folders, results):
+        if (print_msg):
+            print('Tile:', tile_folder)
+            print('Number of patches per tile: ', len(patch_ids))
+            if (num_missing > 0):
+                print('Patches without a reference map: ', num_missing)
+            print('Classes: ', [CORINE2018_L3_CODES[c] for c in np.flatnonzero(pixel_counts.sum(axis=0))])
+        pixel_counts_list.append(pixel_counts)
+        missing_masks += num_missing
+    statistics = merge_statistics(pixel_counts_list)
+    statistics['missing_masks'] = missing_masks
+    return statistics
+
+def collect_statistics(root_path, start_tile_index, end_tile_index, print_msg=False, manifest_path=None):
     '''
     This function collects the unique values in each BigEarthNetv2 mask file
     and put them in a bucket list from 1 to 44 in order to count how many masks
     contain each one of the Corine2018 classes. The function return an array of
-    the 44 buckets with the number of masks for each class.
+    the 44 buckets with the number of masks for each class. If the path of a 
+    manifest created by build_manifest is passed the mask files are read from 
+    the manifest instead of the file system. See collect_class_statistics for
+    the number of pixels of each class.
+    '''
+    statistics = collect_class_statistics(root_path, start_tile_index, end_tile_index, 
+                                          print_msg=print_msg, manifest_path=manifest_path)
+    return statistics['image_counts'].astype(np.float64)
+
+def save_class_statistics(statistics, file_path):
     '''
-    num_mask_files = 0
-    corine2018_buckets = np.zeros(45)
-    tiles_paths = [pathlib.Path(x) for x in root_path.iterdir() if x.is_dir()]
-    if (print_msg):
-        print('Number of tiles: ', len(tiles_paths))
-    for tile_path in tiles_paths[start_tile_index:end_tile_index]:
-        if (print_msg):
-            print('Tile:', tile_path.name)
-        patches_paths = [pathlib.Path(x) for x in tile_path.iterdir() if x.is_dir()]
-        if (print_msg):
-            print('Number of patches per tile: ', len(patches_paths))
-        for patch_path in patches_paths:
-            if (print_msg):
-                print('Patch: ', patch_path.name)
-            for mask_path in patch_path.iterdir():
-                file_type = mask_path.name[-7:]
-                if (file_type == 'map.tif'):
-                    mask_png = rasterio.open(mask_path)
-                    mask_array = mask_png.read(1)
-                    unique_values = np.unique(mask_array)
-                    num_mask_files += 1
-                    if (print_msg):
-                        print('Unique values: ', unique_values)
-                    for u in unique_values:
-                        bucket = corine2018_class_bucket(u)
-                        bucket_value = corine2018_buckets[bucket - 1]
-                        corine2018_buckets[bucket - 1] = bucket_value + 1
-    return corine2018_buckets
+    Saves the dictionary returned by collect_class_statistics in a npz file.
+    '''
+    np.savez(file_path, **statistics)
+
+def read_class_statistics(file_path):
+    '''
+    Reads the statistics saved by save_class_statistics
+    and returns them in a dictionary.
+    '''
+    with np.load(file_path) as statistics:
+        return {key: statistics[key] for key in statistics.files}
 
 def save_statistics(bucket_array, file_path):
     '''
@@ -779,4 +3356,512 @@ def read_statistics(file_path):
             bucket_array[index] = line.strip()
             index += 1
         return bucket_array
+## ---------------------------------------------- 7) Dataset splits
+def pair_patch_files(image_paths, mask_paths):
+    '''
+    This function joins the image files and the mask files of the patches by 
+    their id, tile_patch_date (see read_patch_id), so that an image can only be 
+    paired with the mask of the same patch. The files can be TIFF bands, reference
+    maps or PNG files. Returns a dictionary that maps the id of each patch to the 
+    pair (image path, mask path), sorted by id, and the lists of the images and 
+    of the masks without a pair.
+    '''
+    images = {read_patch_id(pathlib.Path(image_path).name): image_path for image_path in image_paths}
+    masks = {read_patch_id(pathlib.Path(mask_path).name): mask_path for mask_path in mask_paths}
+    pairs = {patch_id: (images[patch_id], masks[patch_id]) for patch_id in sorted(images.keys() & masks.keys())}
+    unpaired_images = [images[patch_id] for patch_id in sorted(images.keys() - masks.keys())]
+    unpaired_masks = [masks[patch_id] for patch_id in sorted(masks.keys() - images.keys())]
+    return pairs, unpaired_images, unpaired_masks
+
+def split_sizes(num_items, fractions):
+    '''
+    Returns the number of items of each split, proportional to the fractions, 
+    whose sum is num_items. The items left by the rounding go to the splits 
+    with the largest remainders.
+    '''
+    fractions = np.asarray(fractions, dtype=np.float64) / np.sum(fractions)
+    exact_sizes = fractions * num_items
+    sizes = np.floor(exact_sizes).astype(np.int64)
+    remainders = np.argsort(-(exact_sizes - sizes), kind='stable')
+    sizes[remainders[:num_items - sizes.sum()]] += 1
+    return sizes
+
+def split_patches(patch_ids, fractions=None, seed=0, group_by_tile=False, class_index=None):
+    '''
+    This function splits the ids of the patches into subsets, by default train 
+    (70%), val (20%) and test (10%), in a random order given by the seed. The 
+    fractions are a dictionary with the name and the fraction of each split. 
+    With group_by_tile all the patches of a Sentinel-2 tile, e.g. R022_T33UUP, 
+    are in the same split, so that no area is in more than one split, and the 
+    tiles are assigned to the split that is farthest from its size. If a class 
+    presence index is passed (see ClassPresenceIndex) the split is stratified: 
+    the patches are sorted by the rarest class they contain and each one is 
+    assigned to the split that is farthest from its size, so that the patches 
+    of each class are split with the same fractions. Returns a dictionary with the ids of the 
+    patches of each split.
+    '''
+    if (fractions is None):
+        fractions = {'train': 0.7, 'val': 0.2, 'test': 0.1}
+    if (group_by_tile and class_index is not None):
+        raise ValueError('A split cannot be both grouped by tile and stratified')
+    split_names = list(fractions.keys())
+    patch_ids = np.asarray(sorted(patch_ids), dtype=str)
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(len(patch_ids))
+    split_indexes = np.zeros(len(patch_ids), dtype=np.int64)
+    if (group_by_tile):
+        tiles = np.array([patch_id[:11] for patch_id in patch_ids])
+        tile_names, tile_indexes, tile_sizes = np.unique(tiles, return_inverse=True, return_counts=True)
+        targets = split_sizes(len(patch_ids), list(fractions.values()))
+        sizes = np.zeros(len(split_names), dtype=np.int64)
+        tile_splits = np.zeros(len(tile_names), dtype=np.int64)
+        for tile_index in rng.permutation(len(tile_names)):
+            split_index = int(np.argmax(targets - sizes))
+            tile_splits[tile_index] = split_index
+            sizes[split_index] += tile_sizes[tile_index]
+        split_indexes = tile_splits[tile_indexes]
+    elif (class_index is not None):
+        positions = np.array([class_index.positions[patch_id] for patch_id in patch_ids], dtype=np.int64)
+        class_counts = class_index.class_counts()
+        rarity = np.where(class_counts > 0, class_counts, len(class_index) + 1)
+        presence = class_index.presence[positions]
+        strata = np.full(len(patch_ids), 45, dtype=np.int64)
+        for class_number in np.argsort(rarity, kind='stable')[::-1]:
+            present = (presence & (np.uint64(1) << np.uint64(class_number))) != 0
+            strata[present] = class_number
+        targets = np.asarray(list(fractions.values()), dtype=np.float64) / sum(fractions.values())
+        sizes = [0] * len(split_names)
+        for item_number, patch_index in enumerate(order[np.argsort(strata[order], kind='stable')]):
+            split_index = max(range(len(split_names)), key=lambda index: targets[index] * (item_number + 1) - sizes[index])
+            split_indexes[patch_index] = split_index
+            sizes[split_index] += 1
+    else:
+        bounds = np.cumsum(split_sizes(len(patch_ids), list(fractions.values())))[:-1]
+        for split_index, split_members in enumerate(np.split(order, bounds)):
+            split_indexes[split_members] = split_index
+    return {split_name: patch_ids[order[split_indexes[order] == split_index]]
+            for split_index, split_name in enumerate(split_names)}
+
+def save_split(splits, file_path):
+    '''
+    Saves the ids of the patches of each split in a CSV file with the columns 
+    split and patch_id. The files are not copied or moved.
+    '''
+    with atomic_target(file_path) as temp_path:
+        with open(temp_path, 'w') as f:
+            f.write('split,patch_id\n')
+            for split_name, patch_ids in splits.items():
+                f.writelines('{},{}\n'.format(split_name, patch_id) for patch_id in patch_ids)
+
+def read_split(file_path):
+    '''
+    Reads a split saved by save_split and returns a dictionary with the ids
+    of the patches of each split, in the order in which they were saved.
+    '''
+    splits = {}
+    with open(file_path, 'r') as f:
+        next(f)
+        for line in f:
+            split_name, patch_id = line.rstrip('\n').split(',')
+            splits.setdefault(split_name, []).append(patch_id)
+    return splits
+
+def split_file_paths(patch_ids, pairs):
+    '''
+    Returns the lists of the image paths and of the mask paths of the patches 
+    of a split, in the same order, from the pairs of pair_patch_files.
+    '''
+    missing = [patch_id for patch_id in patch_ids if patch_id not in pairs]
+    if (len(missing) > 0):
+        raise KeyError('{:d} patches of the split have no image and mask, e.g. {}'.format(len(missing), missing[0]))
+    return [pairs[patch_id][0] for patch_id in patch_ids], [pairs[patch_id][1] for patch_id in patch_ids]
+
+## ---------------------------------------------- 8) Inference
+def create_prediction_file_name(tile, patch, date, level):
+    return tile + '_' + patch + '_' + date + '_' + level + '_pred.tif'
+
+def _load_inference_patch(patch, input_buffer, clip_values=None):
+    '''
+    Reads the RGB bands of a patch, normalized as in createPNG, resizes them 
+    to the size of the input buffer and copies them into the buffer. Returns 
+    the georeference of the patch and the time spent reading and resizing.
+    '''
+    from PIL import Image
+    start = time.perf_counter()
+    image = np.dstack(read_normalized_bands(patch, clip_values)).astype(np.uint8)
+    georeference = read_georeference(patch[0])
+    read_seconds = time.perf_counter() - start
+    height, width = input_buffer.shape[:2]
+    if (image.shape[:2] != (height, width)):
+        image = np.asarray(Image.fromarray(image).resize((width, height), Image.BILINEAR))
+    input_buffer[...] = image
+    return georeference, read_seconds, time.perf_counter() - start - read_seconds
+
+def _write_prediction(target_path, classes, georeference, level):
+    '''
+    Writes the predicted classes of a patch in a one band uint8 GeoTIFF file
+    with the crs and the transform of the patch, resized to the size of the 
+    patch if the model uses a different size. Returns the time spent writing.
+    '''
+    from PIL import Image
+    start = time.perf_counter()
+    if (classes.shape != (georeference['height'], georeference['width'])):
+        classes = np.asarray(Image.fromarray(classes).resize((georeference['width'], georeference['height']), 
+                                                             Image.NEAREST))
+    with atomic_target(target_path) as temp_path:
+        with rasterio.open(temp_path,
+                           mode='w',
+                           driver='GTiff',
+                           height=classes.shape[0],
+                           width=classes.shape[1],
+                           count=1,
+                           dtype=np.uint8,
+                           crs=georeference['crs'],
+                           transform=georeference['transform']) as target_dataset:
+            target_dataset.write(classes, 1)
+            target_dataset.update_tags(level=level)
+    return time.perf_counter() - start
+
+def predict_tiles(model, root_path, start_tile_index, end_tile_index, target_dir, level='l1', batch_size=32, 
+                  image_size=(128, 128), num_threads=8, dtype=np.float32, label_offset=1, clip_values=None, 
+                  manifest_path=None, tile_names=None, metrics=None):
+    '''
+    This function predicts the Corine2018 classes of the pixels of the patches 
+    of the tiles from start_tile_index to end_tile_index, or of the tiles in 
+    tile_names (see list_image_files), and writes them in GeoTIFF files with the 
+    crs and the transform of the patches, one per patch, in the target folder 
+    (see create_prediction_file_name). The model is any callable that takes a 
+    batch of images with shape (batch_size, height, width, 3) and values in 
+    [0, 255], the RGB bands normalized as in createPNG and resized to image_size, 
+    and returns the probabilities of the classes with shape (batch_size, height, 
+    width, classes) or the classes with shape (batch_size, height, width), e.g. 
+    a Keras model, whose predict_on_batch method is used, or a NumPy function. 
+    The label_offset is added to the predicted class indexes, e.g. 1 for the 
+    models trained with the classes starting from 0, and the masks are resized 
+    to the size of the patches. A pool of num_threads threads reads the patches 
+    of the next batch and writes the masks of the previous one while the model 
+    runs. The number of patches per second and the time spent reading, resizing, 
+    predicting and writing are collected in a StageMetrics object. Returns the 
+    list of the paths of the GeoTIFF files.
+    '''
+    tiles_list = list_image_files(pathlib.Path(root_path), start_tile_index, end_tile_index, 
+                                  manifest_path=manifest_path, tile_names=tile_names)
+    patches = [patch for patches_list in tiles_list for patch in patches_list]
+    batches = [patches[start:start + batch_size] for start in range(0, len(patches), batch_size)]
+    os.makedirs(target_dir, exist_ok=True)
+    predict = getattr(model, 'predict_on_batch', model)
+    own_metrics = metrics is None
+    if (own_metrics):
+        metrics = StageMetrics('Inference', len(patches))
+    inputs = np.zeros((2, batch_size) + tuple(image_size) + (3,), dtype=dtype)
+    target_paths = []
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        def submit_loads(batch_number):
+            return [executor.submit(_load_inference_patch, patch, inputs[batch_number % 2, batch_index], clip_values)
+                    for batch_index, patch in enumerate(batches[batch_number])]
+        def wait_writes(writes):
+            for tile, write in writes:
+                write_seconds = write.result()
+                metrics.add({'write_seconds': write_seconds, 'task_seconds': write_seconds}, tile)
+        loads = submit_loads(0) if len(batches) > 0 else []
+        writes = []
+        for batch_number, batch_patches in enumerate(batches):
+            loaded = [load.result() for load in loads]
+            if (batch_number + 1 < len(batches)):
+                loads = submit_loads(batch_number + 1)
+            start = time.perf_counter()
+            predictions = np.asarray(predict(inputs[batch_number % 2, :len(batch_patches)]))
+            if (predictions.ndim == 4):
+                predictions = np.argmax(predictions, axis=-1)
+            classes = (predictions + label_offset).astype(np.uint8)
+            predict_seconds = time.perf_counter() - start
+            wait_writes(writes)
+            writes = []
+            for batch_index, patch in enumerate(batch_patches):
+                tile, patch_name, band, date = read_band_name(pathlib.Path(patch[0]).name)
+                target_path = os.path.join(target_dir, create_prediction_file_name(tile, patch_name, date, level))
+                georeference, read_seconds, transform_seconds = loaded[batch_index]
+                writes.append((tile, executor.submit(_write_prediction, target_path, classes[batch_index], 
+                                                     georeference, level)))
+                target_paths.append(target_path)
+                patch_predict_seconds = predict_seconds / len(batch_patches)
+                metrics.add({'patches': 1, 'read_seconds': read_seconds, 'transform_seconds': transform_seconds,
+                             'predict_seconds': patch_predict_seconds, 
+                             'task_seconds': read_seconds + transform_seconds + patch_predict_seconds}, tile)
+        wait_writes(writes)
+    if (own_metrics):
+        metrics.stop()
+    return target_paths
+
+## ---------------------------------------------- 9) Evaluation
+class ConfusionMatrix:
+    '''
+    This class accumulates the confusion matrix of the classes of the pixels 
+    of a stream of batches of true and predicted masks, e.g. 6x6 for the 
+    Corine2018 level 1 or 45x45 for the level 3. The masks contain the class 
+    indexes from first_class to first_class + num_classes - 1, e.g. from 1 to 6 
+    as the masks created by mapCorineL1 and the predictions of predict_tiles, 
+    and the pixels with other values in the true or the predicted masks, e.g. 0, 
+    are ignored. The rows of the matrix are the true classes and the columns the
+    predicted ones. The matrix of a batch is computed with one np.bincount over 
+    the pixels. The matrices computed by different workers, e.g. for different 
+    tiles, are combined by adding them. The per-class IoU, precision and recall, 
+    the mean IoU and the pixel accuracy are computed from the matrix.
+    '''
+    def __init__(self, num_classes, first_class=1, matrix=None):
+        self.num_classes = num_classes
+        self.first_class = first_class
+        self.matrix = np.zeros((num_classes, num_classes), dtype=np.int64) if matrix is None else matrix
+
+    def update(self, true_masks, predicted_masks):
+        '''
+        Adds the pixels of a mask, or of a batch of masks, and of the predicted
+        mask, or masks, with the same shape to the matrix.
+        '''
+        true_classes = np.asarray(true_masks, dtype=np.int64).ravel() - self.first_class
+        predicted_classes = np.asarray(predicted_masks, dtype=np.int64).ravel() - self.first_class
+        if (true_classes.shape != predicted_classes.shape):
+            raise ValueError('The true and the predicted masks must have the same shape')
+        valid = ((true_classes >= 0) & (true_classes < self.num_classes) & 
+                 (predicted_classes >= 0) & (predicted_classes < self.num_classes))
+        pixel_indexes = true_classes[valid] * self.num_classes + predicted_classes[valid]
+        self.matrix += np.bincount(pixel_indexes, minlength=self.num_classes ** 2).reshape(self.matrix.shape)
+        return self
+
+    def __add__(self, other):
+        if (other.num_classes != self.num_classes or other.first_class != self.first_class):
+            raise ValueError('The confusion matrices have different classes')
+        return ConfusionMatrix(self.num_classes, self.first_class, self.matrix + other.matrix)
+
+    def __radd__(self, other):
+        if (other == 0):
+            return self
+        return self.__add__(other)
+
+    def true_pixels(self):
+        return self.matrix.sum(axis=1)
+
+    def predicted_pixels(self):
+        return self.matrix.sum(axis=0)
+
+    def iou(self):
+        '''
+        Returns the intersection over union of each class. The classes without
+        true and predicted pixels have IoU nan.
+        '''
+        intersection = np.diag(self.matrix).astype(np.float64)
+        union = self.true_pixels() + self.predicted_pixels() - intersection
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return intersection / union
+
+    def mean_iou(self):
+        '''
+        Returns the mean of the IoU of the classes with true or predicted pixels.
+        '''
+        iou = self.iou()
+        return float(np.nanmean(iou)) if not np.isnan(iou).all() else float('nan')
+
+    def precision(self):
+        '''
+        Returns the precision of each class, nan for the classes never predicted.
+        '''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.diag(self.matrix) / self.predicted_pixels()
+
+    def recall(self):
+        '''
+        Returns the recall of each class, nan for the classes without true pixels.
+        '''
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.diag(self.matrix) / self.true_pixels()
+
+    def pixel_accuracy(self):
+        total_pixels = self.matrix.sum()
+        return float(np.trace(self.matrix) / total_pixels) if total_pixels > 0 else float('nan')
+
+    def report(self, labels=None):
+        '''
+        Returns a dictionary with the pixel accuracy, the mean IoU and the IoU, 
+        precision, recall and number of true pixels of each class, by label if 
+        the list of the labels of the classes is passed, that can be saved in 
+        JSON format.
+        '''
+        if (labels is None):
+            labels = [str(class_index) for class_index in range(self.first_class, self.first_class + self.num_classes)]
+        iou, precision, recall, true_pixels = self.iou(), self.precision(), self.recall(), self.true_pixels()
+        to_float = lambda value: None if np.isnan(value) else float(value)
+        return {'pixel_accuracy': self.pixel_accuracy(),
+                'mean_iou': self.mean_iou(),
+                'classes': {label: {'iou': to_float(iou[class_index]), 
+                                    'precision': to_float(precision[class_index]),
+                                    'recall': to_float(recall[class_index]), 
+                                    'true_pixels': int(true_pixels[class_index])}
+                            for class_index, label in enumerate(labels)}}
+
+def save_confusion_matrix(confusion_matrix, file_path):
+    '''
+    Saves a confusion matrix in a npz file.
+    '''
+    np.savez(file_path, matrix=confusion_matrix.matrix, first_class=confusion_matrix.first_class)
+
+def read_confusion_matrix(file_path):
+    '''
+    Reads a confusion matrix saved by save_confusion_matrix.
+    '''
+    with np.load(file_path) as data:
+        matrix = data['matrix']
+        return ConfusionMatrix(matrix.shape[0], int(data['first_class']), matrix)
+
+def _confusion_matrix_task(pairs, level):
+    '''
+    Worker task of evaluate_predictions. Returns the confusion matrix of 
+    a list of pairs of reference maps and predicted masks.
+    '''
+    confusion_matrix = ConfusionMatrix(CORINE2018_NUM_CLASSES[level])
+    for reference_path, prediction_path in pairs:
+        confusion_matrix.update(corine_remap(read_mask(reference_path), level), read_mask(prediction_path))
+    return confusion_matrix
+
+def evaluate_predictions(reference_paths, prediction_paths, level='l1', num_workers=1, chunk_size=256):
+    '''
+    This function computes the confusion matrix of the predicted masks, e.g. 
+    created by predict_tiles, and of the reference maps of the same patches, 
+    with the Corine2018 Level 3 codes mapped to the level (see corine_remap).
+    The files are paired by patch id and the patches without a prediction or 
+    a reference map are not evaluated. The pairs are split in chunks of 
+    chunk_size patches processed by a pool of num_workers processes and the 
+    confusion matrices of the chunks are added. Returns the confusion matrix 
+    and the number of patches evaluated.
+    '''
+    pairs, unpaired_references, unpaired_predictions = pair_patch_files(reference_paths, prediction_paths)
+    pairs = list(pairs.values())
+    chunks = [pairs[start:start + chunk_size] for start in range(0, len(pairs), chunk_size)]
+    task = functools.partial(_confusion_matrix_task, level=level)
+    if (num_workers > 1):
+        with multiprocessing.Pool(processes=num_workers) as pool:
+            matrices = pool.map(task, chunks)
+    else:
+        matrices = map(task, chunks)
+    return sum(matrices, ConfusionMatrix(CORINE2018_NUM_CLASSES[level])), len(pairs)
+
+## ---------------------------------------------- 10) Mosaics
+def _read_mosaic_patch(patch, level=None, clip_values=None):
+    '''
+    Reads a patch of a mosaic and returns its array with shape (bands, height, 
+    width) and its georeference. A patch is a list of TIFF band files, whose 
+    bands are normalized to uint8 as in createPNG, or a raster file, e.g. a 
+    reference map or a predicted mask. If a level is passed the Corine2018 
+    codes of the reference maps are mapped to the classes of the level.
+    '''
+    if (isinstance(patch, (list, tuple))):
+        array = np.stack(read_normalized_bands(patch, clip_values)).astype(np.uint8)
+        return array, read_georeference(patch[0])
+    with rasterio.open(patch) as dataset:
+        array = dataset.read()
+        georeference = {'crs': dataset.crs, 'transform': dataset.transform, 
+                        'width': dataset.width, 'height': dataset.height}
+    if (level is not None and str(patch).endswith('_reference_map.tif')):
+        array = corine_remap(array, level)
+    return array, georeference
+
+def mosaic_grid(georeferences):
+    '''
+    Returns the transform, the width and the height of the grid that covers 
+    the patches with the georeferences, e.g. the patches of a tile. The patches
+    must have the same crs and resolution and no rotation.
+    '''
+    first = georeferences[0]
+    resolution_x, resolution_y = first['transform'].a, first['transform'].e
+    for georeference in georeferences:
+        transform = georeference['transform']
+        if (georeference['crs'] != first['crs'] or transform.a != resolution_x or transform.e != resolution_y or
+            transform.b != 0 or transform.d != 0):
+            raise ValueError('The patches of a mosaic must have the same crs and resolution')
+    left = min(georeference['transform'].c for georeference in georeferences)
+    top = max(georeference['transform'].f for georeference in georeferences)
+    right = max(georeference['transform'].c + georeference['width'] * resolution_x for georeference in georeferences)
+    bottom = min(georeference['transform'].f + georeference['height'] * resolution_y for georeference in georeferences)
+    width = int(round((right - left) / resolution_x))
+    height = int(round((bottom - top) / resolution_y))
+    return rasterio.Affine(resolution_x, 0.0, left, 0.0, resolution_y, top), width, height
+
+def build_mosaic(patches, target_path, level=None, clip_values=None, num_threads=8, block_size=512, 
+                 compress='DEFLATE', print_msg=False):
+    '''
+    This function assembles the patches of a tile, e.g. the lists of the RGB 
+    band files of list_image_files, the reference maps of list_mask_files or 
+    the masks predicted by predict_tiles, into one Cloud Optimized GeoTIFF 
+    that a GIS viewer can pan and zoom without opening the files of the patches. 
+    The position of each patch in the mosaic is computed from its transform 
+    (see mosaic_grid) and the patch is written in its window of a tiled GeoTIFF 
+    while the next patches are read by a pool of num_threads threads, so 
+    at most 2 * num_threads patches are in memory. The GeoTIFF is then copied 
+    with the COG driver of GDAL into blocks of block_size pixels, compressed, 
+    with internal overviews computed with the average of the pixels for the RGB 
+    images and the nearest pixel for the masks. The pixels without a patch are 
+    set to 0, that is the nodata value of the masks, while in the RGB images 0 
+    is also a valid value. If a level, 'l1' or 'l3', is passed, the reference 
+    maps are mapped to the classes of the level (see corine_remap) and the colors 
+    of the classes (see corine_color_lut) are saved in the color table. The other
+    levels have no colors and raise a ValueError. The file is written atomically 
+    (see atomic_target).
+    '''
+    from rasterio.shutil import copy as raster_copy
+    from rasterio.windows import Window
+    if (level not in (None, 'l1', 'l3')):
+        raise ValueError('The mosaics can only be mapped to the levels l1 and l3: {}'.format(level))
+    georeferences = [read_georeference(patch[0] if isinstance(patch, (list, tuple)) else patch) for patch in patches]
+    transform, width, height = mosaic_grid(georeferences)
+    first_array, first_georeference = _read_mosaic_patch(patches[0], level, clip_values)
+    is_mask = not isinstance(patches[0], (list, tuple))
+    if (print_msg):
+        print('Mosaic of {:d} patches: {:d} x {:d} pixels, {:d} bands'.format(len(patches), width, height, 
+                                                                             first_array.shape[0]))
+    temp_dir = os.path.dirname(os.path.abspath(target_path))
+    temp_path = os.path.join(temp_dir, '.{}.{:d}.mosaic.tif'.format(os.path.basename(target_path), os.getpid()))
+    try:
+        with rasterio.open(temp_path,
+                           mode='w',
+                           driver='GTiff',
+                           height=height,
+                           width=width,
+                           count=first_array.shape[0],
+                           dtype=first_array.dtype,
+                           crs=first_georeference['crs'],
+                           transform=transform,
+                           nodata=0 if is_mask else None,
+                           tiled=True,
+                           blockxsize=block_size,
+                           blockysize=block_size,
+                           BIGTIFF='IF_SAFER') as mosaic:
+            def write_patch(future):
+                array, georeference = future.result()
+                patch_transform = georeference['transform']
+                col_off = int(round((patch_transform.c - transform.c) / transform.a))
+                row_off = int(round((patch_transform.f - transform.f) / transform.e))
+                window = Window(col_off, row_off, array.shape[2], array.shape[1])
+                mosaic.write(array.astype(first_array.dtype, copy=False), window=window)
+
+            read_patch = functools.partial(_read_mosaic_patch, level=level, clip_values=clip_values)
+            reads = collections.deque()
+            with ThreadPoolExecutor(max_workers=num_threads) as executor:
+                for patch in patches:
+                    if (len(reads) == 2 * num_threads):
+                        write_patch(reads.popleft())
+                    reads.append(executor.submit(read_patch, patch))
+                while (len(reads) > 0):
+                    write_patch(reads.popleft())
+            if (level is not None and first_array.dtype == np.uint8 and first_array.shape[0] == 1):
+                color_lut = corine_color_lut(level)
+                num_classes = len(corine_l1_color_map()) if level == 'l1' else len(corine_l3_color_map())
+                mosaic.write_colormap(1, {value: tuple(int(channel) for channel in color_lut[value]) + (255,)
+                                          for value in range(1, num_classes + 1)})
+        with atomic_target(target_path) as temp_target_path:
+            raster_copy(temp_path, temp_target_path, driver='COG', compress=compress, blocksize=block_size,
+                        overview_resampling='nearest' if is_mask else 'average', BIGTIFF='IF_SAFER')
+    finally:
+        if (os.path.exists(temp_path)):
+            os.remove(temp_path)
+    return width, height
+
 ## ---------------------------------------------- End of functions definition -----------------------------------------------
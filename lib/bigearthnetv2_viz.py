@@ -0,0 +1,29 @@
+import os
+import sys
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bigearthnetv2_lib import *
+from osgeo import gdal, osr, ogr
+from rasterio.plot import show_hist
+from rasterio.plot import show
+import PIL
+from PIL import Image, ImageDraw
+from skimage import io
+from skimage import exposure
+from skimage.io import imread
+import tifffile as tiff
+import matplotlib
+import matplotlib.pyplot as plt
+import matplotlib.colors as mcol
+from matplotlib import cm, ticker
+from matplotlib.colors import ListedColormap, LinearSegmentedColormap
+
+'''
+This script imports the functions of the bigearthnetv2_lib.py python script
+together with the packages used in the notebooks to visualize and analyze the
+images and the masks: GDAL, rasterio.plot, PIL, scikit-image, tifffile and
+matplotlib. The library only imports the packages used to read and write the
+rasters so that the scripts and the worker processes start quickly. In a
+notebook the script can be run with the command
+
+%run -i lib/bigearthnetv2_viz.py
+'''
@@ -1,4 +1,5 @@
 from lib.bigearthnetv2_lib import *
+import sys
 '''
 This script can be used to  create new mask PNG files in a target folder 
 from source mask PNG files in the source folder to map the Corine2018 
@@ -18,7 +19,10 @@ print('Source folder: ', SOURCE_DIR)
 print('Target folder: ', TARGET_DIR)
 print('Zip folder: ', ZIP_DIR)
 
-l1_masks = mapCorineL1_list(SOURCE_DIR, TARGET_DIR)
+## The masks already created are recorded in a journal in the zip 
+## folder so that a run that is interrupted can be resumed
+journal_path = ZIP_DIR + 'l1_masks_journal.jsonl'
+l1_masks = mapCorineL1_list(SOURCE_DIR, TARGET_DIR, journal_path)
 num_target_masks = len(l1_masks)
 
 print('Printing the unique values of the first 10 new masks:')
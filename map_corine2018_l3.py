@@ -1,4 +1,5 @@
 from lib.bigearthnetv2_lib import *
+import sys
 '''
 This script can be used to  create new mask PNG files in a target folder 
 from source mask PNG files in the source folder to map the Corine2018 
@@ -17,7 +18,11 @@ TARGET_DIR = sys.argv[2]
 print('Source folder: ', SOURCE_DIR)
 print('Target folder: ', TARGET_DIR)
 
-nc_masks = mapCorineL3_list(SOURCE_DIR, TARGET_DIR)
+## The masks already created are recorded in a journal next to the
+## target folder so that a run that is interrupted can be resumed
+parent_folder = str(pathlib.Path(TARGET_DIR).parent)
+journal_path = parent_folder + '/' + 'l3_masks_journal.jsonl'
+nc_masks = mapCorineL3_list(SOURCE_DIR, TARGET_DIR, journal_path)
 num_target_masks = len(nc_masks)
 
 print('Printing the unique values of the first 10 new masks:')
@@ -27,7 +32,6 @@ for mask in nc_masks[:10]:
     
 print('New {:d} mask files created in {}'.format(num_target_masks, TARGET_DIR))
 
-parent_folder = str(pathlib.Path(TARGET_DIR).parent)
 zip_file_name = parent_folder + '/' + 'l3_masks.zip'
 print('Zip file: ', zip_file_name)
  
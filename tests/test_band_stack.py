@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.crs import CRS
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the stacks of the bands resampled to the 10 m. grid (see resample_band and createBandStacks).
+'''
+
+TILE = 'S2A_MSIL2A_20170613T101031_N9999_R022_T33UUP'
+BANDS = ['B04', 'B05', 'B01']
+
+def bilinear_loop(band_array, factor):
+    '''
+    Upsamples a band computing each pixel from the 4 source pixels around 
+    its center, with the coordinates clamped to the borders.
+    '''
+    height, width = band_array.shape
+    target = np.empty((height * factor, width * factor))
+    for row in range(height * factor):
+        y = min(max((row + 0.5) / factor - 0.5, 0), height - 1)
+        y0 = int(y)
+        y1 = min(y0 + 1, height - 1)
+        for col in range(width * factor):
+            x = min(max((col + 0.5) / factor - 0.5, 0), width - 1)
+            x0 = int(x)
+            x1 = min(x0 + 1, width - 1)
+            top = band_array[y0, x0] * (1 - (x - x0)) + band_array[y0, x1] * (x - x0)
+            bottom = band_array[y1, x0] * (1 - (x - x0)) + band_array[y1, x1] * (x - x0)
+            target[row, col] = top * (1 - (y - y0)) + bottom * (y - y0)
+    return target
+
+@pytest.mark.parametrize('factor', [2, 6])
+def test_resampling_is_equal_to_the_loops(factor):
+    band_array = np.random.default_rng(factor).integers(0, 10000, (5, 4)).astype(np.uint16)
+    nearest = bigearthnet.resample_band(band_array, factor)
+    assert nearest.dtype == np.uint16
+    assert np.array_equal(nearest, np.kron(band_array, np.ones((factor, factor), dtype=np.uint16)))
+    bilinear = bigearthnet.resample_band(band_array, factor, 'bilinear')
+    assert bilinear.dtype == np.float32
+    assert np.allclose(bilinear, bilinear_loop(band_array, factor), rtol=1e-5, atol=1e-2)
+    assert np.array_equal(bigearthnet.resample_band(np.stack([band_array, band_array]), factor)[1], nearest)
+
+def test_band_stacks_are_written_on_the_10m_grid(tmp_path):
+    rng = np.random.default_rng(0)
+    patch_name = TILE + '_00_00'
+    patch_dir = tmp_path / TILE / patch_name
+    patch_dir.mkdir(parents=True)
+    bands = {}
+    for band, size in [('B01', 20), ('B04', 120), ('B05', 60)]:
+        bands[band] = rng.integers(0, 10000, (size, size)).astype(np.uint16)
+        resolution = 1200 // size
+        with rasterio.open(patch_dir / '{}_{}.tif'.format(patch_name, band), 'w', driver='GTiff', height=size,
+                           width=size, count=1, dtype='uint16', crs=CRS.from_epsg(32633),
+                           transform=rasterio.Affine(resolution, 0, 500000, 0, -resolution, 5000000)) as dataset:
+            dataset.write(bands[band], 1)
+    ## a patch without the 20 m. and 60 m. bands
+    other_patch_dir = tmp_path / TILE / (TILE + '_01_00')
+    other_patch_dir.mkdir()
+    (other_patch_dir / (TILE + '_01_00_B04.tif')).write_bytes((patch_dir / (patch_name + '_B04.tif')).read_bytes())
+    tiles_list = bigearthnet.list_image_files(tmp_path, 0, None, bands=BANDS)
+    target_dir = tmp_path / 'stacks'
+    target_dir.mkdir()
+    failed_patches = []
+    stack_files = bigearthnet.createBandStacks(tiles_list, BANDS, target_dir=str(target_dir), 
+                                               failed_patches=failed_patches)
+    assert len(stack_files) == 1
+    assert len(failed_patches) == 1
+    with rasterio.open(stack_files[0]) as dataset:
+        stack = dataset.read()
+        assert dataset.descriptions == tuple(BANDS)
+        assert dataset.transform == rasterio.Affine(10, 0, 500000, 0, -10, 5000000)
+    assert stack.shape == (3, 120, 120)
+    assert np.array_equal(stack[0], bands['B04'])
+    assert np.array_equal(stack[1], bigearthnet.resample_band(bands['B05'], 2))
+    assert np.array_equal(stack[2], bigearthnet.resample_band(bands['B01'], 6))
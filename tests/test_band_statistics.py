@@ -0,0 +1,72 @@
+import math
+
+import numpy as np
+import pytest
+import rasterio
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the histograms of the bands and of the quantization to uint8 
+(see collect_band_histograms, band_clip_values and quantize).
+'''
+
+TILES = ['S2A_MSIL2A_20170613T101031_N9999_R022_T33UUP', 'S2B_MSIL2A_20170615T102019_N9999_R065_T32UQC']
+
+@pytest.fixture
+def tiles_list(tmp_path):
+    rng = np.random.default_rng(0)
+    for tile in TILES:
+        for patch_index in range(3):
+            patch_name = '{}_{:02d}_00'.format(tile, patch_index)
+            patch_dir = tmp_path / tile / patch_name
+            patch_dir.mkdir(parents=True)
+            for band, scale in [('B02', 1500), ('B03', 3000), ('B04', 9000)]:
+                band_array = rng.gamma(2.0, scale / 2.0, (120, 120)).clip(0, 65535).astype(np.uint16)
+                with rasterio.open(patch_dir / '{}_{}.tif'.format(patch_name, band), 'w', driver='GTiff', 
+                                   height=120, width=120, count=1, dtype='uint16') as dataset:
+                    dataset.write(band_array, 1)
+    return bigearthnet.list_image_files(tmp_path, 0, None)
+
+def read_band_values(tiles_list, band):
+    values = []
+    for patches_list in tiles_list:
+        for bands_list in patches_list:
+            for band_path in bands_list:
+                if (band_path.name.endswith(band + '.tif')):
+                    with rasterio.open(band_path) as dataset:
+                        values.append(dataset.read(1).ravel())
+    return np.sort(np.concatenate(values))
+
+@pytest.mark.parametrize('num_workers', [1, 2])
+def test_histograms_of_tile_ranges_are_merged(tmp_path, tiles_list, num_workers):
+    histograms = bigearthnet.collect_band_histograms(tiles_list, num_workers=num_workers)
+    assert sorted(histograms) == ['B02', 'B03', 'B04']
+    merged = bigearthnet.merge_band_histograms([bigearthnet.collect_band_histograms(tiles_list[:1]),
+                                                bigearthnet.collect_band_histograms(tiles_list[1:])])
+    histograms_path = str(tmp_path / 'histograms.npz')
+    bigearthnet.save_band_histograms(merged, histograms_path)
+    merged = bigearthnet.read_band_histograms(histograms_path)
+    for band in histograms:
+        values = read_band_values(tiles_list, band)
+        assert np.array_equal(histograms[band], np.bincount(values, minlength=65536))
+        assert np.array_equal(merged[band], histograms[band])
+
+def test_clip_values_are_the_percentiles(tiles_list):
+    clip_values = bigearthnet.band_clip_values(bigearthnet.collect_band_histograms(tiles_list), 2.0, 98.0)
+    for band, (low, high) in clip_values.items():
+        values = read_band_values(tiles_list, band)
+        assert low == values[math.ceil(len(values) * 0.02) - 1]
+        assert high == values[math.ceil(len(values) * 0.98) - 1]
+
+def test_quantize_stretches_and_clips_the_values():
+    rng = np.random.default_rng(0)
+    band_array = rng.integers(0, 65536, (120, 120)).astype(np.uint16)
+    band_array[0, :4] = [0, 1000, 5000, 65535]
+    expected = np.rint(np.clip((band_array.astype(np.float64) - 1000) * 255 / 4000, 0, 255))
+    out = np.empty(band_array.shape, dtype=np.uint8)
+    quantized = bigearthnet.quantize(band_array, 1000, 5000, out=out)
+    assert quantized is out
+    assert np.abs(quantized.astype(np.int16) - expected).max() <= 1
+    assert np.array_equal(quantized[0, :4], [0, 0, 255, 255])
+    assert np.array_equal(bigearthnet.quantize(band_array, 1000, 5000), quantized)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the batches of images and masks of BatchLoader.
+'''
+
+NUM_PATCHES = 10
+
+@pytest.fixture
+def patch_files(tmp_path):
+    rng = np.random.default_rng(0)
+    image_paths = []
+    mask_paths = []
+    for patch_index in range(NUM_PATCHES):
+        file_name = bigearthnet.create_png_file_name('R000_T33UAA', '{:02d}_00'.format(patch_index), '20170613')
+        image_path = str(tmp_path / file_name)
+        mask_path = str(tmp_path / (file_name[:-4] + '_mask.png'))
+        bands = [rng.integers(0, 256, (120, 120)).astype(np.uint8) for band in range(3)]
+        bands[0][0, 0] = 255
+        bigearthnet.write_png(image_path, bands, 'uint8')
+        bigearthnet.write_png(mask_path, [rng.integers(1, 7, (120, 120)).astype(np.uint8)], 'uint8')
+        image_paths.append(image_path)
+        mask_paths.append(mask_path)
+    return image_paths, mask_paths
+
+def test_float16_images_keep_the_values_in_0_255(patch_files):
+    '''
+    The float16 images have the same values of the uint8 images, in [0, 255],
+    as the images of the TF datasets of the notebooks, that are not rescaled.
+    '''
+    image_paths, mask_paths = patch_files
+    uint8_loader = bigearthnet.BatchLoader(image_paths, mask_paths, batch_size=4, label_offset=1)
+    float16_loader = bigearthnet.BatchLoader(image_paths, mask_paths, batch_size=4, dtype=np.float16, label_offset=1)
+    for (uint8_images, uint8_masks), (float16_images, float16_masks) in zip(uint8_loader, float16_loader):
+        assert float16_images.dtype == np.float16
+        assert float16_images.min() >= 0
+        assert float16_images.max() == 255
+        assert np.array_equal(float16_images, uint8_images.astype(np.float16))
+        assert np.array_equal(float16_masks, uint8_masks)
+        assert uint8_masks.min() >= 0 and uint8_masks.max() <= 5
+
+def test_augmented_batches_transform_images_and_masks_together(patch_files):
+    image_paths, mask_paths = patch_files
+    loader = bigearthnet.BatchLoader(image_paths, mask_paths, batch_size=4, augment=True, seed=1)
+    transforms = loader.epoch_transforms(0)
+    position = 0
+    for images, masks in loader:
+        for image, mask in zip(images, masks):
+            expected_image = bigearthnet.dihedral_transform(bigearthnet.read_png(image_paths[position]),
+                                                            transforms[position])
+            expected_mask = bigearthnet.dihedral_transform(bigearthnet.read_mask(mask_paths[position]),
+                                                           transforms[position])
+            assert np.array_equal(image, expected_image)
+            assert np.array_equal(mask, expected_mask)
+            position += 1
+    assert position == NUM_PATCHES
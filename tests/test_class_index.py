@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the class presence index and of the balanced subsets (see ClassPresenceIndex and sample_class_subset).
+'''
+
+CODES = bigearthnet.CORINE2018_L3_CODES
+NUM_PATCHES = 400
+
+@pytest.fixture
+def pixel_counts():
+    '''
+    Pixel counts of patches with the common classes 211 and 311, the rare 
+    class 213, in 10 patches, and the unclassified code 999.
+    '''
+    rng = np.random.default_rng(0)
+    pixel_counts = np.zeros((NUM_PATCHES, 45), dtype=np.int64)
+    for code, probability in [(211, 0.8), (311, 0.6), (999, 0.3)]:
+        pixel_counts[:, CODES.index(code)] = (rng.random(NUM_PATCHES) < probability) * rng.integers(1, 14400, NUM_PATCHES)
+    pixel_counts[rng.choice(NUM_PATCHES, 10, replace=False), CODES.index(213)] = 50
+    return pixel_counts
+
+def test_index_is_built_from_the_partials(tmp_path, pixel_counts):
+    patch_ids = np.array(['R022_T33UUP_{:02d}_{:02d}_20170613'.format(*divmod(position, 100)) 
+                          for position in range(NUM_PATCHES)])
+    partial_paths = []
+    for tile_index in range(2):
+        partial_paths.append(str(tmp_path / 'tile_{:d}.npz'.format(tile_index)))
+        tile_positions = slice(tile_index * 200, (tile_index + 1) * 200)
+        bigearthnet.save_tile_statistics(partial_paths[-1], patch_ids[tile_positions], pixel_counts[tile_positions])
+    index = bigearthnet.build_class_index(partial_paths)
+    index_path = str(tmp_path / 'class_index.npz')
+    bigearthnet.save_class_index(index, index_path)
+    index = bigearthnet.read_class_index(index_path)
+    assert len(index) == NUM_PATCHES
+    fractions = pixel_counts / np.maximum(pixel_counts.sum(axis=1, keepdims=True), 1)
+    present = pixel_counts > 0
+    rice, forest = CODES.index(213), CODES.index(311)
+    assert np.array_equal(index.select(213), np.flatnonzero(present[:, rice]))
+    assert np.array_equal(index.select([213, 311]), np.flatnonzero(present[:, rice] | present[:, forest]))
+    assert np.array_equal(index.select([213, 311], match='all'), np.flatnonzero(present[:, rice] & present[:, forest]))
+    assert np.array_equal(index.select(311, min_fraction=0.5), np.flatnonzero(fractions[:, forest] >= 0.5))
+    assert list(index.patches_with(213)) == list(patch_ids[present[:, rice]])
+    assert index.classes_of(patch_ids[0]) == [code for code, count in zip(CODES, pixel_counts[0]) if count > 0]
+    assert np.array_equal(index.class_counts(), np.count_nonzero(pixel_counts, axis=0))
+    with pytest.raises(ValueError):
+        index.select(211, match='most')
+
+def test_subset_takes_all_the_patches_of_the_rare_classes(pixel_counts):
+    index = bigearthnet.ClassPresenceIndex(np.arange(NUM_PATCHES).astype(str), 
+                                           bigearthnet.class_presence_bits(pixel_counts), 
+                                           np.zeros(pixel_counts.shape, dtype=np.float16))
+    positions = bigearthnet.sample_class_subset(index, 60, seed=1)
+    assert len(positions) == len(np.unique(positions)) == 60
+    assert np.array_equal(positions, bigearthnet.sample_class_subset(index, 60, seed=1))
+    assert set(index.select(213)) <= set(positions)
+    counts = index.class_counts(positions)
+    assert counts[CODES.index(211)] >= 20 and counts[CODES.index(311)] >= 20
+
+    positions = bigearthnet.sample_class_subset(index, 30, quotas={213: 5, 311: 25}, seed=1)
+    assert len(positions) == 30
+    counts = index.class_counts(positions)
+    assert counts[CODES.index(213)] >= 5 and counts[CODES.index(311)] >= 25
+    assert len(bigearthnet.sample_class_subset(index, 1000)) == NUM_PATCHES
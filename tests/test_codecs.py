@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the codecs of the output files (see encode_array and decode_array).
+'''
+
+CODECS = ['png', 'webp', 'npy', 'zstd']
+
+def random_bands(num_bands, dtype, high):
+    rng = np.random.default_rng(num_bands)
+    return [rng.integers(0, high, (120, 120)).astype(dtype) for band in range(num_bands)]
+
+@pytest.mark.parametrize('codec', CODECS)
+@pytest.mark.parametrize('compresslevel', [None, 1])
+def test_rgb_images_round_trip(codec, compresslevel):
+    bands = random_bands(3, np.uint8, 256)
+    encoded_bytes = bigearthnet.encode_array(bands, 'uint8', codec, compresslevel)
+    decoded = bigearthnet.decode_array(encoded_bytes, codec)
+    assert decoded.dtype == np.uint8
+    assert np.array_equal(decoded, np.dstack(bands))
+
+@pytest.mark.parametrize('codec', ['png', 'npy', 'zstd'])
+def test_uint16_masks_round_trip(codec):
+    bands = random_bands(1, np.uint16, 65536)
+    decoded = bigearthnet.decode_array(bigearthnet.encode_array(bands, 'uint16', codec), codec)
+    assert decoded.dtype == np.uint16
+    assert np.array_equal(decoded, bands[0])
+
+def test_webp_masks_are_decoded_as_gray_images():
+    bands = random_bands(1, np.uint8, 7)
+    decoded = bigearthnet.decode_array(bigearthnet.encode_array(bands, 'uint8', 'webp'), 'webp')
+    assert decoded.shape == (120, 120, 3)
+    assert all(np.array_equal(decoded[:, :, channel], bands[0]) for channel in range(3))
+    with pytest.raises(ValueError):
+        bigearthnet.encode_array(random_bands(1, np.uint16, 1000), 'uint16', 'webp')
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_float_bands_are_stored_as_the_png_files(codec):
+    bands = [bigearthnet.normalize(band) for band in random_bands(3, np.uint16, 3000)]
+    expected = bigearthnet.decode_array(bigearthnet.encode_array(bands, 'uint8', 'png'), 'png')
+    assert np.array_equal(bigearthnet.decode_array(bigearthnet.encode_array(bands, 'uint8', codec), codec), expected)
+
+@pytest.mark.parametrize('codec', CODECS)
+def test_files_are_named_and_read_by_codec(tmp_path, codec):
+    mask_path = bigearthnet.codec_file_name(str(tmp_path / 'R022_T33UUP_26_57_20170613_mask.png'), codec)
+    assert mask_path.endswith(bigearthnet.CODEC_EXTENSIONS[codec])
+    assert bigearthnet.file_codec(mask_path) == codec
+    assert bigearthnet.read_patch_id(mask_path.split('/')[-1]) == 'R022_T33UUP_26_57_20170613'
+    bands = random_bands(1, np.uint8, 7)
+    bigearthnet.write_png(mask_path, bands, 'uint8')
+    decoded = bigearthnet.read_array_file(mask_path)
+    assert np.array_equal(decoded[..., 0] if codec == 'webp' else decoded, bands[0])
+    with pytest.raises(ValueError):
+        bigearthnet.codec_file_name(mask_path, 'jpeg')
+    with pytest.raises(ValueError):
+        bigearthnet.decode_array(b'', 'jpeg')
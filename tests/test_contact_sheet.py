@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the contact sheets of the images and masks (see contact_sheet and render_contact_sheets).
+'''
+
+def contact_sheet_loop(images, masks, level, columns, step, gap):
+    '''
+    Builds the contact sheet one cell at a time.
+    '''
+    lut = bigearthnet.corine_color_lut(level)
+    height, width = images[0, ::step, ::step].shape[:2]
+    num_rows = -(-len(images) // columns)
+    sheet = np.full((num_rows * (height + gap), columns * (2 * width + 2 * gap), 3), 255, dtype=np.uint8)
+    for patch_index in range(len(images)):
+        row, column = divmod(patch_index, columns)
+        top, left = row * (height + gap), column * (2 * width + 2 * gap)
+        sheet[top:top + height, left:left + width] = images[patch_index, ::step, ::step]
+        sheet[top:top + height, left + width + gap:left + 2 * width + gap] = lut[masks[patch_index, ::step, ::step]]
+    return sheet
+
+@pytest.mark.parametrize('level, columns, step', [('l3', 4, 1), ('l1', 3, 2), ('l1', 16, 3)])
+def test_contact_sheet_is_equal_to_the_loop(level, columns, step):
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (7, 12, 12, 3)).astype(np.uint8)
+    masks = rng.integers(0, bigearthnet.CORINE2018_NUM_CLASSES[level] + 1, (7, 12, 12)).astype(np.uint8)
+    sheet = bigearthnet.contact_sheet(images, masks, level, columns=columns, step=step, gap=2)
+    assert np.array_equal(sheet, contact_sheet_loop(images, masks, level, columns, step, 2))
+    labeled_sheet = bigearthnet.contact_sheet(images, masks, level, columns=columns, step=step, gap=2, 
+                                              labels=['{:d}'.format(index) for index in range(7)])
+    assert labeled_sheet.shape == sheet.shape
+    assert not np.array_equal(labeled_sheet, sheet)
+
+def test_sheets_are_rendered_from_the_png_files(tmp_path):
+    rng = np.random.default_rng(0)
+    image_paths = []
+    mask_paths = []
+    for patch_index in range(5):
+        file_name = bigearthnet.create_png_file_name('R000_T33UAA', '{:02d}_00'.format(patch_index), '20170613')
+        image_paths.append(str(tmp_path / file_name))
+        mask_paths.append(str(tmp_path / (file_name[:-4] + '_l1_mask.png')))
+        bigearthnet.write_png(image_paths[-1], [rng.integers(0, 256, (12, 12)).astype(np.uint8) for band in range(3)], 
+                              'uint8')
+        bigearthnet.write_png(mask_paths[-1], [rng.integers(1, 7, (12, 12)).astype(np.uint8)], 'uint8')
+    sheet_paths = bigearthnet.render_contact_sheets(image_paths, mask_paths[::-1], str(tmp_path / 'sheet'), 'l1', 
+                                                    patches_per_sheet=2, columns=2, num_threads=2)
+    assert [path.split('/')[-1] for path in sheet_paths] == ['sheet_000.png', 'sheet_001.png', 'sheet_002.png']
+    images = np.stack([bigearthnet.read_png(image_path) for image_path in image_paths])
+    masks = np.stack([bigearthnet.read_mask(mask_path) for mask_path in mask_paths])
+    for sheet_index, sheet_path in enumerate(sheet_paths):
+        patches = slice(2 * sheet_index, 2 * sheet_index + 2)
+        expected = bigearthnet.contact_sheet(images[patches], masks[patches], 'l1', columns=2)
+        assert np.array_equal(bigearthnet.read_png(sheet_path), expected)
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the lookup tables of the Corine2018 levels (see corine_remap).
+'''
+
+def remap_loop(mask_array, level):
+    '''
+    Maps the values of a mask one unique value at a time, as the functions
+    replaced by corine_remap, with 0 for the values that are not codes.
+    '''
+    codes = bigearthnet.CORINE2018_L3_CODES
+    target = np.zeros(mask_array.shape, dtype=np.uint8)
+    for value in np.unique(mask_array):
+        if (value not in codes):
+            continue
+        if (level == 'l3'):
+            target[mask_array == value] = codes.index(value) + 1
+        else:
+            target[mask_array == value] = 6 if value == 999 else value // 100
+    return target
+
+@pytest.mark.parametrize('level', ['l3', 'l1'])
+def test_remap_is_equal_to_the_loop(level):
+    rng = np.random.default_rng(0)
+    mask = rng.choice(bigearthnet.CORINE2018_L3_CODES, (3, 120, 120)).astype(np.uint16)
+    mask[0, 0, :4] = [0, 100, 1000, 65535]
+    target = bigearthnet.corine_remap(mask, level)
+    assert target.dtype == np.uint8
+    assert np.array_equal(target, remap_loop(mask, level))
+    assert np.array_equal(target[0, 0, :4], [0, 0, 0, 0])
+
+def test_remap_maps_values_outside_the_table_to_0():
+    mask = np.array([[-1, 111], [70000, 999]], dtype=np.int64)
+    assert np.array_equal(bigearthnet.corine_remap(mask, 'l3'), [[0, 1], [0, 45]])
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+import rasterio
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the confusion matrix of the predicted masks (see ConfusionMatrix and evaluate_predictions).
+'''
+
+TILE = 'S2A_MSIL2A_20170613T101031_N9999_R022_T33UUP'
+TRUE_MASK = np.array([[1, 1, 2], [2, 3, 0]])
+PREDICTED_MASK = np.array([[1, 2, 2], [3, 3, 1]])
+
+def test_confusion_matrix_of_a_hand_computed_case(tmp_path):
+    confusion_matrix = bigearthnet.ConfusionMatrix(3).update(TRUE_MASK, PREDICTED_MASK)
+    assert np.array_equal(confusion_matrix.matrix, [[1, 1, 0], [0, 1, 1], [0, 0, 1]])
+    assert np.allclose(confusion_matrix.iou(), [1 / 2, 1 / 3, 1 / 2])
+    assert confusion_matrix.mean_iou() == pytest.approx(4 / 9)
+    assert np.allclose(confusion_matrix.precision(), [1, 1 / 2, 1 / 2])
+    assert np.allclose(confusion_matrix.recall(), [1 / 2, 1 / 2, 1])
+    assert confusion_matrix.pixel_accuracy() == pytest.approx(3 / 5)
+    report = confusion_matrix.report(['urban', 'agriculture', 'forest'])
+    assert report['classes']['agriculture'] == {'iou': pytest.approx(1 / 3), 'precision': 0.5, 'recall': 0.5, 
+                                                'true_pixels': 2}
+    matrix_path = str(tmp_path / 'confusion_matrix.npz')
+    bigearthnet.save_confusion_matrix(confusion_matrix, matrix_path)
+    assert np.array_equal(bigearthnet.read_confusion_matrix(matrix_path).matrix, confusion_matrix.matrix)
+
+def test_classes_without_pixels_are_nan():
+    confusion_matrix = bigearthnet.ConfusionMatrix(4, first_class=0).update(TRUE_MASK - 1, PREDICTED_MASK - 1)
+    assert np.isnan(confusion_matrix.iou()[3])
+    assert confusion_matrix.mean_iou() == pytest.approx(4 / 9)
+    assert confusion_matrix.report()['classes']['3']['iou'] is None
+
+def test_matrices_of_the_workers_are_added():
+    rng = np.random.default_rng(0)
+    true_masks = rng.integers(0, 7, (8, 120, 120))
+    predicted_masks = rng.integers(1, 7, (8, 120, 120))
+    single = bigearthnet.ConfusionMatrix(6).update(true_masks, predicted_masks)
+    parts = [bigearthnet.ConfusionMatrix(6).update(true_masks[start:start + 3], predicted_masks[start:start + 3])
+             for start in range(0, 8, 3)]
+    assert np.array_equal(sum(parts).matrix, single.matrix)
+    assert single.matrix.sum() == np.count_nonzero(true_masks)
+    with pytest.raises(ValueError):
+        parts[0] + bigearthnet.ConfusionMatrix(45)
+    with pytest.raises(ValueError):
+        bigearthnet.ConfusionMatrix(6).update(true_masks[0], predicted_masks[:2])
+
+@pytest.mark.parametrize('num_workers', [1, 2])
+def test_predictions_are_evaluated_against_the_reference_maps(tmp_path, num_workers):
+    rng = np.random.default_rng(0)
+    reference_paths = []
+    prediction_paths = []
+    expected = bigearthnet.ConfusionMatrix(6)
+    for patch_index in range(5):
+        codes = rng.choice(bigearthnet.CORINE2018_L3_CODES, (20, 20)).astype(np.uint16)
+        predicted = rng.integers(1, 7, (20, 20)).astype(np.uint8)
+        patch = '{:02d}_00'.format(patch_index)
+        reference_paths.append(str(tmp_path / (TILE + '_' + patch + '_reference_map.tif')))
+        prediction_paths.append(str(tmp_path / bigearthnet.create_prediction_file_name('R022_T33UUP', patch, 
+                                                                                        '20170613', 'l1')))
+        for file_path, array in [(reference_paths[-1], codes), (prediction_paths[-1], predicted)]:
+            with rasterio.open(file_path, 'w', driver='GTiff', height=20, width=20, count=1, 
+                               dtype=array.dtype) as dataset:
+                dataset.write(array, 1)
+        if (patch_index < 4):
+            expected.update(bigearthnet.corine_remap(codes, 'l1'), predicted)
+    confusion_matrix, num_patches = bigearthnet.evaluate_predictions(reference_paths, prediction_paths[:4], 'l1',
+                                                                     num_workers=num_workers, chunk_size=3)
+    assert num_patches == 4
+    assert np.array_equal(confusion_matrix.matrix, expected.matrix)
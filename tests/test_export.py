@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import rasterio
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the export of the products of the patches in one pass (see exportPatches).
+'''
+
+TILE = 'S2A_MSIL2A_20170613T101031_N9999_R022_T33UUP'
+PRODUCTS = ['rgb', 'mask', 'l3', 'l1']
+
+def write_tif(tif_path, array):
+    tif_path.parent.mkdir(parents=True, exist_ok=True)
+    with rasterio.open(tif_path, 'w', driver='GTiff', height=array.shape[0], width=array.shape[1], count=1, 
+                       dtype=array.dtype) as dataset:
+        dataset.write(array, 1)
+
+@pytest.fixture
+def dataset(tmp_path):
+    rng = np.random.default_rng(0)
+    for patch_index in range(3):
+        patch_name = '{}_{:02d}_00'.format(TILE, patch_index)
+        for band in ['B02', 'B03', 'B04']:
+            write_tif(tmp_path / 'BigEarthNet-S2' / TILE / patch_name / '{}_{}.tif'.format(patch_name, band),
+                      rng.integers(0, 3000, (120, 120)).astype(np.uint16))
+        if (patch_index < 2):
+            write_tif(tmp_path / 'Reference_Maps' / TILE / patch_name / (patch_name + '_reference_map.tif'),
+                      rng.choice(bigearthnet.CORINE2018_L3_CODES, (120, 120)).astype(np.uint16))
+    return (bigearthnet.list_image_files(tmp_path / 'BigEarthNet-S2', 0, None), 
+            bigearthnet.list_mask_files(tmp_path / 'Reference_Maps', 0, None))
+
+@pytest.mark.parametrize('codec', ['png', 'zstd'])
+def test_export_is_equal_to_the_separate_functions(tmp_path, dataset, codec):
+    tiles_list, tiles_mask_list = dataset
+    target_dirs = {product: str(tmp_path / product) for product in PRODUCTS}
+    for target_dir in target_dirs.values():
+        (tmp_path / target_dir).mkdir()
+    failed_patches = []
+    product_files = bigearthnet.exportPatches(tiles_list, tiles_mask_list, PRODUCTS, target_dirs, 
+                                              failed_patches=failed_patches, codec=codec)
+    assert [patch for patch, error in failed_patches] == [TILE + '_02_00']
+    assert all(len(product_files[product]) == 2 for product in PRODUCTS)
+    for patch_index, bands_list in enumerate(tiles_list[0][:2]):
+        mask_path = tiles_mask_list[0][patch_index][0]
+        expected_path = bigearthnet.codec_file_name(str(tmp_path / 'expected.png'), codec)
+        bigearthnet.createPNG(bands_list, expected_path, overwrite=True)
+        expected = {'rgb': bigearthnet.read_array_file(expected_path)}
+        bigearthnet.createMaskPNG(mask_path, expected_path, overwrite=True)
+        expected['mask'] = bigearthnet.read_array_file(expected_path)
+        for level in ['l3', 'l1']:
+            expected_level_path = str(tmp_path / ('expected_' + level + '.png'))
+            bigearthnet.mapCorine(mask_path, expected_level_path, level, overwrite=True)
+            expected[level] = bigearthnet.read_array_file(expected_level_path)
+        for product in PRODUCTS:
+            assert product_files[product][patch_index].startswith(target_dirs[product] + '/')
+            assert np.array_equal(bigearthnet.read_array_file(product_files[product][patch_index]), expected[product])
+
+def test_existing_files_are_not_read_again(tmp_path, dataset, monkeypatch):
+    tiles_list, tiles_mask_list = dataset
+    tiles_list = [tiles_list[0][:2]]
+    first = bigearthnet.exportPatches(tiles_list, tiles_mask_list, PRODUCTS)
+    def fail(*args, **kwargs):
+        raise AssertionError('The patch shall not be read')
+    monkeypatch.setattr(bigearthnet, 'read_mask', fail)
+    monkeypatch.setattr(bigearthnet, 'read_normalized_bands', fail)
+    assert bigearthnet.exportPatches(tiles_list, tiles_mask_list, PRODUCTS) == first
@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+import types
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the names and of the packages imported by the library.
+'''
+
+LAZY_PACKAGES = ['osgeo', 'PIL', 'skimage', 'tifffile', 'matplotlib', 'tensorflow', 'keras']
+
+def test_import_does_not_load_the_lazy_packages():
+    code = 'import sys; import lib.bigearthnetv2_lib; print(" ".join(sys.modules))'
+    completed = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                               cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    imported_packages = {name.split('.')[0] for name in completed.stdout.split()}
+    assert imported_packages & set(LAZY_PACKAGES) == set()
+
+def test_star_import_exports_the_library_names_only():
+    assert len(bigearthnet.__all__) == len(set(bigearthnet.__all__))
+    for name in bigearthnet.__all__:
+        assert hasattr(bigearthnet, name)
+    for name, value in vars(bigearthnet).items():
+        if (name.startswith('_') or isinstance(value, types.ModuleType)):
+            continue
+        if (getattr(value, '__module__', bigearthnet.__name__) == bigearthnet.__name__):
+            assert name in bigearthnet.__all__
+    namespace = {}
+    exec('from lib.bigearthnetv2_lib import *', namespace)
+    for name in ['io', 'queue', 'struct', 'json', 'sys']:
+        assert name not in namespace
+    assert namespace['np'] is bigearthnet.np
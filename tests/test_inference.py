@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.crs import CRS
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the inference on the patches of the tiles (see predict_tiles).
+'''
+
+TILES = ['S2A_MSIL2A_20170613T101031_N9999_R022_T33UUP', 'S2B_MSIL2A_20170615T102019_N9999_R065_T32UQC']
+NUM_PATCHES = 3
+
+@pytest.fixture
+def dataset(tmp_path):
+    rng = np.random.default_rng(0)
+    root_path = tmp_path / 'BigEarthNet-S2'
+    for tile_index, tile in enumerate(TILES):
+        for patch_index in range(NUM_PATCHES):
+            patch_name = '{}_{:02d}_00'.format(tile, patch_index)
+            (root_path / tile / patch_name).mkdir(parents=True)
+            transform = rasterio.Affine(10, 0, 500000 + 1200 * patch_index, 0, -10, 5000000 - 1200 * tile_index)
+            for band in ['B02', 'B03', 'B04']:
+                with rasterio.open(root_path / tile / patch_name / '{}_{}.tif'.format(patch_name, band), 'w', 
+                                   driver='GTiff', height=120, width=120, count=1, dtype='uint16',
+                                   crs=CRS.from_epsg(32633), transform=transform) as band_dataset:
+                    band_array = rng.integers(0, 500, (120, 120)).astype(np.uint16)
+                    band_array[:, :20 * (patch_index + 1)] += 2500
+                    band_dataset.write(band_array, 1)
+    return root_path
+
+def threshold_model(images):
+    '''
+    NumPy stand-in of a model with 2 classes: 1 where the first band is greater than 127.
+    '''
+    foreground = images[..., 0] > 127
+    return np.stack([~foreground, foreground], axis=-1).astype(np.float32)
+
+@pytest.mark.parametrize('image_size', [(120, 120), (128, 128)])
+def test_predictions_are_written_with_the_georeference_of_the_patches(tmp_path, dataset, image_size):
+    target_dir = str(tmp_path / 'predictions')
+    metrics = bigearthnet.StageMetrics('Inference', print_msg=False)
+    target_paths = bigearthnet.predict_tiles(threshold_model, dataset, 0, None, target_dir, batch_size=4, 
+                                             image_size=image_size, num_threads=2, metrics=metrics)
+    assert metrics.stop().counters['patches'] == len(TILES) * NUM_PATCHES
+    tiles_list = bigearthnet.list_image_files(dataset, 0, None)
+    patches = [patch for patches_list in tiles_list for patch in patches_list]
+    assert len(target_paths) == len(patches)
+    for patch, target_path in zip(patches, target_paths):
+        assert bigearthnet.read_patch_id(target_path.split('/')[-1]) == bigearthnet.read_patch_id(patch[0].name)
+        with rasterio.open(target_path) as prediction:
+            classes = prediction.read(1)
+            assert prediction.tags()['level'] == 'l1'
+            assert prediction.transform == bigearthnet.read_georeference(patch[0])['transform']
+            assert prediction.crs == CRS.from_epsg(32633)
+        assert classes.shape == (120, 120)
+        image = np.dstack(bigearthnet.read_normalized_bands(patch)).astype(np.uint8)
+        expected = (image[..., 0] > 127) + 1
+        if (image_size == (120, 120)):
+            assert np.array_equal(classes, expected)
+        else:
+            assert np.mean(classes == expected) > 0.95
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the journal used to resume an interrupted conversion (see PatchJournal).
+'''
+
+NUM_PATCHES = 3
+
+@pytest.fixture
+def tiles_list(tmp_path):
+    tiles_list = []
+    for tile_name in ['S2A_T33UAA', 'S2A_T33UAB']:
+        patches_list = []
+        for patch_index in range(NUM_PATCHES):
+            patch_path = tmp_path / tile_name / '{}_{:02d}'.format(tile_name, patch_index)
+            patch_path.mkdir(parents=True)
+            band_path = patch_path / 'B02.tif'
+            band_path.write_bytes(b'band')
+            patches_list.append([band_path])
+        tiles_list.append(patches_list)
+    return tiles_list
+
+def run_tasks(tiles_list, journal_path, applied):
+    def task_function(patch_task):
+        tile_index, patch = patch_task
+        applied.append(patch[0].parent.name)
+        return tile_index, patch[0].parent.name + '.png', None
+    metrics = bigearthnet.StageMetrics('Test', print_msg=False)
+    results = bigearthnet.run_patch_tasks(task_function, tiles_list, metrics=metrics, journal_path=journal_path)
+    metrics.stop()
+    return results
+
+def test_resume_skips_the_completed_patches(tmp_path, tiles_list):
+    journal_path = str(tmp_path / 'journal.jsonl')
+    applied = []
+    results = run_tasks(tiles_list, journal_path, applied)
+    assert len(applied) == 2 * NUM_PATCHES
+    journal = bigearthnet.PatchJournal(journal_path)
+    journal.close()
+    assert journal.completed_tiles == {'S2A_T33UAA', 'S2A_T33UAB'}
+
+    ## Interrupted run: the record of the second tile and of its last patch are lost
+    with open(journal_path) as journal_file:
+        lines = journal_file.readlines()
+    with open(journal_path, 'w') as journal_file:
+        journal_file.writelines(line for line in lines if 'S2A_T33UAB' not in line or '_00' in line)
+        journal_file.write('{"patch": "trunc')
+    applied = []
+    assert run_tasks(tiles_list, journal_path, applied) == results
+    assert applied == ['S2A_T33UAB_01', 'S2A_T33UAB_02']
+
+    applied = []
+    assert run_tasks(tiles_list, journal_path, applied) == results
+    assert applied == []
+
+def test_resume_skips_the_completed_mask_folders(tmp_path, monkeypatch):
+    source_folder = tmp_path / 'masks'
+    source_folder.mkdir()
+    target_folder = tmp_path / 'l1'
+    target_folder.mkdir()
+    for patch_index in range(NUM_PATCHES):
+        mask = np.full((4, 4), 111 + 100 * patch_index, dtype=np.uint16)
+        bigearthnet.write_png(str(source_folder / 'S2A_T33UAA_{:02d}_mask.png'.format(patch_index)), [mask], 'uint16')
+    journal_path = str(tmp_path / 'journal.jsonl')
+    target_masks = bigearthnet.mapCorine_list(str(source_folder), str(target_folder) + '/', 'l1', journal_path)
+    assert sorted(target_masks) == [str(target_folder / 'S2A_T33UAA_{:02d}_l1_mask.png'.format(patch_index))
+                                    for patch_index in range(NUM_PATCHES)]
+    for patch_index, target_mask in enumerate(sorted(target_masks)):
+        assert np.all(bigearthnet.read_mask(target_mask) == patch_index + 1)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('The completed folder shall not be read')
+    monkeypatch.setattr(bigearthnet, 'mapCorine', fail)
+    monkeypatch.setattr(bigearthnet, 'source_fingerprint', fail)
+    assert bigearthnet.mapCorine_list(str(source_folder), str(target_folder) + '/', 'l1', journal_path) == target_masks
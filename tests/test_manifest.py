@@ -0,0 +1,46 @@
+import os
+import shutil
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the manifest of the files of the dataset (see build_manifest).
+'''
+
+TILES = ['S2A_MSIL2A_20170613T101031_N9999_R022_T33UUP', 'S2B_MSIL2A_20170615T102019_N9999_R065_T32UQC']
+
+def create_patch(root_path, tile, patch_index):
+    patch_name = '{}_{:02d}_00'.format(tile, patch_index)
+    patch_dir = root_path / tile / patch_name
+    patch_dir.mkdir(parents=True)
+    for band in ['B02', 'B03', 'B04', 'B08']:
+        (patch_dir / '{}_{}.tif'.format(patch_name, band)).write_bytes(b'')
+    return patch_dir
+
+def test_manifest_is_refreshed_incrementally(tmp_path, capsys):
+    root_path = tmp_path / 'BigEarthNet-S2'
+    patch_dirs = [create_patch(root_path, tile, patch_index) for tile in TILES for patch_index in range(3)]
+    manifest_path = str(tmp_path / 'manifest.sqlite')
+    assert bigearthnet.build_manifest(root_path, manifest_path, num_workers=2) == 6 * 4
+    assert 'manifest.sqlite: 6 folders listed' in capsys.readouterr().out
+    assert (bigearthnet.list_image_files(root_path, 0, None, manifest_path) == 
+            bigearthnet.list_image_files(root_path, 0, None))
+
+    ## Only the folders that changed are listed again
+    assert bigearthnet.build_manifest(root_path, manifest_path) == 6 * 4
+    assert 'manifest.sqlite: 0 folders listed' in capsys.readouterr().out
+    shutil.rmtree(patch_dirs[1])
+    (patch_dirs[4] / (patch_dirs[4].name + '_B8A.tif')).write_bytes(b'')
+    os.remove(patch_dirs[5] / (patch_dirs[5].name + '_B02.tif'))
+    create_patch(root_path, TILES[0], 3)
+    assert bigearthnet.build_manifest(root_path, manifest_path) == 6 * 4
+    assert 'manifest.sqlite: 3 folders listed' in capsys.readouterr().out
+    for bands in [('B02', 'B03', 'B04'), bigearthnet.SENTINEL2_BANDS]:
+        assert (bigearthnet.list_image_files(root_path, 0, None, manifest_path, bands=bands) == 
+                bigearthnet.list_image_files(root_path, 0, None, bands=bands))
+    assert bigearthnet.list_tile_names(root_path, manifest_path) == sorted(TILES)
+
+    shutil.rmtree(root_path / TILES[1])
+    assert bigearthnet.build_manifest(root_path, manifest_path) == 3 * 4
+    assert (bigearthnet.list_image_files(root_path, 0, None, manifest_path) == 
+            bigearthnet.list_image_files(root_path, 0, None))
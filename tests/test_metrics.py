@@ -0,0 +1,38 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the counters of the patches of run_patch_tasks (see timed_metric and count_metric).
+'''
+
+def counting_task(patch_task):
+    tile_index, patch = patch_task
+    for value in range(patch):
+        bigearthnet.count_metric('bytes_read', 1)
+    with bigearthnet.timed_metric('read'):
+        pass
+    return tile_index, patch, None
+
+def run_counting_tasks(tiles_list):
+    metrics = bigearthnet.StageMetrics('Test', print_msg=False)
+    results = bigearthnet.run_patch_tasks(counting_task, tiles_list, metrics=metrics)
+    metrics.stop()
+    return results, metrics.counters
+
+def test_counters_of_concurrent_runs_are_not_mixed():
+    tiles_list = [[10000] * 5, [20000] * 5]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        runs = list(executor.map(run_counting_tasks, [tiles_list] * 4))
+    for results, counters in runs:
+        assert results == [10000] * 5 + [20000] * 5
+        assert counters['patches'] == 10
+        assert counters['bytes_read'] == 5 * 10000 + 5 * 20000
+        assert counters['read_seconds'] > 0
+
+def test_counters_outside_a_task_are_not_recorded():
+    bigearthnet.count_metric('bytes_read', 1000)
+    with bigearthnet.timed_metric('read'):
+        pass
+    results, counters = run_counting_tasks([[1]])
+    assert counters['bytes_read'] == 1
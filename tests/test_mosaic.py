@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.crs import CRS
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the mosaics of the patches of a tile (see build_mosaic).
+'''
+
+SIZE = 8
+
+def write_raster(raster_path, array, col, row):
+    with rasterio.open(raster_path, mode='w', driver='GTiff', height=SIZE, width=SIZE, count=1,
+                       dtype=array.dtype, crs=CRS.from_epsg(32633),
+                       transform=rasterio.Affine(10, 0, 500000 + 10 * SIZE * col, 0, -10, 5000000 - 10 * SIZE * row)) as dataset:
+        dataset.write(array, 1)
+    return str(raster_path)
+
+@pytest.fixture
+def reference_maps(tmp_path):
+    rng = np.random.default_rng(0)
+    patches = []
+    ## 3 patches of a 2x2 grid, the patch at the bottom right is missing
+    for col, row in [(0, 0), (1, 0), (0, 1)]:
+        codes = rng.choice(bigearthnet.CORINE2018_L3_CODES, (SIZE, SIZE)).astype(np.uint16)
+        patches.append(write_raster(tmp_path / 'T33UUP_{:d}_{:d}_reference_map.tif'.format(col, row), codes, col, row))
+    return patches
+
+@pytest.mark.parametrize('num_threads', [1, 2])
+def test_mask_mosaic(tmp_path, reference_maps, num_threads):
+    target_path = str(tmp_path / 'mosaic_l1.tif')
+    assert bigearthnet.build_mosaic(reference_maps, target_path, level='l1', 
+                                    num_threads=num_threads) == (2 * SIZE, 2 * SIZE)
+    with rasterio.open(target_path) as mosaic:
+        array = mosaic.read(1)
+        assert mosaic.nodata == 0
+        color_map = mosaic.colormap(1)
+    for patch_path, (col, row) in zip(reference_maps, [(0, 0), (1, 0), (0, 1)]):
+        with rasterio.open(patch_path) as dataset:
+            expected = bigearthnet.corine_remap(dataset.read(1), 'l1')
+        assert np.array_equal(array[row * SIZE:(row + 1) * SIZE, col * SIZE:(col + 1) * SIZE], expected)
+    assert np.all(array[SIZE:, SIZE:] == 0)
+    assert color_map[1] == (230, 0, 77, 255)
+    assert color_map[6] == (255, 255, 255, 255)
+
+def test_rgb_mosaic_has_no_nodata(tmp_path):
+    rng = np.random.default_rng(0)
+    patches = []
+    for col in range(2):
+        patches.append([write_raster(tmp_path / 'T33UUP_{:d}_{}.tif'.format(col, band), 
+                                     rng.integers(0, 3000, (SIZE, SIZE)).astype(np.uint16), col, 0)
+                        for band in ['B04', 'B03', 'B02']])
+    target_path = str(tmp_path / 'mosaic_rgb.tif')
+    assert bigearthnet.build_mosaic(patches, target_path) == (2 * SIZE, SIZE)
+    with rasterio.open(target_path) as mosaic:
+        assert mosaic.count == 3
+        assert mosaic.nodata is None
+        assert np.array_equal(mosaic.read()[:, :, SIZE:], np.stack(bigearthnet.read_normalized_bands(patches[1])).astype(np.uint8))
+
+@pytest.mark.parametrize('level', ['l2', 'ben19'])
+def test_levels_without_colors_are_rejected(tmp_path, reference_maps, level):
+    with pytest.raises(ValueError):
+        bigearthnet.build_mosaic(reference_maps, str(tmp_path / 'mosaic.tif'), level=level)
@@ -0,0 +1,73 @@
+import zipfile
+from zipfile import ZipFile
+
+import numpy as np
+import pytest
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the zip archives of the PNG files (see PNGArchiveWriter and PNGArchiveReader).
+'''
+
+def encoded_masks(first_index, num_masks):
+    rng = np.random.default_rng(first_index)
+    return {'R000_T33UAA_{:02d}_00_20170613_mask.png'.format(mask_index):
+            bigearthnet.encode_png([rng.integers(0, 999, (120, 120)).astype(np.uint16)], 'uint16')
+            for mask_index in range(first_index, first_index + num_masks)}
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_appended_archive_is_valid(tmp_path, compression):
+    zip_path = str(tmp_path / 'masks.zip')
+    first_masks = encoded_masks(0, 5)
+    with bigearthnet.PNGArchiveWriter(zip_path, compression=compression) as writer:
+        for name, data in first_masks.items():
+            assert writer.add(name, data)
+    second_masks = encoded_masks(5, 5)
+    with bigearthnet.PNGArchiveWriter(zip_path, mode='a', compression=compression) as writer:
+        assert not writer.add(next(iter(first_masks)), b'')
+        for name, data in second_masks.items():
+            assert writer.add(name, data)
+    members = {**first_masks, **second_masks}
+    with ZipFile(zip_path, 'r') as zip_file:
+        assert zip_file.testzip() is None
+        assert zip_file.namelist() == list(members)
+        for name, data in members.items():
+            assert zip_file.read(name) == data
+            assert zip_file.getinfo(name).compress_type == compression
+    with bigearthnet.PNGArchiveReader(zip_path) as reader:
+        for position, (name, data) in enumerate(members.items()):
+            assert reader.read_bytes(position) == data
+            assert np.array_equal(reader.read(position), bigearthnet.decode_array(data, 'png'))
+
+def test_reader_serves_the_members_of_a_zip_file(tmp_path):
+    masks = encoded_masks(0, 6)
+    zip_path = str(tmp_path / 'masks.zip')
+    with ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr('README.txt', 'not a mask')
+        zip_file.writestr('other/R000_T33UAA_99_00_20170613_mask.png', b'')
+        for name, data in masks.items():
+            zip_file.writestr('masks/' + name, data)
+    expected = [bigearthnet.decode_array(data, 'png') for data in masks.values()]
+    with bigearthnet.PNGArchiveReader(zip_path, prefix='masks/') as reader:
+        assert len(reader) == len(masks)
+        assert np.array_equal(reader.read_patch('R000_T33UAA_03_00_20170613'), expected[3])
+        positions = [5, 0, 3, 3, 1]
+        for array, position in zip(reader.read_many(positions, num_threads=3), positions):
+            assert np.array_equal(array, expected[position])
+
+def test_reader_detects_corrupted_members(tmp_path):
+    masks = encoded_masks(0, 2)
+    zip_path = str(tmp_path / 'masks.zip')
+    with bigearthnet.PNGArchiveWriter(zip_path) as writer:
+        for name, data in masks.items():
+            writer.add(name, data)
+    with open(zip_path, 'r+b') as zip_file:
+        content = zip_file.read()
+        offset = content.index(masks['R000_T33UAA_01_00_20170613_mask.png'][-100:])
+        zip_file.seek(offset)
+        zip_file.write(bytes(byte ^ 0xFF for byte in content[offset:offset + 4]))
+    with bigearthnet.PNGArchiveReader(zip_path) as reader:
+        reader.read(0)
+        with pytest.raises(zipfile.BadZipFile):
+            reader.read_bytes(1)
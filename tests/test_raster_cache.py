@@ -0,0 +1,87 @@
+import multiprocessing
+import os
+
+import numpy as np
+import pytest
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the cache of the decoded rasters (see RasterCache). They can be executed
+from the root folder of the dl_remote_sensing project repository with the command
+
+>python -m pytest tests
+'''
+
+NUM_MASKS = 24
+
+@pytest.fixture
+def mask_paths(tmp_path):
+    rng = np.random.default_rng(0)
+    paths = []
+    for mask_index in range(NUM_MASKS):
+        mask_path = str(tmp_path / 'R000_T33UAA_{:02d}_00_20170613_mask.png'.format(mask_index))
+        bigearthnet.write_png(mask_path, [rng.integers(0, 999, (120, 120)).astype(np.uint16)], 'uint16')
+        paths.append(mask_path)
+    return paths
+
+def shared_segments(shared_name):
+    return [file_name for file_name in os.listdir('/dev/shm') if file_name.startswith(shared_name + '_')]
+
+def read_masks(mask_paths):
+    arrays = [bigearthnet.read_mask(mask_path) for mask_path in mask_paths]
+    return [int(array.sum(dtype=np.int64)) for array in arrays], bigearthnet.raster_cache().stats()
+
+def test_cache_evicts_least_recently_used(mask_paths):
+    cache = bigearthnet.enable_raster_cache(max_bytes=3 * 120 * 120 * 2)
+    try:
+        for mask_path in mask_paths[:4]:
+            bigearthnet.read_mask(mask_path)
+        bigearthnet.read_mask(mask_paths[3])
+        stats = cache.stats()
+        assert stats['misses'] == 4
+        assert stats['hits'] == 1
+        assert stats['evictions'] == 1
+        assert stats['entries'] == 3
+        with pytest.raises(ValueError):
+            bigearthnet.read_mask(mask_paths[3])[0, 0] = 0
+    finally:
+        bigearthnet.disable_raster_cache()
+
+def test_cache_reads_a_changed_file_again(mask_paths):
+    cache = bigearthnet.enable_raster_cache()
+    try:
+        bigearthnet.read_mask(mask_paths[0])
+        bigearthnet.write_png(mask_paths[0], [np.ones((120, 120), dtype=np.uint16)], 'uint16')
+        assert bigearthnet.read_mask(mask_paths[0]).sum() == 120 * 120
+        assert cache.stats()['misses'] == 2
+    finally:
+        bigearthnet.disable_raster_cache()
+
+@pytest.mark.skipif(not os.path.isdir('/dev/shm') or 'fork' not in multiprocessing.get_all_start_methods(),
+                    reason='the shared memory backend is shared with the fork start method')
+def test_shared_cache_with_concurrent_workers(mask_paths):
+    '''
+    Four workers read the same masks at the same time, so that a worker often opens
+    a segment that another worker is creating. No read shall fail and every worker
+    shall get the same arrays as without the cache. The workers of a second pool 
+    then find all the masks in shared memory.
+    '''
+    expected_sums = [int(bigearthnet.read_mask(mask_path).sum(dtype=np.int64)) for mask_path in mask_paths]
+    context = multiprocessing.get_context('fork')
+    for run in range(10):
+        shared_name = 'test_cache_{:d}_{:d}'.format(os.getpid(), run)
+        bigearthnet.enable_raster_cache(shared_name=shared_name)
+        try:
+            with context.Pool(4) as pool:
+                results = pool.map(read_masks, [mask_paths] * 4, chunksize=1)
+            with context.Pool(2) as pool:
+                shared_results = pool.map(read_masks, [mask_paths] * 2, chunksize=1)
+        finally:
+            bigearthnet.disable_raster_cache()
+        for sums, stats in results + shared_results:
+            assert sums == expected_sums
+        for sums, stats in shared_results:
+            assert stats['misses'] == 0
+            assert stats['shared_hits'] >= NUM_MASKS
+        assert shared_segments(shared_name) == []
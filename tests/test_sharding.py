@@ -0,0 +1,83 @@
+import argparse
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from zipfile import ZipFile
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the sharded runs and of the merge of their outputs (see shard_tile_names, 
+select_shard, merge_archives and merge_class_statistics).
+'''
+
+TILES = ['S2A_MSIL2A_20170613T101031_N9999_R022_T33UUP', 'S2A_MSIL2A_20170613T101031_N9999_R022_T32UQC',
+         'S2B_MSIL2A_20170615T102019_N9999_R065_T33UUP', 'S2A_MSIL2A_20171002T094031_N9999_R036_T35VNK',
+         'S2B_MSIL2A_20180204T100159_N9999_R122_T34VER']
+
+@pytest.mark.parametrize('method', ['sorted', 'hash'])
+def test_shards_partition_the_tiles(method):
+    shards = [bigearthnet.shard_tile_names(TILES, shard_index, 3, method) for shard_index in range(3)]
+    assert sorted(tile for shard in shards for tile in shard) == sorted(TILES)
+    assert shards == [bigearthnet.shard_tile_names(reversed(TILES), shard_index, 3, method) for shard_index in range(3)]
+    if (method == 'hash'):
+        new_tile = 'S2A_MSIL2A_20180301T094031_N9999_R036_T35VNL'
+        for shard_index, shard in enumerate(shards):
+            assert set(shard) <= set(bigearthnet.shard_tile_names(TILES + [new_tile], shard_index, 3, method))
+    with pytest.raises(ValueError):
+        bigearthnet.shard_tile_names(TILES, 3, 3)
+
+@pytest.fixture
+def reference_maps(tmp_path):
+    rng = np.random.default_rng(0)
+    root_path = tmp_path / 'Reference_Maps'
+    for tile in TILES:
+        for patch_index in range(2):
+            patch_name = '{}_{:02d}_00'.format(tile, patch_index)
+            (root_path / tile / patch_name).mkdir(parents=True)
+            with rasterio.open(root_path / tile / patch_name / (patch_name + '_reference_map.tif'), 'w', 
+                               driver='GTiff', height=20, width=20, count=1, dtype='uint16') as dataset:
+                dataset.write(rng.choice(bigearthnet.CORINE2018_L3_CODES[:10], (20, 20)).astype(np.uint16), 1)
+    return root_path
+
+def mask_png_names(tiles_list):
+    png_names = []
+    for patches_list in tiles_list:
+        for mask_list in patches_list:
+            tile, patch, date = bigearthnet.read_mask_name(mask_list[0].name)
+            png_names.append(bigearthnet.create_mask_png_file_name(tile, patch, date))
+    return png_names
+
+def test_merge_of_the_shards_is_equal_to_a_single_run(tmp_path, reference_maps):
+    parser = argparse.ArgumentParser()
+    bigearthnet.add_shard_arguments(parser)
+    single_names = mask_png_names(bigearthnet.list_mask_files(reference_maps, 0, None))
+    single_statistics = bigearthnet.collect_class_statistics(reference_maps, 0, None)
+    shard_zip_files = []
+    shard_statistics = []
+    shard_tiles = []
+    for shard_index in range(3):
+        args = parser.parse_args(['--shard', str(shard_index), '--num-shards', '3', '--shard-method', 'hash',
+                                  '--output-dir', str(tmp_path / 'data')])
+        tile_names, output_dir = bigearthnet.select_shard(args, bigearthnet.list_tile_names(reference_maps))
+        assert output_dir == os.path.join(str(tmp_path / 'data'), 'shard_{:03d}_of_003'.format(shard_index))
+        assert bigearthnet.read_shard_info(os.path.join(output_dir, 'shard.json'))['tiles'] == tile_names
+        shard_tiles.extend(tile_names)
+        zip_file = os.path.join(output_dir, 'masks.zip')
+        with bigearthnet.PNGArchiveWriter(zip_file) as writer:
+            for png_name in mask_png_names(bigearthnet.list_mask_files(reference_maps, 0, None, tile_names=tile_names)):
+                writer.add(png_name, png_name.encode())
+        shard_zip_files.append(zip_file)
+        shard_statistics.append(bigearthnet.collect_class_statistics(reference_maps, 0, None, tile_names=tile_names))
+
+    order_key = bigearthnet.tile_order_key(shard_tiles)
+    merged_names = bigearthnet.merge_archives(shard_zip_files[::-1], str(tmp_path / 'masks.zip'), sort_key=order_key)
+    assert merged_names == single_names
+    with ZipFile(str(tmp_path / 'masks.zip')) as zip_file:
+        assert zip_file.namelist() == single_names
+    merged_statistics = bigearthnet.merge_class_statistics(shard_statistics)
+    for key in ['image_counts', 'pixel_counts', 'class_weights']:
+        assert np.array_equal(merged_statistics[key], single_statistics[key])
+    assert merged_statistics['num_masks'] == single_statistics['num_masks'] == 2 * len(TILES)
@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the packed shards of the images and masks (see write_shards and ShardReader).
+'''
+
+NUM_PATCHES = 7
+
+@pytest.fixture
+def patch_files(tmp_path):
+    rng = np.random.default_rng(0)
+    image_paths = []
+    mask_paths = []
+    for patch_index in range(NUM_PATCHES):
+        file_name = bigearthnet.create_png_file_name('R000_T33UAA', '{:02d}_00'.format(patch_index), '20170613')
+        image_path = str(tmp_path / file_name)
+        mask_path = str(tmp_path / (file_name[:-4] + '_mask.png'))
+        bigearthnet.write_png(image_path, [rng.integers(0, 256, (120, 120)).astype(np.uint8) for band in range(3)], 
+                              'uint8')
+        bigearthnet.write_png(mask_path, [rng.integers(1, 7, (120, 120)).astype(np.uint8)], 'uint8')
+        image_paths.append(image_path)
+        mask_paths.append(mask_path)
+    return image_paths, mask_paths
+
+def test_shards_return_the_patches(tmp_path, patch_files):
+    image_paths, mask_paths = patch_files
+    shards_dir = str(tmp_path / 'shards')
+    assert bigearthnet.write_shards(image_paths, mask_paths, shards_dir, shard_size=3) == 3
+    reader = bigearthnet.ShardReader(shards_dir)
+    assert len(reader) == NUM_PATCHES
+    images = [bigearthnet.read_png(image_path) for image_path in image_paths]
+    masks = [bigearthnet.read_mask(mask_path) for mask_path in mask_paths]
+    for position in range(NUM_PATCHES):
+        image, mask = reader.get(position)
+        assert np.array_equal(image, images[position])
+        assert np.array_equal(mask, masks[position])
+    image, mask = reader.get_patch('R000_T33UAA_04_00_20170613')
+    assert np.array_equal(image, images[4])
+
+    ## a batch within a shard is a view of the shard, across shards a copy
+    batch_images, batch_masks = reader.get_batch(3, 6)
+    assert np.shares_memory(batch_images, reader.images[1])
+    assert np.array_equal(batch_images, np.stack(images[3:6]))
+    batch_images, batch_masks = reader.get_batch(2, 10)
+    assert np.array_equal(batch_images, np.stack(images[2:]))
+    assert np.array_equal(batch_masks, np.stack(masks[2:]))
+    batch_images, batch_masks = reader.take([6, 0, 3])
+    assert np.array_equal(batch_masks, np.stack([masks[6], masks[0], masks[3]]))
+
+def test_masks_of_other_patches_are_rejected(tmp_path, patch_files):
+    image_paths, mask_paths = patch_files
+    with pytest.raises(ValueError):
+        bigearthnet.write_shards(image_paths, mask_paths[1:] + mask_paths[:1], str(tmp_path / 'shards'))
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the train, val and test splits of the patches (see split_patches).
+'''
+
+TILES = ['R022_T33UUP', 'R065_T32UQC', 'R036_T35VNK', 'R122_T34VER', 'R051_T29SNC', 'R008_T31TCJ']
+
+def patch_ids(num_patches_per_tile=20):
+    return ['{}_{:02d}_00_20170613'.format(tile, patch_index) 
+            for tile in TILES for patch_index in range(num_patches_per_tile)]
+
+def as_lists(splits):
+    return {split_name: list(split) for split_name, split in splits.items()}
+
+@pytest.mark.parametrize('num_items', [0, 1, 7, 10, 999])
+def test_split_sizes_sum_to_the_items(num_items):
+    sizes = bigearthnet.split_sizes(num_items, [0.7, 0.2, 0.1])
+    assert sizes.sum() == num_items
+    assert np.all(np.abs(sizes - np.array([0.7, 0.2, 0.1]) * num_items) < 1)
+    assert list(bigearthnet.split_sizes(10, [7, 2, 1])) == [7, 2, 1]
+    assert list(bigearthnet.split_sizes(2, [1, 1, 1])) == [1, 1, 0]
+
+@pytest.mark.parametrize('group_by_tile', [False, True])
+def test_splits_do_not_leak(tmp_path, group_by_tile):
+    ids = patch_ids()
+    splits = bigearthnet.split_patches(ids[::-1], seed=3, group_by_tile=group_by_tile)
+    assert list(splits) == ['train', 'val', 'test']
+    assert sorted(patch_id for split in splits.values() for patch_id in split) == sorted(ids)
+    assert as_lists(bigearthnet.split_patches(ids, seed=3, group_by_tile=group_by_tile)) == as_lists(splits)
+    if (group_by_tile):
+        split_tiles = [{patch_id[:11] for patch_id in split} for split in splits.values()]
+        assert sum(len(tiles) for tiles in split_tiles) == len(TILES)
+    else:
+        assert [len(split) for split in splits.values()] == [84, 24, 12]
+    split_path = str(tmp_path / 'split.csv')
+    bigearthnet.save_split(splits, split_path)
+    assert bigearthnet.read_split(split_path) == as_lists(splits)
+
+def test_stratified_split_keeps_the_fractions_of_a_rare_class():
+    ids = patch_ids()
+    pixel_counts = np.zeros((len(ids), 45), dtype=np.int64)
+    pixel_counts[:, 10] = 1
+    pixel_counts[::6, 20] = 1
+    index = bigearthnet.ClassPresenceIndex(ids, bigearthnet.class_presence_bits(pixel_counts), 
+                                           np.zeros(pixel_counts.shape, dtype=np.float16))
+    splits = bigearthnet.split_patches(ids, fractions={'train': 0.5, 'val': 0.3, 'test': 0.2}, class_index=index)
+    rare = set(np.array(ids)[::6])
+    assert [len(rare.intersection(split)) for split in splits.values()] == [10, 6, 4]
+    assert [len(split) for split in splits.values()] == [60, 36, 24]
+    with pytest.raises(ValueError):
+        bigearthnet.split_patches(ids, group_by_tile=True, class_index=index)
+
+def test_split_file_paths_pair_images_and_masks():
+    ids = patch_ids(2)
+    image_paths = ['images/{}.png'.format(patch_id) for patch_id in ids]
+    mask_paths = ['masks/{}_mask.png'.format(patch_id) for patch_id in ids[1:]]
+    mask_paths.append('masks/R000_T00AAA_00_00_20170613_mask.png')
+    pairs, unpaired_images, unpaired_masks = bigearthnet.pair_patch_files(image_paths[::-1], mask_paths)
+    assert unpaired_images == [image_paths[0]]
+    assert unpaired_masks == ['masks/R000_T00AAA_00_00_20170613_mask.png']
+    images, masks = bigearthnet.split_file_paths([ids[3], ids[1]], pairs)
+    assert images == [image_paths[3], image_paths[1]]
+    assert masks == [mask_paths[2], mask_paths[0]]
+    with pytest.raises(KeyError):
+        bigearthnet.split_file_paths([ids[0]], pairs)
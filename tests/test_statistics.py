@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import rasterio
+
+import lib.bigearthnetv2_lib as bigearthnet
+
+'''
+Tests of the class statistics of the reference maps (see collect_class_statistics).
+'''
+
+TILE = 'S2A_MSIL2A_20170613T101031_N9999_R022_T33UUP'
+
+def create_reference_maps(root_path, num_patches):
+    '''
+    Creates the reference maps of the patches of one tile with the Corine2018
+    code 111 in the first row and 211 in the other pixels.
+    '''
+    mask = np.full((120, 120), 211, dtype=np.uint16)
+    mask[0] = 111
+    mask_paths = []
+    for patch_index in range(num_patches):
+        patch_name = '{}_{:02d}_00'.format(TILE, patch_index)
+        patch_dir = root_path / TILE / patch_name
+        patch_dir.mkdir(parents=True)
+        mask_path = patch_dir / (patch_name + '_reference_map.tif')
+        with rasterio.open(mask_path, 'w', driver='GTiff', height=120, width=120, count=1, dtype='uint16') as dataset:
+            dataset.write(mask, 1)
+        mask_paths.append(mask_path)
+    return mask_paths
+
+def test_patches_without_reference_map_are_skipped(tmp_path):
+    mask_paths = create_reference_maps(tmp_path, 4)
+    os.remove(mask_paths[1])
+    statistics = bigearthnet.collect_class_statistics(tmp_path, 0, None)
+    assert statistics['num_masks'] == 3
+    assert statistics['missing_masks'] == 1
+    assert statistics['pixel_counts'].dtype == np.int64
+    assert statistics['pixel_counts'].sum() == 3 * 120 * 120
+
+def test_partials_are_reused_only_for_the_same_masks(tmp_path):
+    mask_paths = create_reference_maps(tmp_path / 'Reference_Maps', 3)
+    partials_dir = str(tmp_path / 'partials')
+    partial_path = os.path.join(partials_dir, TILE + '.npz')
+    first = bigearthnet.collect_class_statistics(tmp_path / 'Reference_Maps', 0, None, partials_dir=partials_dir)
+    partial_mtime = os.stat(partial_path).st_mtime_ns
+    second = bigearthnet.collect_class_statistics(tmp_path / 'Reference_Maps', 0, None, partials_dir=partials_dir)
+    assert os.stat(partial_path).st_mtime_ns == partial_mtime
+    assert np.array_equal(first['pixel_counts'], second['pixel_counts'])
+
+    # a partial of an older run, e.g. of other masks, is computed again
+    bigearthnet.save_tile_statistics(partial_path, np.array(['old'], dtype=str), np.ones((1, 45), dtype=np.uint16))
+    third = bigearthnet.collect_class_statistics(tmp_path / 'Reference_Maps', 0, None, partials_dir=partials_dir)
+    assert np.array_equal(first['pixel_counts'], third['pixel_counts'])
+
+    # a mask that changes after the partial was saved is read again
+    os.remove(mask_paths[2])
+    fourth = bigearthnet.collect_class_statistics(tmp_path / 'Reference_Maps', 0, None, partials_dir=partials_dir)
+    assert fourth['num_masks'] == 2
+    assert fourth['missing_masks'] == 1
+    patch_ids, pixel_counts = bigearthnet.read_tile_statistics(partial_path)
+    assert len(patch_ids) == 2
+    assert [name for name in os.listdir(partials_dir) if name.endswith('.tmp')] == []